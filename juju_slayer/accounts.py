@@ -0,0 +1,253 @@
+"""
+Orders sharded across several SoftLayer accounts.
+
+One account's api rate limit and order quota cap how fast a batch can be
+provisioned. Given credential profiles of further accounts, ie.
+sub-accounts or api users, orders are spread across all of them, each
+held to its own rate limit and quota.
+"""
+import logging
+import threading
+import time
+
+from SoftLayer.exceptions import SoftLayerAPIError
+
+from juju_slayer.constraints import VIRTUAL
+from juju_slayer.exceptions import ConfigError, ProviderError
+from juju_slayer.transport import TransportClient
+
+log = logging.getLogger("juju.slayer")
+
+# Order params naming resources of the primary account.
+PRIMARY_PARAMS = ('public_vlan', 'private_vlan')
+
+NOT_FOUND = 'SoftLayer_Exception_ObjectNotFound'
+
+
+class RateLimiter(object):
+    """Token bucket spacing calls to a rate per second.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(self.rate))
+        self.tokens = float(self.burst)
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            delay = max(0, (1 - self.tokens) / self.rate)
+            # Taken ahead of the wait, so later callers queue behind us.
+            self.tokens -= 1
+        if delay:
+            time.sleep(delay)
+
+
+class LimitedClient(TransportClient):
+    """Api client held to its account's rate limit.
+    """
+
+    def __init__(self, limiter, transport, **kw):
+        self.limiter = limiter
+        super(LimitedClient, self).__init__(transport, **kw)
+
+    def call(self, service, method, *args, **kw):
+        self.limiter.wait()
+        return super(LimitedClient, self).call(service, method, *args, **kw)
+
+
+class AccountPool(object):
+    """Provider sharding orders across accounts.
+
+    Orders go to the account with the fewest in flight that is under its
+    quota, calls on an instance go to the account owning it. Account
+    wide resources like the ordering catalog are the primary's.
+    """
+
+    def __init__(self, accounts):
+        self.accounts = accounts
+        self.primary = accounts[0]
+        self.cond = threading.Condition()
+        # Hostnames of orders in flight to the account placing them.
+        self.inflight = {}
+        # (kind, id) of instances, and ids of images, to their account.
+        self.owners = {}
+        self.image_owners = {}
+
+    @property
+    def config(self):
+        return self.primary.config
+
+    def close(self):
+        for account in self.accounts:
+            account.close()
+
+    def assign(self, params):
+        """Pick the account for an order, waiting while all are at quota.
+        """
+        candidates = self.accounts
+        if any(k in params for k in PRIMARY_PARAMS):
+            candidates = [self.primary]
+        elif 'image_id' in params:
+            candidates = [self._image_owner(params['image_id'])]
+        with self.cond:
+            while True:
+                load = dict((a.name, 0) for a in candidates)
+                for name in self.inflight.values():
+                    if name in load:
+                        load[name] += 1
+                free = [a for a in candidates
+                        if a.orders is None or load[a.name] < a.orders]
+                if free:
+                    account = min(free, key=lambda a: load[a.name])
+                    self.inflight[params['hostname']] = account.name
+                    return account
+                log.debug("Accounts at their order quota, waiting to order "
+                          "%s", params['hostname'])
+                self.cond.wait()
+
+    def release(self, hostname):
+        with self.cond:
+            if self.inflight.pop(hostname, None) is not None:
+                self.cond.notify_all()
+
+    def _own(self, account, instance):
+        instance['account'] = account.name
+        self.owners[(instance.kind, instance.id)] = account
+        return instance
+
+    def _owner(self, instance_id, kind=VIRTUAL):
+        if (kind, instance_id) not in self.owners:
+            self.get_instance(instance_id, kind)
+        return self.owners[(kind, instance_id)]
+
+    def _image_owner(self, global_id):
+        if global_id not in self.image_owners:
+            self.get_images()
+        # Public images are orderable from any account.
+        return self.image_owners.get(global_id, self.primary)
+
+    def _translate_keys(self, account, key_ids):
+        """Map ssh key ids of the primary to the account's keys of the same
+        name.
+        """
+        if not key_ids or account is self.primary:
+            return key_ids
+        names = dict((k.id, k.name) for k in self.primary.get_ssh_keys())
+        ids = dict((k.name, k.id) for k in account.get_ssh_keys())
+        missing = [names.get(i, i) for i in key_ids if names.get(i) not in ids]
+        if missing:
+            raise ConfigError("SSH keys %s must be uploaded to account %s" % (
+                ", ".join(map(str, missing)), account.name))
+        return [ids[names[i]] for i in key_ids]
+
+    def get_ssh_keys(self):
+        return self.primary.get_ssh_keys()
+
+    def get_instances(self, **filters):
+        instances = []
+        for account in self.accounts:
+            instances.extend(self._own(account, i)
+                             for i in account.get_instances(**filters))
+        return instances
+
+    def get_instance(self, instance_id, kind=VIRTUAL):
+        account = self.owners.get((kind, instance_id))
+        if account is not None:
+            return self._own(
+                account, account.get_instance(instance_id, kind))
+        # Not seen by this invocation, ie. resumed or recycled.
+        for account in self.accounts:
+            try:
+                return self._own(
+                    account, account.get_instance(instance_id, kind))
+            except SoftLayerAPIError, e:
+                if e.faultCode != NOT_FOUND:
+                    raise
+        raise ProviderError(
+            "Instance %s not found on any account" % instance_id)
+
+    def launch_instance(self, params):
+        account = self.assign(params)
+        params = dict(params)
+        if 'ssh_keys' in params:
+            params['ssh_keys'] = self._translate_keys(
+                account, params['ssh_keys'])
+        log.debug("Ordering %s on account %s", params['hostname'],
+                  account.name)
+        try:
+            instance = account.launch_instance(params)
+        except:
+            self.release(params['hostname'])
+            raise
+        if instance is not None:
+            self._own(account, instance)
+        return instance
+
+    def find_hardware(self, hostname, domain, limit=60, delay=10):
+        with self.cond:
+            name = self.inflight.get(hostname)
+        accounts = [a for a in self.accounts if a.name == name]
+        if not accounts:
+            # A resumed order, look on every account.
+            accounts = self.accounts
+        for count in range(limit + 1):
+            for account in accounts:
+                hardware = account.lookup_hardware(hostname, domain)
+                if hardware is not None:
+                    return self._own(account, hardware)
+            time.sleep(delay)
+        raise ProviderError(
+            "Bare metal order %s not allocated before timeout" % hostname)
+
+    def wait_on(self, instance, limit=None):
+        # The order is through once provisioned, either way.
+        try:
+            return self._owner(instance.id, instance.kind).wait_on(
+                instance, limit)
+        finally:
+            self.release(instance.name)
+
+    def reload_instance(self, instance_id, ssh_keys=None, kind=VIRTUAL):
+        account = self._owner(instance_id, kind)
+        account.reload_instance(
+            instance_id, ssh_keys=self._translate_keys(account, ssh_keys),
+            kind=kind)
+
+    def tag_instance(self, instance_id, tags, kind=VIRTUAL):
+        self._owner(instance_id, kind).tag_instance(instance_id, tags, kind)
+
+    def terminate_instance(self, instance_id, kind=VIRTUAL):
+        self._owner(instance_id, kind).terminate_instance(instance_id, kind)
+
+    def capture_instance(self, instance_id, name, note=""):
+        return self._owner(instance_id).capture_instance(
+            instance_id, name, note)
+
+    def get_create_options(self):
+        return self.primary.get_create_options()
+
+    def get_bare_metal_options(self):
+        return self.primary.get_bare_metal_options()
+
+    def get_vlans(self):
+        return self.primary.get_vlans()
+
+    def get_images(self):
+        images = []
+        for account in self.accounts:
+            for image in account.get_images():
+                self.image_owners[image.id] = account
+                self.image_owners[image.global_id] = account
+                images.append(image)
+        return images
+
+    def delete_image(self, image_id):
+        if image_id not in self.image_owners:
+            self.get_images()
+        self.image_owners.get(image_id, self.primary).delete_image(image_id)
@@ -0,0 +1,198 @@
+"""
+Load driven scaling of machine profiles.
+
+A policy file names profiles of machines, each with its constraints, the
+range of machines it may scale between and the load thresholds that
+scale it. The autoscale command samples load on each profile's machines
+and adds or removes machines through the add-machine and
+terminate-machine code paths.
+
+Policies are yaml, ie.::
+
+  profiles:
+    web:
+      constraints: "mem=2G, region=dal05"
+      min: 2
+      max: 10
+      scale-up: 0.8
+      scale-down: 0.3
+
+A machine's load is the greater of its 1 minute load average per core
+and the fraction of its memory in use. A profile scales up once its mean
+load has been above scale-up for up-periods samples in a row, and down
+once it's been below scale-down for down-periods samples. After scaling,
+a profile is left alone for its cooldown, as it is after failing to add
+the machines it needs to reach its min.
+"""
+import json
+import logging
+import os
+import tempfile
+import yaml
+
+from juju_slayer.exceptions import ConfigError
+from juju_slayer.lock import FileLock
+from juju_slayer import ssh
+
+log = logging.getLogger("juju.slayer")
+
+# Prints the load average, core count and memory statistics.
+LOAD_COMMAND = "cat /proc/loadavg; nproc; cat /proc/meminfo"
+
+PROFILE_DEFAULTS = {
+    'constraints': "",
+    'series': "precise",
+    'min': 0,
+    'step': 1,
+    'scale-up': 0.8,
+    'scale-down': 0.3,
+    'up-periods': 2,
+    'down-periods': 3,
+    'cooldown': 300,
+    # Only remove machines without service units.
+    'idle-only': True,
+    'recycle': False,
+}
+
+
+def sample(host):
+    """Return the load of the host, or None if it couldn't be sampled.
+
+    Hosts that can't be reached or want a password fail fast, rather
+    than holding up the profiles' other samples.
+    """
+    try:
+        status, output = ssh.execute(host, LOAD_COMMAND)
+        if status != 0:
+            log.warning("Could not sample load on %s\n%s", host, output)
+            return None
+        return parse_load(output)
+    except Exception:
+        log.warning("Could not sample load on %s", host, exc_info=True)
+        return None
+
+
+def parse_load(output):
+    lines = output.splitlines()
+    loadavg = float(lines[0].split()[0])
+    cores = int(lines[1])
+    meminfo = {}
+    for line in lines[2:]:
+        parts = line.replace(':', ' ').split()
+        if len(parts) >= 2 and parts[1].isdigit():
+            meminfo[parts[0]] = int(parts[1])
+    available = meminfo.get('MemAvailable')
+    if available is None:
+        # Kernels before 3.14 don't estimate it.
+        available = sum(meminfo.get(k, 0)
+                        for k in ('MemFree', 'Buffers', 'Cached'))
+    memory = 1 - float(available) / meminfo['MemTotal']
+    return max(loadavg / max(cores, 1), memory)
+
+
+class Profile(object):
+
+    def __init__(self, name, settings):
+        self.name = name
+        unknown = set(settings) - set(PROFILE_DEFAULTS) - set(['max'])
+        if unknown:
+            raise ConfigError("Unknown autoscale settings for %s: %s" % (
+                name, ", ".join(sorted(unknown))))
+        if 'max' not in settings:
+            raise ConfigError("Autoscale profile %s needs a max" % name)
+        conf = dict(PROFILE_DEFAULTS)
+        conf.update(settings)
+        self.constraints = conf['constraints']
+        self.series = conf['series']
+        self.min = conf['min']
+        self.max = conf['max']
+        self.step = conf['step']
+        self.scale_up = conf['scale-up']
+        self.scale_down = conf['scale-down']
+        self.up_periods = conf['up-periods']
+        self.down_periods = conf['down-periods']
+        self.cooldown = conf['cooldown']
+        self.idle_only = conf['idle-only']
+        self.recycle = conf['recycle']
+        if not 0 <= self.min <= self.max:
+            raise ConfigError(
+                "Autoscale profile %s needs 0 <= min <= max" % name)
+        if self.scale_down >= self.scale_up:
+            raise ConfigError(
+                "Autoscale profile %s needs scale-down below scale-up" % name)
+
+    def decide(self, machines, loads, record, now):
+        """Return how many machines to add, negative to remove.
+
+        The profile's record of consecutive samples above and below its
+        thresholds is updated.
+        """
+        count = len(machines)
+        if count < self.min:
+            # Failed scale ups aren't retried until the cooldown passes.
+            if now - record.get('failed', 0) < self.cooldown:
+                return 0
+            return self.min - count
+        if count > self.max:
+            return self.max - count
+        sampled = [loads[m] for m in machines if loads.get(m) is not None]
+        if not sampled:
+            return 0
+        load = sum(sampled) / len(sampled)
+        record['load'] = load
+        if load > self.scale_up:
+            record['up'] = record.get('up', 0) + 1
+            record['down'] = 0
+        elif load < self.scale_down:
+            record['down'] = record.get('down', 0) + 1
+            record['up'] = 0
+        else:
+            record['up'] = record['down'] = 0
+        if now - record.get('scaled', 0) < self.cooldown:
+            return 0
+        if record['up'] >= self.up_periods:
+            return min(self.step, self.max - count)
+        if record['down'] >= self.down_periods:
+            return -min(self.step, count - self.min)
+        return 0
+
+
+def load_policy(path):
+    """Return the profiles of a policy file in name order.
+    """
+    if not os.path.exists(path):
+        raise ConfigError("Autoscale policy %s not found" % path)
+    with open(path) as fh:
+        data = yaml.safe_load(fh.read()) or {}
+    profiles = data.get('profiles')
+    if not profiles or not isinstance(profiles, dict):
+        raise ConfigError("Autoscale policy %s has no profiles" % path)
+    return [Profile(name, profiles[name] or {}) for name in sorted(profiles)]
+
+
+class ScaleState(object):
+    """Machines each profile scaled up, with its sampling history.
+
+    Persisted, so a restarted or periodically run autoscaler keeps its
+    cooldowns and only ever removes machines it added.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = self.path + ".lock"
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as fh:
+            return json.load(fh)
+
+    def save(self, data):
+        parent = os.path.dirname(self.path)
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        with FileLock(self.lock_path):
+            fd, tmp_path = tempfile.mkstemp(dir=parent)
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(data, fh)
+            os.rename(tmp_path, self.path)
@@ -0,0 +1,171 @@
+"""
+Record and replay of a session's external interactions.
+
+Recording captures every SoftLayer api call, juju command and ssh
+invocation with its timing into a cassette. Replaying serves them back
+from the cassette while the plugin's own code runs for real, so a
+production session can be rerun offline as a benchmark or test.
+"""
+import json
+import logging
+import subprocess
+import threading
+import time
+
+from juju_slayer.exceptions import CassetteError
+
+log = logging.getLogger("juju.slayer")
+
+# The unpatched sleep, replay compresses the plugin's own sleeps.
+_sleep = time.sleep
+
+# Functions in juju_slayer.ssh shelling out to ssh or scp.
+SSH_CALLS = (
+    'check_ssh', 'run', 'execute', 'push', 'relay', 'update_instance')
+
+
+def _api_call(transport, uri, method, args=None, headers=None, **kw):
+    headers = dict(headers or {})
+    # Never write credentials to the cassette.
+    headers.pop('authenticate', None)
+    return ("%s.%s" % (uri.rsplit('/', 1)[-1], method),
+            {'args': list(args or ()), 'headers': headers})
+
+
+def _juju_call(env, command, **kw):
+    return command[0], {'command': list(command)}
+
+
+def _juju_running(env):
+    return 'is_running', {}
+
+
+def _ssh_call(name):
+    def describe(*args, **kw):
+        return name, {'args': list(args)}
+    return describe
+
+
+def _dump_error(e):
+    if isinstance(e, subprocess.CalledProcessError):
+        args = [e.returncode, e.cmd, e.output]
+    elif hasattr(e, 'faultCode'):
+        args = [e.faultCode, e.faultString]
+    else:
+        args = [str(a) for a in e.args]
+    return {'module': e.__class__.__module__,
+            'type': e.__class__.__name__, 'args': args}
+
+
+def _load_error(error):
+    try:
+        module = __import__(error['module'], fromlist=[error['type']])
+        cls = getattr(module, error['type'])
+        return cls(*error['args'])
+    except Exception:
+        return CassetteError("Recorded %s: %s" % (
+            error['type'], " ".join(map(str, error['args']))))
+
+
+class Cassette(object):
+
+    def __init__(self, path, replay=False, speed=1.0):
+        self.path = path
+        self.replaying = replay
+        # Replay time compression, 0 replays without any delays.
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.entries = None
+        self.patched = []
+
+    def install(self):
+        """Route api calls, juju commands and ssh through the cassette.
+        """
+        from juju_slayer.env import Environment
+        from juju_slayer.transport import Transport
+        from juju_slayer import ssh
+
+        if self.replaying:
+            self.load()
+            self._patch(time, 'sleep', self.sleep)
+        self._patch(Transport, 'call', self.wrap(
+            'api', Transport.__dict__['call'], _api_call))
+        self._patch(Environment, '_run', self.wrap(
+            'juju', Environment.__dict__['_run'], _juju_call))
+        self._patch(Environment, 'is_running', self.wrap(
+            'juju', Environment.__dict__['is_running'], _juju_running))
+        for name in SSH_CALLS:
+            self._patch(ssh, name, self.wrap(
+                'ssh', getattr(ssh, name), _ssh_call(name)))
+
+    def uninstall(self):
+        while self.patched:
+            owner, name, original = self.patched.pop()
+            setattr(owner, name, original)
+
+    def _patch(self, owner, name, replacement):
+        self.patched.append((owner, name, owner.__dict__[name]))
+        setattr(owner, name, replacement)
+
+    def wrap(self, kind, func, describe):
+        def call(*args, **kw):
+            name, request = describe(*args, **kw)
+            if self.replaying:
+                return self.play(kind, name, request)
+            start = time.time()
+            try:
+                result = func(*args, **kw)
+            except Exception, e:
+                self.add(kind, name, request, start, error=_dump_error(e))
+                raise
+            self.add(kind, name, request, start, response=result)
+            return result
+        return call
+
+    def sleep(self, seconds):
+        if self.speed:
+            _sleep(seconds / self.speed)
+
+    def add(self, kind, name, request, start, **result):
+        entry = {'kind': kind, 'name': name, 'request': request,
+                 'start': start, 'duration': time.time() - start}
+        entry.update(result)
+        line = json.dumps(entry, default=str)
+        with self.lock:
+            with open(self.path, 'a') as fh:
+                fh.write(line + "\n")
+
+    def load(self):
+        with open(self.path) as fh:
+            entries = [json.loads(line) for line in fh if line.strip()]
+        # Entries are written on completion, replay them in call order.
+        entries.sort(key=lambda e: e['start'])
+        self.entries = entries
+        log.debug("Replaying %d interactions from %s",
+                  len(entries), self.path)
+
+    def play(self, kind, name, request):
+        """Serve the next recorded interaction matching a call.
+
+        The first unplayed entry with an identical request is preferred,
+        otherwise the first unplayed one of the same call. Concurrent ops
+        and generated hostnames mean a session never repeats exactly.
+        """
+        # Requests are compared as they were recorded.
+        request = json.loads(json.dumps(request, default=str))
+        with self.lock:
+            candidates = [e for e in self.entries
+                          if e['kind'] == kind and e['name'] == name]
+            if not candidates:
+                raise CassetteError(
+                    "No recorded %s call %s left to replay" % (kind, name))
+            for entry in candidates:
+                if entry['request'] == request:
+                    break
+            else:
+                entry = candidates[0]
+            self.entries.remove(entry)
+        self.sleep(entry['duration'])
+        if 'error' in entry:
+            raise _load_error(entry['error'])
+        return entry['response']
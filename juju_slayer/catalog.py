@@ -0,0 +1,259 @@
+"""
+Cached SoftLayer ordering catalog, used to validate solved constraints.
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+
+from juju_slayer.constraints import BARE_METAL, BARE_METAL_OS_MAP
+from juju_slayer.exceptions import ConstraintError
+
+log = logging.getLogger("juju.slayer")
+
+# Block device slots, in disk order. Device 1 is reserved for swap.
+DISK_DEVICES = ('0', '2', '3', '4', '5')
+
+# Bare metal servers are cpu and memory presets described as
+# '2 x 2.0 GHz Core Bare Metal Instance - 2 GB Ram'
+SERVER_CPUS_RE = re.compile('(\d+) x ')
+SERVER_MEMORY_RE = re.compile(' - (\d+) GB Ram', re.I)
+
+
+class Catalog(object):
+
+    # Options change rarely, refetch daily.
+    ttl = 24 * 60 * 60
+    # Catalogs older than this are refetched once when validation fails,
+    # ie. for a vlan created since.
+    refresh_age = 5 * 60
+
+    def __init__(self, provider, path):
+        self.provider = provider
+        self.path = path
+        self._data = None
+        self._loaded = None
+
+    @property
+    def data(self):
+        # Held in memory it ages too, a daemon keeps it for days.
+        if self._data is None or time.time() - self._loaded >= self.ttl:
+            self._data = {}
+            self._loaded = time.time()
+            if os.path.exists(self.path):
+                mtime = os.stat(self.path).st_mtime
+                if self._loaded - mtime < self.ttl:
+                    with open(self.path) as fh:
+                        self._data = json.load(fh)
+                    self._loaded = mtime
+        return self._data
+
+    def refresh(self):
+        """Drop the cached catalog, sections are fetched again when used.
+        """
+        log.debug("Refreshing SoftLayer catalog")
+        self._data = {}
+        self._loaded = time.time()
+
+    def section(self, name):
+        """Return a cached section of the catalog, fetching it if missing.
+        """
+        if name not in self.data:
+            log.debug("Fetching SoftLayer %s", name.replace('_', ' '))
+            self.data[name] = getattr(self.provider, 'get_%s' % name)()
+            self._save()
+        return self.data[name]
+
+    def _save(self):
+        parent = os.path.dirname(self.path)
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        fd, tmp_path = tempfile.mkstemp(dir=parent)
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(self.data, fh)
+        os.rename(tmp_path, self.path)
+
+    def _templates(self, category):
+        return [o['template'] for o in
+                self.section('create_options').get(category, ())]
+
+    def datacenters(self):
+        return set(t['datacenter']['name']
+                   for t in self._templates('datacenters'))
+
+    def cpus(self, dedicated=False):
+        return set(t['startCpus'] for t in self._templates('processors')
+                   if bool(t.get('dedicatedAccountHostOnlyFlag')) == dedicated)
+
+    def memory(self):
+        return set(t['maxMemory'] for t in self._templates('memory'))
+
+    def nic_speeds(self):
+        return set(t['networkComponents'][0]['maxSpeed']
+                   for t in self._templates('networkComponents'))
+
+    def disks(self, local_disk=False):
+        """Return the capacities offered per block device for local or san
+        storage.
+        """
+        devices = {}
+        for t in self._templates('blockDevices'):
+            if bool(t.get('localDiskFlag')) != local_disk:
+                continue
+            for b in t['blockDevices']:
+                devices.setdefault(b['device'], set()).add(
+                    b['diskImage']['capacity'])
+        return devices
+
+    def vlans(self):
+        return dict((v['id'], v) for v in self.section('vlans'))
+
+    def _bare_metal_items(self, category):
+        options = self.section('bare_metal_options') or {}
+        return options.get('categories', {}).get(category, {}).get(
+            'items', [])
+
+    def bare_metal_servers(self):
+        """Return bare metal server items keyed by (cpus, memory).
+        """
+        servers = {}
+        for item in self._bare_metal_items('server_core'):
+            cpus = SERVER_CPUS_RE.search(item['description'])
+            memory = SERVER_MEMORY_RE.search(item['description'])
+            if cpus and memory:
+                servers[(int(cpus.group(1)),
+                         int(memory.group(1)) * 1024)] = item
+        return servers
+
+    def bare_metal_locations(self):
+        """Return bare metal order locations keyed by datacenter.
+
+        Locations are described as 'DAL05 - Dallas'.
+        """
+        options = self.section('bare_metal_options') or {}
+        return dict(
+            (l['long_name'].split(' - ')[0].strip().lower(), l['keyname'])
+            for l in options.get('locations', ()))
+
+    def bare_metal_nic_speeds(self):
+        """Return bare metal port speed items keyed by speed.
+        """
+        speeds = {}
+        # Prefer public and private uplinks over private only ones.
+        for item in sorted(self._bare_metal_items('port_speed'),
+                           key=lambda i: 'Public' not in i['description']):
+            speeds.setdefault(int(item['capacity']), item)
+        return speeds
+
+    def bare_metal_order(self, params, series):
+        """Return the order price ids for validated bare metal params.
+        """
+        server = self.bare_metal_servers()[
+            (params['cpus'], params['memory'])]
+        name = BARE_METAL_OS_MAP.get(series)
+        for item in self._bare_metal_items('os'):
+            if name and item['description'].startswith(name) and (
+                    '64 bit' in item['description']):
+                break
+        else:
+            raise ConstraintError(
+                "No bare metal operating system for series %s" % series)
+        # Hourly billing where the preset offers it.
+        hourly = bool(float(server['hourly_recurring_fee'] or 0))
+        if not hourly:
+            log.warning("Bare metal %s is only available monthly",
+                        server['description'])
+        return {
+            'server': server['price_id'],
+            'os': item['price_id'],
+            'port_speed': self.bare_metal_nic_speeds()[
+                params['nic_speed']]['price_id'],
+            'hourly': hourly}
+
+    def validate(self, params):
+        """Check solved params against what SoftLayer offers.
+
+        A stale catalog is refreshed before params are rejected.
+        """
+        try:
+            self._validate(params)
+        except ConstraintError:
+            if time.time() - self._loaded < self.refresh_age:
+                raise
+            self.refresh()
+            self._validate(params)
+
+    def _validate(self, params):
+        datacenters = [params.get('datacenter')] + [
+            d for d, w in params.get('datacenters', ())]
+        if params.get('type') == BARE_METAL:
+            self._validate_bare_metal(params, datacenters)
+        else:
+            self._validate_virtual(params, datacenters)
+        for key, space in (('private_vlan', 'PRIVATE'),
+                           ('public_vlan', 'PUBLIC')):
+            if key in params:
+                self._validate_vlan(params[key], space, datacenters)
+
+    def _validate_bare_metal(self, params, datacenters):
+        for d in filter(None, datacenters):
+            if d not in self.bare_metal_locations():
+                raise ConstraintError(
+                    "Bare metal not available in datacenter %s" % d)
+        if (params['cpus'], params['memory']) not in self.bare_metal_servers():
+            raise ConstraintError(
+                "Bare metal cpu-cores %s with mem %sM not available, "
+                "valid: %s" % (params['cpus'], params['memory'], ", ".join(
+                    "%s/%sG" % (c, m / 1024) for c, m in sorted(
+                        self.bare_metal_servers()))))
+        if params['nic_speed'] not in self.bare_metal_nic_speeds():
+            raise ConstraintError(
+                "Bare metal nic-speed %s not available" % params['nic_speed'])
+
+    def _validate_virtual(self, params, datacenters):
+        for d in filter(None, datacenters):
+            if d not in self.datacenters():
+                raise ConstraintError("Datacenter %s not available" % d)
+        dedicated = params.get('dedicated', False)
+        if params['cpus'] not in self.cpus(dedicated):
+            raise ConstraintError("cpu-cores %s not available%s" % (
+                params['cpus'], dedicated and " on dedicated hosts" or ""))
+        if params['memory'] not in self.memory():
+            raise ConstraintError("mem %sM not available" % params['memory'])
+        if params['nic_speed'] not in self.nic_speeds():
+            raise ConstraintError(
+                "nic-speed %s not available, valid: %s" % (
+                    params['nic_speed'],
+                    ", ".join(map(str, sorted(self.nic_speeds())))))
+        if 'disks' in params:
+            self._validate_disks(
+                params['disks'], params.get('local_disk', False))
+
+    def _validate_vlan(self, vlan_id, space, datacenters):
+        vlan = self.vlans().get(vlan_id)
+        if vlan is None or vlan.get('networkSpace') != space:
+            raise ConstraintError(
+                "Unknown %s vlan %s" % (space.lower(), vlan_id))
+        vlan_datacenter = vlan.get(
+            'primaryRouter', {}).get('datacenter', {}).get('name')
+        for d in filter(None, datacenters):
+            if vlan_datacenter and d != vlan_datacenter:
+                raise ConstraintError(
+                    "Vlan %s is in %s not %s" % (vlan_id, vlan_datacenter, d))
+
+    def _validate_disks(self, disks, local_disk):
+        storage = local_disk and "local" or "san"
+        devices = self.disks(local_disk)
+        slots = [d for d in DISK_DEVICES if d in devices]
+        if len(disks) > len(slots):
+            raise ConstraintError(
+                "At most %d disks available on %s storage" % (
+                    len(slots), storage))
+        for device, size in zip(slots, disks):
+            if size not in devices[device]:
+                raise ConstraintError(
+                    "Disk %s of %sG not available on %s storage, valid: %s" % (
+                        device, size, storage, ", ".join(
+                            "%sG" % c for c in sorted(devices[device]))))
@@ -1,11 +1,13 @@
 import argparse
 import logging
+import os
 import sys
 
-from juju_slayer.config import Config
-from juju_slayer.constraints import IMAGE_MAP
+# Keep imports here light, juju runs every plugin with --description
+# when listing them. The provider and yaml stacks are only imported once
+# a command is dispatched.
+from juju_slayer.constraints import IMAGE_MAP, SPREAD_STRATEGIES
 from juju_slayer.exceptions import ConfigError, PrecheckError
-from juju_slayer import commands
 
 
 def _default_opts(parser):
@@ -13,6 +15,15 @@ def _default_opts(parser):
         "-e", "--environment", help="Juju environment to operate on")
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="Verbose output")
+    parser.add_argument(
+        "--record", metavar="CASSETTE",
+        help="Record api calls, juju commands and ssh to a cassette")
+    parser.add_argument(
+        "--replay", metavar="CASSETTE",
+        help="Replay a recorded cassette instead of calling out")
+    parser.add_argument(
+        "--replay-speed", type=float, default=1.0,
+        help="Replay time compression, 0 replays without delays")
 
 
 def _machine_opts(parser):
@@ -24,8 +35,31 @@ def _machine_opts(parser):
         help="OS Release for machine.")
 
 
+def _qualify_opts(parser):
+    parser.add_argument(
+        "--qualify", metavar="THRESHOLDS",
+        help="Benchmark new machines, replacing any failing thresholds "
+             "like cpu=200,disk=50,network=10,steal=5")
+
+
+def _target_opts(parser):
+    targets = parser.add_mutually_exclusive_group(required=True)
+    targets.add_argument(
+        "--all", action="store_true", default=False,
+        help="Every machine in the environment")
+    targets.add_argument(
+        "-m", "--machine", dest="machines", action="append",
+        help="Machine ids, repeated or comma separated")
+    targets.add_argument(
+        "--tag", help="Machines whose instance has this tag")
+
+
 PLUGIN_DESCRIPTION = "Juju SoftLayer client-side provider"
 
+# Commands never sent to a daemon. The autoscaler runs until interrupted,
+# it would hold the daemon's command lock for good.
+IN_PROCESS_COMMANDS = ('Autoscale',)
+
 
 def setup_parser():
     if '--description' in sys.argv:
@@ -43,7 +77,18 @@ def setup_parser():
         "--upload-tools",
         action="store_true", default=False,
         help="upload local version of tools before bootstrapping")
-    bootstrap.set_defaults(command=commands.Bootstrap)
+    bootstrap.add_argument(
+        "-n", "--num-machines", type=int, default=0,
+        help="Number of additional machines to allocate concurrently")
+    bootstrap.add_argument(
+        "--spread", default="round-robin", choices=SPREAD_STRATEGIES,
+        help="How to distribute machines across a region list")
+    bootstrap.add_argument(
+        "--apt-cache", action="store_true", default=False,
+        help="Serve a caching apt proxy from the bootstrap host to the "
+             "environment's machines")
+    _qualify_opts(bootstrap)
+    bootstrap.set_defaults(command='Bootstrap')
 
     add_machine = subparsers.add_parser(
         'add-machine',
@@ -51,29 +96,155 @@ def setup_parser():
     add_machine.add_argument(
         "-n", "--num-machines", type=int, default=1,
         help="Number of machines to allocate")
+    add_machine.add_argument(
+        "--spread", default="round-robin", choices=SPREAD_STRATEGIES,
+        help="How to distribute machines across a region list")
+    add_machine.add_argument(
+        "--resume", action="store_true", default=False,
+        help="Resume unfinished machine ops from an interrupted run")
+    _qualify_opts(add_machine)
     _default_opts(add_machine)
     _machine_opts(add_machine)
-    add_machine.set_defaults(command=commands.AddMachine)
+    add_machine.set_defaults(command='AddMachine')
 
     terminate_machine = subparsers.add_parser(
         "terminate-machine",
         help="Terminate machine")
     terminate_machine.add_argument("machines", nargs="+")
+    terminate_machine.add_argument(
+        "--recycle", action="store_true", default=False,
+        help="OS reload instances and keep them for reuse by add-machine")
     _default_opts(terminate_machine)
-    terminate_machine.set_defaults(command=commands.TerminateMachine)
+    terminate_machine.set_defaults(command='TerminateMachine')
 
     destroy_environment = subparsers.add_parser(
         'destroy-environment',
         help="Destroy all machines in juju environment")
     _default_opts(destroy_environment)
-    destroy_environment.set_defaults(command=commands.DestroyEnvironment)
+    destroy_environment.set_defaults(command='DestroyEnvironment')
+
+    status = subparsers.add_parser(
+        'status',
+        help="Show juju machines and the instances backing them")
+    _default_opts(status)
+    status.set_defaults(command='Status')
+
+    gc = subparsers.add_parser(
+        'gc',
+        help="Cancel orphaned instances the environment doesn't know")
+    gc.add_argument(
+        "--dry-run", action="store_true", default=False,
+        help="List the instances that would be cancelled")
+    gc.add_argument(
+        "--min-age", type=int, default=60, metavar="MINUTES",
+        help="Only cancel instances older than this")
+    _default_opts(gc)
+    gc.set_defaults(command='CollectGarbage')
+
+    run = subparsers.add_parser(
+        'run',
+        help="Run a shell command on environment machines over ssh")
+    _target_opts(run)
+    run.add_argument(
+        "-c", "--concurrency", type=int, default=10,
+        help="Number of machines to run on at once")
+    run.add_argument(
+        "remote_command", nargs="+", metavar="command",
+        help="Shell command to run, after -- if it has options")
+    _default_opts(run)
+    run.set_defaults(command='Run')
+
+    push = subparsers.add_parser(
+        'push',
+        help="Copy a file to environment machines, machine to machine")
+    _target_opts(push)
+    push.add_argument(
+        "--fanout", type=int, default=3,
+        help="Machines each machine holding the file copies it to at once")
+    push.add_argument("source", help="Local file to copy")
+    push.add_argument(
+        "destination", help="Path to copy the file to on the machines")
+    _default_opts(push)
+    push.set_defaults(command='Push')
+
+    image = subparsers.add_parser(
+        'image',
+        help="Manage captured image templates")
+    image_commands = image.add_subparsers()
+    image_capture = image_commands.add_parser(
+        'capture',
+        help="Capture a prepared image template for a series")
+    _default_opts(image_capture)
+    _machine_opts(image_capture)
+    image_capture.set_defaults(command='ImageCapture')
+
+    image_list = image_commands.add_parser(
+        'list',
+        help="List recorded image templates")
+    _default_opts(image_list)
+    image_list.set_defaults(command='ImageList')
+
+    image_prune = image_commands.add_parser(
+        'prune',
+        help="Delete superseded image templates")
+    image_prune.add_argument(
+        "--dry-run", action="store_true", default=False,
+        help="List the templates that would be deleted")
+    _default_opts(image_prune)
+    image_prune.set_defaults(command='ImagePrune')
+
+    autoscale = subparsers.add_parser(
+        'autoscale',
+        help="Scale machine profiles with their load")
+    autoscale.add_argument(
+        "--policy", required=True,
+        help="Yaml file of machine profiles and their scaling policies")
+    autoscale.add_argument(
+        "--interval", type=int, default=60,
+        help="Seconds between load samples")
+    autoscale.add_argument(
+        "--once", action="store_true", default=False,
+        help="Sample and scale once, ie. when run periodically by cron")
+    _default_opts(autoscale)
+    autoscale.set_defaults(command='Autoscale')
+
+    daemon = subparsers.add_parser(
+        'daemon',
+        help="Serve commands from a warm process, other commands use it "
+             "when running")
+    daemon.add_argument(
+        "-v", "--verbose", action="store_true", help="Verbose output")
+    daemon.set_defaults(command='Daemon')
 
     return parser
 
 
+LOG_FORMAT = "%(asctime)s:%(levelname)s %(message)s"
+LOG_DATE_FORMAT = "%Y/%m/%d %H:%M.%S"
+
+
+def run_command(config, provider, command):
+    """Run a command against the environment, returning its exit status.
+    """
+    from juju_slayer import commands
+    cmd = getattr(commands, command)(
+        config, provider, config.connect_environment())
+    try:
+        cmd.run_locked()
+    except ConfigError, e:
+        print("Configuration error: %s" % str(e))
+        return 1
+    except PrecheckError, e:
+        print("Precheck error: %s" % str(e))
+        return 1
+    return 0
+
+
 def main():
     parser = setup_parser()
     options = parser.parse_args()
+
+    from juju_slayer.config import Config
     config = Config(options)
 
     if config.verbose:
@@ -81,30 +252,60 @@ def main():
     else:
         level = logging.INFO
     logging.basicConfig(
-        level=level,
-        datefmt="%Y/%m/%d %H:%M.%S",
-        format="%(asctime)s:%(levelname)s %(message)s")
+        level=level, datefmt=LOG_DATE_FORMAT, format=LOG_FORMAT)
     logging.getLogger('requests').setLevel(level=logging.WARNING)
     logging.getLogger('SoftLayer.transports').setLevel(level=logging.WARNING)
 
+    if options.command == 'Daemon':
+        return serve(config)
+
+    # Sessions are recorded and replayed in process.
+    if not (config.record or config.replay or
+            options.command in IN_PROCESS_COMMANDS):
+        from juju_slayer import daemon
+        # The daemon doesn't share our environment variables.
+        options.environment = (
+            options.environment or os.environ.get("JUJU_ENV"))
+        status = daemon.call(config.daemon_path, options)
+        if status is not None:
+            sys.exit(status)
+
     try:
         config.validate()
     except ConfigError, e:
         print("Configuration error: %s" % str(e))
         sys.exit(1)
 
-    cmd = options.command(
-        config,
-        config.connect_provider(),
-        config.connect_environment())
+    provider = config.connect_provider()
+    cassette = config.get_cassette()
+    if cassette is not None:
+        cassette.install()
     try:
-        cmd.run()
+        status = run_command(config, provider, options.command)
+    finally:
+        provider.close()
+    if status:
+        sys.exit(status)
+
+
+def serve(config):
+    """Serve commands over the daemon socket until interrupted.
+    """
+    from juju_slayer.daemon import Daemon
+    try:
+        provider = config.connect_provider()
     except ConfigError, e:
         print("Configuration error: %s" % str(e))
         sys.exit(1)
+    try:
+        Daemon(config.daemon_path, provider).serve()
     except PrecheckError, e:
         print("Precheck error: %s" % str(e))
         sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        provider.close()
 
 if __name__ == '__main__':
     main()
@@ -1,12 +1,21 @@
+import hashlib
 import logging
+import os
+import re
+import subprocess
+import time
 import uuid
-import yaml
-import socket
 
-from juju_slayer.constraints import IMAGE_MAP, solve_constraints
-from juju_slayer.exceptions import ConfigError, PrecheckError
-from juju_slayer import ops
-from juju_slayer.runner import Runner
+from juju_slayer.constraints import (
+    BARE_METAL, IMAGE_MAP, VIRTUAL, fallback_params, solve_constraints,
+    spread_datacenters)
+from juju_slayer.exceptions import (
+    ConfigError, ConstraintError, PrecheckError, ProviderError)
+from juju_slayer.images import IMAGE_PREFIX
+from juju_slayer.index import MachineIndex, resolve_address
+from juju_slayer.lock import EXCLUSIVE, SHARED
+from juju_slayer import ops, ssh
+from juju_slayer.runner import Gate, Runner
 
 
 log = logging.getLogger("juju.slayer")
@@ -14,23 +23,197 @@ log = logging.getLogger("juju.slayer")
 
 class BaseCommand(object):
 
+    # How the environment lock is held while running, None to not hold it.
+    env_lock = SHARED
+
     def __init__(self, config, provider, environment):
         self.config = config
         self.provider = provider
         self.env = environment
         self.runner = Runner()
+        # Constraints' fallback policy and region list, set when solving
+        # and planning.
+        self.fallback = None
+        self.region = []
+
+    def run_locked(self):
+        """Run as a live invocation, holding the environment lock if any.
+        """
+        runs = self.config.get_runs()
+        runs.start(self.config.run_id)
+        try:
+            if self.env_lock is None:
+                return self.run()
+            with self.config.get_env_lock(shared=self.env_lock == SHARED):
+                return self.run()
+        finally:
+            runs.stop(self.config.run_id)
 
     def solve_constraints(self):
         params = solve_constraints(self.config.constraints)
+        self.fallback = params.pop('fallback', None)
+        if params.get('type') == BARE_METAL:
+            return self.solve_bare_metal(params)
         if self.config.image is not None:
+            if 'disks' in params:
+                raise ConstraintError(
+                    "Disks can't be given when launching from an image")
             params['image_id'] = self.config.image
         else:
             params['os_code'] = IMAGE_MAP[self.config.series]
         params['domain'] = self.config.domain
         params['hourly'] = True
-        params['nic_speed'] = 100  # Highest speed on the free side.
+        # Highest speed on the free side.
+        params.setdefault('nic_speed', 100)
+        # The bindings default to local disk, we default to san.
+        params.setdefault('local_disk', False)
+        self.config.get_catalog(self.provider).validate(params)
         return params
 
+    def solve_bare_metal(self, params):
+        if self.config.image is not None:
+            raise ConstraintError("Bare metal can't be launched from an image")
+        params['domain'] = self.config.domain
+        params.setdefault('nic_speed', 100)
+        catalog = self.config.get_catalog(self.provider)
+        catalog.validate(params)
+        params.update(catalog.bare_metal_order(params, self.config.series))
+        return params
+
+    def place(self, params, datacenter):
+        """Set the datacenter to launch in, with its image or location.
+        """
+        params['datacenter'] = datacenter
+        if params.get('type') == BARE_METAL:
+            params['location'] = self.config.get_catalog(
+                self.provider).bare_metal_locations().get(datacenter)
+        self.apply_image(params)
+
+    def apply_image(self, params):
+        """Launch from a captured image for the series and datacenter if any.
+
+        Images are per datacenter, so orders left to softlayer to place
+        use the stock image.
+        """
+        if 'os_code' not in params or not params.get('datacenter'):
+            return
+        # Images carry their own disk layout.
+        if 'disks' in params:
+            return
+        image = self.config.get_images().get(
+            self.config.series, params['datacenter'])
+        if image is not None:
+            params.pop('os_code')
+            params['image_id'] = image['globalIdentifier']
+
+    def solve_fallbacks(self, params):
+        """Return the ranked alternatives to placed params SoftLayer offers.
+        """
+        if not self.fallback:
+            return None
+        catalog = self.config.get_catalog(self.provider)
+        fallbacks = []
+        for alternative in fallback_params(
+                params, self.fallback, self.region):
+            try:
+                catalog.validate(alternative)
+            except ConstraintError:
+                continue
+            if alternative['datacenter'] != params['datacenter']:
+                # Captured images are per datacenter.
+                if self.config.image is None and 'image_id' in alternative:
+                    del alternative['image_id']
+                    alternative['os_code'] = IMAGE_MAP[self.config.series]
+                self.place(alternative, alternative['datacenter'])
+            fallbacks.append(alternative)
+        return fallbacks
+
+    def plan_datacenters(self, params, count):
+        """Pop any region list from params and return a datacenter per machine.
+        """
+        datacenters = params.pop('datacenters', None)
+        self.region = [d for d, w in datacenters or ()]
+        if not datacenters:
+            return [params.get('datacenter')] * count
+        return spread_datacenters(datacenters, count, self.config.spread)
+
+    def queue_machines(self, runner, params, plan, journal, pool=None,
+                       **options):
+        """Queue a journaled machine registration per planned datacenter.
+
+        Instances recycled into the pool are claimed before ordering.
+        """
+        template = dict(params)
+        for datacenter in plan:
+            params = dict(template)
+            params['hostname'] = "%s-%s" % (
+                self.config.get_env_name(), uuid.uuid4().hex)
+            self.place(params, datacenter)
+            # Recycled disk layouts aren't tracked, so only instances of
+            # the default layout are reused. Reloads restore the stock
+            # os, not captured images.
+            instance_id = pool and not (
+                'disks' in params or 'image_id' in params) and pool.claim(
+                params['cpus'], params['memory'], datacenter,
+                local_disk=params.get('local_disk', False),
+                dedicated=params.get('dedicated', False),
+                kind=params.get('type', VIRTUAL),
+                os_code=IMAGE_MAP[self.config.series],
+                nic_speed=params.get('nic_speed'),
+                private=params.get('private', False),
+                public_vlan=params.get('public_vlan'),
+                private_vlan=params.get('private_vlan'))
+            resume = None
+            if instance_id:
+                log.info("Reusing recycled instance id:%s", instance_id)
+                # Continue as an op whose order already went through.
+                resume = {'steps': ['queued', 'ordered'],
+                          'instance_id': instance_id}
+            fallbacks = self.solve_fallbacks(params)
+            op = ops.MachineRegister(
+                self.provider, self.env, params, series=self.config.series,
+                journal=journal, resume=resume, fallbacks=fallbacks,
+                **options)
+            op.record('queued', params=params, series=self.config.series,
+                      run=self.config.run_id, fallbacks=fallbacks)
+            if instance_id:
+                op.record('ordered', instance_id=instance_id)
+            runner.queue_op(op)
+
+    def gather_machines(self, runner):
+        """Wait on queued registrations, returning the machine ids added.
+        """
+        machines = []
+        for (instance, machine_id) in runner.iter_results():
+            log.info("Registered id:%s name:%s ip:%s as juju machine %s",
+                     instance.id, instance.name, instance.ip_address,
+                     machine_id)
+            machines.append(machine_id)
+        return machines
+
+    def get_index(self):
+        """Index juju machines against the environment's instances.
+
+        juju status and the provider listing are fetched in parallel.
+        """
+        runner = Runner()
+        runner.queue_op(ops.InstanceListing(
+            self.provider, domain=self.config.domain,
+            hostname="%s-*" % self.config.get_env_name()))
+        runner.start(1)
+        status = self.env.status()
+        listings = list(runner.iter_results())
+        runner.stop()
+        if not listings:
+            raise ProviderError("Could not list provider instances")
+
+        journal = self.config.get_journal()
+        pending = [s['instance_id'] for s in journal.pending()
+                   if 'instance_id' in s]
+        parked = [e['id'] for e in self.config.get_pool().entries()]
+        return MachineIndex(
+            status, listings[0], journal.registry(), pending, parked)
+
     def get_slayer_ssh_keys(self):
         return [k.id for k in self.provider.get_ssh_keys()]
 
@@ -43,23 +226,15 @@ class BaseCommand(object):
                 "SSH Public Key must be uploaded to softlayer")
 
         env_name = self.config.get_env_name()
-        with open(self.config.get_env_conf()) as fh:
-            conf = yaml.safe_load(fh.read())
-            if not 'environments' in conf:
-                raise ConfigError(
-                    "Invalid environments.yaml, no 'environments' section")
-            if not env_name in conf['environments']:
-                raise ConfigError(
-                    "Environment %r not in environments.yaml" % env_name)
-            env = conf['environments'][env_name]
-            if not env['type'] in ('null', 'manual'):
-                raise ConfigError(
-                    "Environment %r provider type is %r must be 'null'" % (
-                        env_name, env['type']))
-            if env['bootstrap-host']:
-                raise ConfigError(
-                    "Environment %r already has a bootstrap-host" % (
-                        env_name))
+        env = self.config.get_env_config()
+        if not env['type'] in ('null', 'manual'):
+            raise ConfigError(
+                "Environment %r provider type is %r must be 'null'" % (
+                    env_name, env['type']))
+        if env['bootstrap-host']:
+            raise ConfigError(
+                "Environment %r already has a bootstrap-host" % (
+                    env_name))
         return keys
 
 
@@ -67,9 +242,12 @@ class Bootstrap(BaseCommand):
     """
     Actions:
     - Launch an instance
+    - Launch any additional machines concurrently
     - Wait for it to reach running state
+    - Set up a caching apt proxy on the instance if requested
     - Update environment in environments.yaml with bootstrap-host address.
     - Bootstrap juju environment
+    - Register additional machines with the environment
 
     Preconditions:
     - named environment found in environments.yaml
@@ -78,24 +256,105 @@ class Bootstrap(BaseCommand):
     - at least one ssh key must exist.
     - ? existing softlayer with matching env name does not exist.
     """
+    env_lock = EXCLUSIVE
+
     def run(self):
         keys = self.check_preconditions()
         params = self.solve_constraints()
         log.info("Launching bootstrap host")
 
         params['ssh_keys'] = keys
+        plan = self.plan_datacenters(params, self.config.num_machines + 1)
+        workers, gate = self.launch_workers(params, plan[1:])
         params['hostname'] = '%s-0' % self.config.get_env_name()
+        self.place(params, plan[0])
 
-        op = ops.MachineAdd(self.provider, self.env, params)
-        instance = op.run()
+        op = ops.MachineAdd(self.provider, self.env, params,
+                            fallbacks=self.solve_fallbacks(params))
+        try:
+            instance = op.run()
+        except:
+            gate.close()
+            self.cancel_workers(workers)
+            raise
 
         log.info("Bootstrapping environment")
         try:
-            self.env.bootstrap_jenv(instance.ip_address)
+            apt_proxy = None
+            if self.config.apt_cache:
+                apt_proxy = self.setup_apt_cache(instance)
+            self.env.bootstrap_jenv(instance.ip_address, apt_proxy=apt_proxy)
         except:
-            self.provider.terminate_instance(instance.id)
+            gate.close()
+            self.provider.terminate_instance(instance.id, instance.kind)
+            self.cancel_workers(workers)
             raise
 
+        gate.open()
+        if workers.job_count:
+            self.gather_machines(workers)
+            workers.stop()
+
+    def launch_workers(self, params, plan):
+        """Start provisioning additional machines alongside the state server.
+
+        The machines are registered once the gate opens on a running
+        state server.
+        """
+        gate = Gate()
+        workers = Runner()
+        if not plan:
+            return workers, gate
+        log.info("Launching %d additional instances", len(plan))
+        self.queue_machines(
+            workers, params, plan, self.config.get_journal(), gate=gate,
+            qualify=self.config.qualify)
+        workers.start(min(workers.num_runners, workers.job_count))
+        return workers, gate
+
+    def cancel_workers(self, workers):
+        """Cancel the additional machines of a failed bootstrap.
+
+        Workers fail at the closed gate once provisioned, so they're waited
+        on before the instances they ordered are cancelled and their ops
+        abandoned.
+        """
+        if not workers.job_count:
+            return
+        log.warning("Bootstrap failed, cancelling additional machines")
+        self.gather_machines(workers)
+        workers.stop()
+        journal = self.config.get_journal()
+        for state in journal.pending():
+            if state.get('run') != self.config.run_id:
+                continue
+            if 'instance_id' in state:
+                try:
+                    self.provider.terminate_instance(
+                        state['instance_id'],
+                        state['params'].get('type', VIRTUAL))
+                except Exception:
+                    log.warning("Could not cancel instance id:%s",
+                                state['instance_id'], exc_info=True)
+                    continue
+            journal.record(state['op'], 'abandoned')
+
+    def setup_apt_cache(self, instance):
+        """Install an apt cache on the bootstrap host, returning its url.
+
+        The cache is served on the private network. It's an optimization,
+        on failure machines use the public mirrors.
+        """
+        address = instance.private_ip_address or instance.ip_address
+        try:
+            ssh.setup_apt_cache(instance.ip_address, address)
+        except subprocess.CalledProcessError, e:
+            log.warning("Could not set up apt cache on %s\n%s",
+                        instance.ip_address, e.output)
+            return None
+        log.info("Serving apt cache from %s", address)
+        return "http://%s:%d" % (address, ssh.APT_CACHE_PORT)
+
     def check_preconditions(self):
         result = super(Bootstrap, self).check_preconditions()
         if self.env.is_running():
@@ -109,24 +368,43 @@ class AddMachine(BaseCommand):
 
     def run(self):
         keys = self.check_preconditions()
+        journal = self.config.get_journal()
+        if self.config.resume:
+            return self.resume(journal)
+
         params = self.solve_constraints()
         log.info("Launching %d instances", self.config.num_machines)
 
         params['ssh_keys'] = keys
-        template = dict(params)
+        plan = self.plan_datacenters(params, self.config.num_machines)
 
-        for n in range(self.config.num_machines):
-            params = dict(template)
-            params['hostname'] = "%s-%s" % (
-                self.config.get_env_name(), uuid.uuid4().hex)
+        # Widen the worker pool so every datacenter in the spread has
+        # orders in flight at once, a slow one won't stall the others.
+        self.runner.num_runners = Runner.DEFAULT_NUM_RUNNER * len(set(plan))
+        self.queue_machines(
+            self.runner, params, plan, journal, self.config.get_pool(),
+            qualify=self.config.qualify,
+            apt_proxy=self.config.get_apt_proxy())
+        return self.gather_machines(self.runner)
+
+    def resume(self, journal):
+        """Resume unfinished ops from the journal at their last step.
+
+        Ops still being run by another invocation are left to it.
+        """
+        pending = journal.claim(
+            self.config.run_id, self.config.get_runs().alive)
+        log.info("Resuming %d unfinished machine ops", len(pending))
+        apt_proxy = self.config.get_apt_proxy()
+        for state in pending:
             self.runner.queue_op(
                 ops.MachineRegister(
-                    self.provider, self.env, params,
-                    series=self.config.series))
-
-        for (instance, machine_id) in self.runner.iter_results():
-            log.info("Registered id:%s name:%s ip:%s as juju machine",
-                     instance.id, instance.name, instance.ip_address)
+                    self.provider, self.env, state['params'],
+                    series=state['series'], journal=journal,
+                    op_id=state['op'], resume=state,
+                    qualify=self.config.qualify, apt_proxy=apt_proxy,
+                    fallbacks=state.get('fallbacks')))
+        return self.gather_machines(self.runner)
 
 
 class TerminateMachine(BaseCommand):
@@ -134,59 +412,53 @@ class TerminateMachine(BaseCommand):
     def run(self):
         """Terminate machine in environment.
         """
-        self.check_preconditions()
-        self._terminate_machines(lambda x: x in self.config.options.machines)
+        keys = self.check_preconditions()
+        self._terminate_machines(
+            lambda x: x in self.config.options.machines,
+            self.config.recycle and keys)
 
-    def _terminate_machines(self, remove_machines):
+    def _terminate_machines(self, remove_machines, recycle_keys=None):
         log.debug("Checking for machines to terminate")
-        status = self.env.status()
-        machines = status.get('machines', {})
+        index = self.get_index()
 
-        # Using the api instance-id can be the provider id, but
-        # else it defaults to ip, and we have to disambiguate.
-        remove = []
-        for m in machines:
-            if remove_machines(m):
-                if machines[m].get('life', '') == 'dead':
-                    continue
-                remove.append(
-                    # Juju does a reverse ip lookup to dns name which softlayer
-                    # has mapped to 198.23.106.29-static.reverse.softlayer.com.
-                    # An account may also have this mapped to a custom domain
-                    # so we always resolve to ip address as we map to provider
-                    # instances by ip address.
-                    {'address': socket.gethostbyname(machines[m]['dns-name']),
-                     'instance_id': machines[m]['instance-id'],
-                     'machine_id': m})
-
-        address_map = dict([(d.ip_address, d.id) for
-                            d in self.provider.get_instances()])
+        remove = [m for m in sorted(index.machines)
+                  if remove_machines(m) and m not in index.dead()]
         if not remove:
-            return status, address_map
+            return index
 
-        log.info("Terminating machines %s",
-                 " ".join([m['machine_id'] for m in remove]))
+        log.info("Terminating machines %s", " ".join(remove))
 
         for m in remove:
-            instance_id = address_map.get(m['address'])
-            if instance_id is None:
+            instance = index.instance_of.get(m)
+            if instance is None:
                 log.warning(
                     "Couldn't resolve machine %s's address %s to instance" % (
-                        m['machine_id'], m['address']))
+                        m, index.machines[m].get('dns-name')))
                 continue
-            self.runner.queue_op(
-                ops.MachineDestroy(
+            if recycle_keys:
+                op = ops.MachineRecycle(
                     self.provider, self.env, {
-                        'machine_id': m['machine_id'],
-                        'instance_id': instance_id}))
+                        'machine_id': m,
+                        'instance': instance,
+                        'ssh_keys': recycle_keys},
+                    pool=self.config.get_pool())
+            else:
+                op = ops.MachineDestroy(
+                    self.provider, self.env, {
+                        'machine_id': m,
+                        'instance_id': instance.id,
+                        'kind': instance.kind})
+            self.runner.queue_op(op)
         for result in self.runner.iter_results():
             pass
 
-        return status, address_map
+        return index
 
 
 class DestroyEnvironment(TerminateMachine):
 
+    env_lock = EXCLUSIVE
+
     def run(self):
         """Destroy environment.
         """
@@ -198,8 +470,13 @@ class DestroyEnvironment(TerminateMachine):
                 return False
             return True
 
-        env_status, instance_map = self._terminate_machines(
-            state_service_filter)
+        index = self._terminate_machines(state_service_filter)
+
+        pool = self.config.get_pool()
+        for instance in index.recycled():
+            log.info("Terminating recycled instance %s", instance.id)
+            self.provider.terminate_instance(instance.id, instance.kind)
+        pool.remove([i.id for i in index.recycled()])
 
         # We forcefuly terminate the environment now, the machines are
         # already dead or dying.
@@ -207,10 +484,501 @@ class DestroyEnvironment(TerminateMachine):
         self.env.destroy_environment()
 
         # Remove the state server.
-        bootstrap_host = env_status.get(
-            'machines', {}).get('0', {}).get('dns-name')
-        # See comment in terminate machine command re resolve
-        instance_id = instance_map.get(socket.gethostbyname(bootstrap_host))
-        if instance_id:
+        instance = index.instance_of.get('0')
+        if instance is not None:
             log.info("Terminating state server")
-            self.provider.terminate_instance(instance_id)
+            self.provider.terminate_instance(instance.id, instance.kind)
+
+
+class Autoscale(BaseCommand):
+    """
+    Actions:
+    - Sample load on each profile's machines concurrently over ssh
+    - Decide per profile whether to scale, with hysteresis and cooldowns
+    - Add machines as add-machine does, remove as terminate-machine does
+    - Repeat every interval, unless running once
+    """
+    # Scaling batches hold the lock while they run, the loop doesn't.
+    env_lock = None
+    sample_runners = 20
+
+    def run(self):
+        self.check_preconditions()
+        profiles = self.config.get_policy()
+        while True:
+            try:
+                self.evaluate(profiles)
+            except Exception:
+                if self.config.once:
+                    raise
+                # Transient juju, provider or ssh failures are retried at
+                # the next interval rather than ending the loop.
+                log.exception("Autoscale evaluation failed")
+            if self.config.once:
+                return
+            time.sleep(self.config.interval)
+
+    def evaluate(self, profiles, now=None):
+        """Sample load and scale each profile once.
+        """
+        now = now or time.time()
+        index = self.get_index()
+        store = self.config.get_scale_state()
+        state = store.load()
+        dead = index.dead()
+        for profile in profiles:
+            record = state.setdefault(profile.name, {'machines': []})
+            # Forget machines removed from the environment by hand.
+            record['machines'] = [m for m in record['machines']
+                                  if m in index.machines and m not in dead]
+        loads = self.sample_load(index, sum(
+            [state[p.name]['machines'] for p in profiles], []))
+
+        for profile in profiles:
+            record = state[profile.name]
+            delta = profile.decide(record['machines'], loads, record, now)
+            log.debug("Profile %s machines:%d load:%s", profile.name,
+                      len(record['machines']), record.get('load'))
+            if delta > 0:
+                log.info("Scaling %s up by %d machines", profile.name, delta)
+                try:
+                    added = self.scale_up(profile, delta)
+                except Exception:
+                    log.exception("Could not scale %s up", profile.name)
+                    added = []
+                record['machines'].extend(added)
+                if len(added) < delta:
+                    log.warning("Profile %s added %d of %d machines",
+                                profile.name, len(added), delta)
+                    record['failed'] = now
+            elif delta < 0:
+                victims = self.pick_victims(profile, record, index, loads,
+                                            -delta)
+                if not victims:
+                    log.info("Profile %s has no idle machines to remove",
+                             profile.name)
+                    continue
+                log.info("Scaling %s down, removing machines %s",
+                         profile.name, " ".join(victims))
+                try:
+                    self.scale_down(profile, victims)
+                except Exception:
+                    # Machines that did go are forgotten next evaluation.
+                    log.exception("Could not scale %s down", profile.name)
+                else:
+                    record['machines'] = [
+                        m for m in record['machines'] if m not in victims]
+            else:
+                continue
+            record.update({'scaled': now, 'up': 0, 'down': 0})
+            store.save(state)
+        store.save(state)
+
+    def sample_load(self, index, machines):
+        runner = Runner(self.sample_runners)
+        for m in machines:
+            instance = index.instance_of.get(m)
+            if instance is not None:
+                runner.queue_op(ops.LoadSample(m, instance.ip_address))
+        return dict(runner.iter_results())
+
+    def pick_victims(self, profile, record, index, loads, count):
+        """Pick the least loaded machines to remove.
+        """
+        candidates = record['machines']
+        if profile.idle_only:
+            occupied = index.occupied()
+            candidates = [m for m in candidates if m not in occupied]
+        candidates = sorted(candidates, key=lambda m: loads.get(m) or 0)
+        return candidates[:count]
+
+    def scale_up(self, profile, count):
+        config = self.config.derive(
+            constraints=profile.constraints, series=profile.series,
+            num_machines=count, resume=False)
+        return AddMachine(config, self.provider, self.env).run_locked()
+
+    def scale_down(self, profile, machines):
+        config = self.config.derive(
+            machines=machines, recycle=profile.recycle)
+        TerminateMachine(config, self.provider, self.env).run_locked()
+
+
+class CollectGarbage(BaseCommand):
+    """
+    Actions:
+    - Join the environment's instances against its juju machines
+    - Find machine instances no machine, live op or recycled instance
+      still claimable accounts for
+    - Cancel those older than the minimum age, unless a dry run
+    - Abandon the journaled ops of cancelled instances
+
+    Preconditions:
+    - every live juju machine is matched to its instance
+    """
+
+    def run(self):
+        index = self.get_index()
+        dead = index.dead()
+        unmatched = [m for m in sorted(index.machines, key=_machine_sort_key)
+                     if m not in index.instance_of and m not in dead]
+        if unmatched:
+            raise PrecheckError(
+                "Machines %s not matched to instances, not collecting" % (
+                    " ".join(unmatched)))
+
+        # Ops of live runs may not have journaled their instance id yet,
+        # their hostnames are journaled when queued.
+        journal = self.config.get_journal()
+        alive = self.config.get_runs().alive
+        live = set()
+        abandoned = {}
+        for state in journal.pending():
+            keys = [k for k in (state.get('instance_id'),
+                                state.get('params', {}).get('hostname')) if k]
+            if state.get('run') and alive(state['run']):
+                live.update(keys)
+            else:
+                for key in keys:
+                    abandoned.setdefault(key, []).append(state['op'])
+
+        # The listing matches hostnames by prefix, so it includes the
+        # instances of environments named like this one, and the state
+        # server is never ours to cancel. Only machine hostnames qualify.
+        hostname = re.compile(
+            r"^%s-[0-9a-f]{32}$" % re.escape(self.config.get_env_name()))
+        # Recycled instances parked past the pool's max age are collected.
+        pool = self.config.get_pool()
+        parked = index.parked.difference(pool.expired())
+        now = time.time()
+        strays = []
+        for i in index.instances:
+            if not hostname.match(i.name):
+                continue
+            if (i.id in index.machine_of or i.id in parked or
+                    i.id in live or i.name in live):
+                continue
+            if i.created is None or now - i.created < self.config.min_age:
+                log.info("Skipping instance %s %s, not %d minutes old",
+                         i.id, i.name, self.config.min_age / 60)
+                continue
+            strays.append(i)
+        if not strays:
+            print("No orphaned instances")
+            return
+
+        print("%-10s %-16s %-8s %-8s %s" % (
+            "INSTANCE", "ADDRESS", "REGION", "AGE", "NAME"))
+        for i in strays:
+            print("%-10s %-16s %-8s %-8s %s" % (
+                i.id, i.ip_address or "-", i.datacenter,
+                "%dh" % ((now - i.created) / 3600), i.name))
+        if self.config.dry_run:
+            print("\nDry run, %d instances not cancelled" % len(strays))
+            return
+
+        for i in strays:
+            self.runner.queue_op(ops.InstanceCancel(
+                self.provider, self.env, {'instance': i}))
+        cancelled = list(self.runner.iter_results())
+        pool.remove([i.id for i in cancelled])
+        for i in cancelled:
+            for op_id in set(abandoned.get(i.id, []) +
+                             abandoned.get(i.name, [])):
+                journal.record(op_id, 'abandoned', instance_id=i.id)
+        print("\nCancelled %d of %d instances" % (
+            len(cancelled), len(strays)))
+
+
+class Status(BaseCommand):
+
+    env_lock = None
+
+    def run(self):
+        """Show juju machines alongside the instances backing them.
+        """
+        index = self.get_index()
+        dead = index.dead()
+        print("%-8s %-10s %-16s %-8s %s" % (
+            "MACHINE", "INSTANCE", "ADDRESS", "REGION", "STATE"))
+        for m in sorted(index.machines, key=_machine_sort_key):
+            instance = index.instance_of.get(m)
+            state = index.machines[m].get('agent-state', 'unknown')
+            if m in dead:
+                state = "dead"
+            if instance is None:
+                print("%-8s %-10s %-16s %-8s %s" % (
+                    m, "-", index.machines[m].get('dns-name', '-'), "-",
+                    state + " (no instance)"))
+                continue
+            print("%-8s %-10s %-16s %-8s %s" % (
+                m, instance.id, instance.ip_address, instance.datacenter,
+                state))
+
+        for title, instances in (("Provisioning", index.provisioning()),
+                                 ("Recycled", index.recycled()),
+                                 ("Orphaned", index.orphans())):
+            if not instances:
+                continue
+            print("\n%s instances:" % title)
+            for i in instances:
+                print("  %-10s %-16s %-8s %s" % (
+                    i.id, i.ip_address, i.datacenter, i.name))
+
+
+class Run(BaseCommand):
+    """
+    Actions:
+    - Resolve the selected machines' addresses
+    - Run the command on them over ssh, a bounded number at a time
+    - Print each machine's output, exit status and timing as it finishes
+    """
+    env_lock = None
+
+    def run(self):
+        if self.config.concurrency < 1:
+            raise ConfigError("Concurrency must be at least 1")
+        command = " ".join(self.config.options.remote_command)
+        targets = self.get_targets(self.get_index())
+        if not targets:
+            log.info("No machines selected")
+            return
+        control_dir = self.config.ssh_control_dir
+        if not os.path.exists(control_dir):
+            os.makedirs(control_dir, 0700)
+
+        t = time.time()
+        runner = Runner(self.config.concurrency)
+        for machine_id, address in targets:
+            runner.queue_op(ops.RemoteCommand(
+                machine_id, address, command, control_dir))
+        failed = []
+        for machine_id, address, status, output, elapsed in (
+                runner.iter_results()):
+            print("== machine %s %s exit %s in %0.2fs" % (
+                machine_id, address, status, elapsed))
+            if output:
+                print(output.rstrip("\n"))
+            if status != 0:
+                failed.append(machine_id)
+        print("\nRan on %d machines in %0.2fs, %d failed%s" % (
+            len(targets), time.time() - t, len(failed),
+            failed and ": %s" % " ".join(
+                sorted(failed, key=_machine_sort_key)) or ""))
+
+    def get_targets(self, index):
+        """Return (machine id, address) of the selected live machines.
+        """
+        options = self.config.options
+        selected = None
+        if options.machines:
+            selected = set()
+            for m in options.machines:
+                selected.update(m.split(','))
+            unknown = selected - set(index.machines)
+            if unknown:
+                raise ConfigError("Unknown machines: %s" % " ".join(
+                    sorted(unknown, key=_machine_sort_key)))
+
+        dead = index.dead()
+        targets = []
+        for m in sorted(index.machines, key=_machine_sort_key):
+            if m in dead or (selected is not None and m not in selected):
+                continue
+            instance = index.instance_of.get(m)
+            if options.tag and (instance is None or
+                                options.tag not in instance.tags):
+                continue
+            if instance is not None:
+                address = instance.ip_address
+            else:
+                address = resolve_address(index.machines[m].get('dns-name'))
+            if not address:
+                log.warning("Machine %s has no address, skipping", m)
+                continue
+            targets.append((m, address))
+        return targets
+
+
+class Push(Run):
+    """
+    Actions:
+    - Upload the file once, to the first selected machine
+    - Relay it machine to machine over the private network in rounds,
+      each machine holding it sending to --fanout more
+    - Verify the checksum on every machine it reaches
+    - Report aggregate throughput
+    """
+    # Attempts at getting the file to a machine before giving up on it.
+    max_attempts = 2
+
+    def run(self):
+        options = self.config.options
+        if options.fanout < 1:
+            raise ConfigError("Fanout must be at least 1")
+        if not os.path.isfile(options.source):
+            raise ConfigError("No such file %s" % options.source)
+        index = self.get_index()
+        targets = self.get_targets(index)
+        if not targets:
+            log.info("No machines selected")
+            return
+        size = os.path.getsize(options.source)
+        digest = _checksum(options.source)
+        addresses = dict(targets)
+        private = {}
+        for m, address in targets:
+            instance = index.instance_of.get(m)
+            private[m] = instance and instance.private_ip_address or address
+
+        t = time.time()
+        pending = [m for m, _ in targets]
+        attempts = dict.fromkeys(pending, 0)
+        holders, failed = [], []
+        while pending:
+            if holders:
+                batch = []
+                for source in holders:
+                    for i in range(options.fanout):
+                        if not pending:
+                            break
+                        m = pending.pop(0)
+                        batch.append(ops.FileRelay(
+                            m, addresses[m], private[m], addresses[source],
+                            options.destination, digest))
+            else:
+                # Seed the tree, the only upload from here.
+                m = pending.pop(0)
+                batch = [ops.FileUpload(
+                    m, addresses[m], options.source, options.destination,
+                    digest)]
+            log.debug("Copying to %d machines from %d", len(batch),
+                      len(holders) or 1)
+            runner = Runner(len(batch))
+            for op in batch:
+                runner.queue_op(op)
+            for machine_id, error in runner.iter_results():
+                if error is None:
+                    print("== machine %s %s verified in %0.2fs" % (
+                        machine_id, addresses[machine_id], time.time() - t))
+                    holders.append(machine_id)
+                    continue
+                attempts[machine_id] += 1
+                log.warning("Copy to machine %s failed: %s",
+                            machine_id, error)
+                if attempts[machine_id] < self.max_attempts:
+                    pending.append(machine_id)
+                else:
+                    failed.append(machine_id)
+
+        elapsed = time.time() - t
+        print("\nPushed %0.1fMB to %d machines in %0.2fs, %0.1fMB/s "
+              "aggregate, %d failed%s" % (
+                  size / 1048576.0, len(holders), elapsed,
+                  size * len(holders) / 1048576.0 / max(elapsed, 0.001),
+                  len(failed), failed and ": %s" % " ".join(
+                      sorted(failed, key=_machine_sort_key)) or ""))
+
+
+def _checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _machine_sort_key(machine_id):
+    # Containers are ids like 1/lxc/0
+    return [int(p) if p.isdigit() else p for p in machine_id.split('/')]
+
+
+class ImageCapture(BaseCommand):
+    """
+    Actions:
+    - Launch an instance from the stock series image
+    - Prepare it for juju
+    - Capture it as an image template
+    - Record the template for the series and datacenter
+    - Terminate the instance
+    """
+    capture_timeout = 180  # In 10s increments
+    env_lock = None
+
+    def run(self):
+        keys = self.check_preconditions()
+        params = self.solve_constraints()
+        if params.get('type') == BARE_METAL:
+            raise ConstraintError(
+                "Images can only be captured from virtual machines")
+        params.pop('image_id', None)
+        params['os_code'] = IMAGE_MAP[self.config.series]
+        params['ssh_keys'] = keys
+        params['datacenter'] = self.plan_datacenters(params, 1)[0]
+        params['hostname'] = "%s-image-%s" % (
+            self.config.get_env_name(), uuid.uuid4().hex)
+
+        log.info("Launching instance to capture")
+        instance = ops.MachineAdd(self.provider, self.env, params).run()
+        try:
+            instance = self.provider.get_instance(instance.id)
+            name = "%s%s-%s-%s" % (
+                IMAGE_PREFIX, self.config.series, instance.datacenter,
+                time.strftime("%Y%m%d%H%M%S"))
+            log.info("Capturing image %s from id:%s", name, instance.id)
+            self.provider.capture_instance(instance.id, name)
+            self.provider.wait_on(instance, self.capture_timeout)
+            images = [i for i in self.provider.get_images() if i.name == name]
+            if not images:
+                raise ProviderError("Captured image %s not found" % name)
+            self.config.get_images().record(
+                self.config.series, instance.datacenter, images[0])
+            log.info("Recorded image %s for %s in %s",
+                     name, self.config.series, instance.datacenter)
+        finally:
+            self.provider.terminate_instance(instance.id)
+
+
+class ImageList(BaseCommand):
+
+    env_lock = None
+
+    def run(self):
+        available = set(i.global_id for i in self.provider.get_images())
+        for series, datacenter, image in self.config.get_images().items():
+            print("%-10s %-8s %s %s%s" % (
+                series, datacenter, image['globalIdentifier'], image['name'],
+                image['globalIdentifier'] not in available and
+                " (missing)" or ""))
+
+
+class ImagePrune(BaseCommand):
+
+    env_lock = None
+
+    def run(self):
+        """Delete superseded captures and forget templates that are gone.
+
+        Only templates the registry recorded and a later capture
+        superseded are deleted, the account's other templates, ie. those
+        of other users or workstations, are left alone.
+        """
+        registry = self.config.get_images()
+        images = dict((i.global_id, i) for i in self.provider.get_images())
+        superseded = [image for _, _, image in registry.superseded()
+                      if image['globalIdentifier'] in images]
+        if self.config.dry_run:
+            for image in superseded:
+                print("Would delete superseded image %s" % image['name'])
+            for _, _, image in registry.items():
+                if image['globalIdentifier'] not in images:
+                    print("Would forget missing image %s" % image['name'])
+            return
+
+        deleted = set()
+        for image in superseded:
+            log.info("Deleting superseded image %s", image['name'])
+            self.provider.delete_image(images[image['globalIdentifier']].id)
+            deleted.add(image['globalIdentifier'])
+        for image in registry.prune(set(images) - deleted):
+            log.info("Removed missing image %s from registry", image['name'])
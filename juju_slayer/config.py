@@ -1,10 +1,49 @@
+import argparse
 import os
+import threading
+import uuid
 import yaml
 import sys
 
-from juju_slayer.env import Environment
+from juju_slayer.catalog import Catalog
 from juju_slayer.exceptions import ConfigError
-from juju_slayer import provider
+from juju_slayer.images import ImageRegistry
+from juju_slayer.journal import Journal
+from juju_slayer.lock import FileLock, RunRegistry
+from juju_slayer.pool import InstancePool
+
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+_yaml_cache = {}
+_yaml_lock = threading.Lock()
+
+
+def parse_yaml(stream):
+    """Parse yaml safely, with libyaml's loader where available.
+    """
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def load_yaml(path):
+    """Load a yaml file, parsing it at most once per modification.
+
+    Results are shared between callers and must not be mutated.
+    """
+    stat = os.stat(path)
+    key = (stat.st_mtime, stat.st_size, stat.st_ino)
+    with _yaml_lock:
+        cached = _yaml_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with open(path) as fh:
+        data = parse_yaml(fh)
+    with _yaml_lock:
+        _yaml_cache[path] = (key, data)
+    return data
 
 
 class EmptyOptions(object):
@@ -16,28 +55,62 @@ class EmptyOptions(object):
     environment = None
     series = None
     constraints = ""
+    spread = "round-robin"
+    resume = False
+    recycle = False
+    qualify = None
+    apt_cache = False
+    min_age = 60
+    dry_run = False
+    concurrency = 10
+    policy = None
+    interval = 60
+    once = False
+    record = None
+    replay = None
+    replay_speed = 1.0
     verbose = True
 
 
 class Config(object):
 
-    def __init__(self, options=None):
+    def __init__(self, options=None, cache=None):
         if options is None:
             options = EmptyOptions()
         self.options = options
+        # Identifies this invocation's ops in the shared journal.
+        self.run_id = uuid.uuid4().hex
+        # Account state kept across the configs sharing it, a daemon
+        # shares one across its commands.
+        self.cache = {} if cache is None else cache
+
+    def derive(self, **overrides):
+        """Return a config for a command run on behalf of this one.
+        """
+        options = dict(vars(self.options))
+        options.update(overrides)
+        return self.__class__(argparse.Namespace(**options), self.cache)
 
     def connect_provider(self):
         """Connect to digital ocean.
         """
-        return provider.factory()
+        from juju_slayer import provider
+        return provider.factory(replay=bool(self.replay))
 
     def connect_environment(self):
         """Return a websocket connection to the environment.
         """
+        from juju_slayer.env import Environment
         return Environment(self)
 
     def validate(self):
-        provider.validate()
+        if self.record and self.replay:
+            raise ConfigError("Can't both record and replay a session")
+        if not self.replay:
+            from juju_slayer import provider
+            provider.validate()
+        # Parse qualification thresholds to report any errors up front.
+        self.qualify
         self.get_env_name()
 
     @property
@@ -64,10 +137,70 @@ class Config(object):
     def upload_tools(self):
         return getattr(self.options, 'upload_tools', False)
 
+    @property
+    def spread(self):
+        return getattr(self.options, 'spread', 'round-robin')
+
     @property
     def num_machines(self):
         return getattr(self.options, 'num_machines', 0)
 
+    @property
+    def resume(self):
+        return getattr(self.options, 'resume', False)
+
+    @property
+    def recycle(self):
+        return getattr(self.options, 'recycle', False)
+
+    @property
+    def concurrency(self):
+        return getattr(self.options, 'concurrency', 10)
+
+    @property
+    def min_age(self):
+        """Seconds an instance must exist before it's garbage collected.
+        """
+        return getattr(self.options, 'min_age', 60) * 60
+
+    @property
+    def dry_run(self):
+        return getattr(self.options, 'dry_run', False)
+
+    @property
+    def apt_cache(self):
+        return getattr(self.options, 'apt_cache', False)
+
+    @property
+    def qualify(self):
+        """Benchmark thresholds new machines must meet, or None.
+        """
+        spec = getattr(self.options, 'qualify', None)
+        if not spec:
+            return None
+        from juju_slayer.qualify import parse_thresholds
+        return parse_thresholds(spec)
+
+    @property
+    def interval(self):
+        return getattr(self.options, 'interval', 60)
+
+    @property
+    def once(self):
+        return getattr(self.options, 'once', False)
+
+    @property
+    def record(self):
+        return getattr(self.options, 'record', None)
+
+    @property
+    def replay(self):
+        return getattr(self.options, 'replay', None)
+
+    @property
+    def replay_speed(self):
+        return getattr(self.options, 'replay_speed', 1.0)
+
     @property
     def juju_home(self):
         jhome = os.environ.get("JUJU_HOME")
@@ -78,6 +211,95 @@ class Config(object):
                 os.path.join('APPDATA'), "Juju")
         return os.path.expanduser("~/.juju")
 
+    @property
+    def state_dir(self):
+        """Directory for the plugin's own client side state.
+        """
+        return os.path.join(self.juju_home, "slayer")
+
+    @property
+    def ssh_control_dir(self):
+        """Directory of shared ssh master connections.
+        """
+        return os.path.join(self.state_dir, "ssh")
+
+    @property
+    def daemon_path(self):
+        """Unix socket a running daemon serves commands on.
+        """
+        return os.path.join(self.state_dir, "daemon.sock")
+
+    def get_journal(self):
+        """Get the machine op journal for the environment.
+        """
+        return Journal(os.path.join(
+            self.state_dir, "%s.journal" % self.get_env_name()))
+
+    def get_env_lock(self, shared=True):
+        """Get the lock coordinating invocations against the environment.
+
+        Bootstrap and destroy-environment hold it exclusively, other
+        commands changing the environment share it.
+        """
+        return FileLock(os.path.join(
+            self.state_dir, "%s.lock" % self.get_env_name()), shared=shared)
+
+    def get_runs(self):
+        """Get the registry of live invocations.
+        """
+        return RunRegistry(os.path.join(self.state_dir, "runs"))
+
+    def get_pool(self):
+        """Get the environment's inventory of recycled instances.
+        """
+        return InstancePool(os.path.join(
+            self.state_dir, "%s.pool" % self.get_env_name()))
+
+    def get_policy(self):
+        """Get the autoscale profiles of the policy file.
+        """
+        from juju_slayer.autoscale import load_policy
+        if not getattr(self.options, 'policy', None):
+            raise ConfigError("No autoscale policy file given")
+        return load_policy(self.options.policy)
+
+    def get_scale_state(self):
+        """Get the autoscaler's record of the environment's profiles.
+        """
+        from juju_slayer.autoscale import ScaleState
+        return ScaleState(os.path.join(
+            self.state_dir, "%s.autoscale" % self.get_env_name()))
+
+    def get_catalog(self, provider):
+        """Get the cached ordering catalog of the provider account.
+
+        The catalog is kept in memory for the configs sharing our cache.
+        """
+        path = os.path.join(self.state_dir, "catalog.json")
+        key = ('catalog', path, provider)
+        catalog = self.cache.get(key)
+        if catalog is None:
+            catalog = self.cache[key] = Catalog(provider, path)
+        return catalog
+
+    def get_cassette(self):
+        """Get the cassette the session is recorded to or replayed from.
+        """
+        if not (self.record or self.replay):
+            return None
+        from juju_slayer.cassette import Cassette
+        if self.replay:
+            return Cassette(self.replay, replay=True, speed=self.replay_speed)
+        return Cassette(self.record)
+
+    def get_images(self):
+        """Get the registry of captured image templates.
+
+        Image templates belong to the account, so the registry is shared
+        across environments.
+        """
+        return ImageRegistry(os.path.join(self.state_dir, "images.yaml"))
+
     def get_env_name(self):
         """Get the environment name.
         """
@@ -91,11 +313,51 @@ class Config(object):
             with open(env_ptr) as fh:
                 return fh.read().strip()
 
-        with open(self.get_env_conf()) as fh:
-            conf = yaml.safe_load(fh.read())
-            if not 'default' in conf:
-                raise ConfigError("No Environment specified")
-            return conf['default']
+        conf = self.get_environments()
+        if not 'default' in conf:
+            raise ConfigError("No Environment specified")
+        return conf['default']
+
+    def get_environments(self):
+        """Get the parsed environments.yaml.
+        """
+        return load_yaml(self.get_env_conf()) or {}
+
+    def get_env_config(self):
+        """Get a copy of the named environment's config.
+        """
+        env_name = self.get_env_name()
+        conf = self.get_environments()
+        if not 'environments' in conf:
+            raise ConfigError(
+                "Invalid environments.yaml, no 'environments' section")
+        if not env_name in conf['environments']:
+            raise ConfigError(
+                "Environment %r not in environments.yaml" % env_name)
+        return dict(conf['environments'][env_name])
+
+    def get_jenv(self):
+        """Get the parsed .jenv of a bootstrapped environment, or None.
+        """
+        jenv = os.path.join(
+            self.juju_home, "environments", "%s.jenv" % self.get_env_name())
+        if not os.path.exists(jenv):
+            return None
+        return load_yaml(jenv)
+
+    def get_apt_proxy(self):
+        """Get the apt proxy url machines are prepared with, or None.
+
+        Bootstrap --apt-cache records the bootstrap host's cache as the
+        environment's apt-http-proxy, which may also name any other
+        machine's cache.
+        """
+        jenv = self.get_jenv()
+        if jenv and jenv.get('bootstrap-config'):
+            conf = jenv['bootstrap-config']
+        else:
+            conf = self.get_env_config()
+        return conf.get('apt-http-proxy') or None
 
     def get_env_conf(self):
         """Get the environment config file.
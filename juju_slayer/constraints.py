@@ -8,9 +8,20 @@ CPUS = (1, 2, 4, 8, 12, 16)
 MEM = (1024, 2048, 4096, 6144, 8192, 12288, 16384, 32768, 49152, 65536)
 # Unit GB
 ROOT_DISK = (25, 100)
+# Unit Mbps
+NIC_SPEEDS = (10, 100, 1000)
 IMAGE_MAP = {
     'precise': 'UBUNTU_12_64',
     '12.0.4': 'UBUNTU_12_64'}
+# Bare metal operating systems are ordered by description.
+BARE_METAL_OS_MAP = {
+    'precise': 'Ubuntu Linux 12.04',
+    '12.0.4': 'Ubuntu Linux 12.04'}
+
+# Virtual guests or bare metal hardware.
+VIRTUAL = 'virtual'
+BARE_METAL = 'baremetal'
+MACHINE_TYPES = (VIRTUAL, BARE_METAL)
 
 # Record regions so we can offer nice aliases.
 # ams01,dal01,dal05,dal06,sea01,sjc01,sng01,wdc01
@@ -27,6 +38,9 @@ REGIONS = [
 
 VALID_REGIONS = [r['name'] for r in REGIONS]
 
+# Strategies for distributing a batch across a region list.
+SPREAD_STRATEGIES = ('round-robin', 'weighted', 'fill-first')
+
 ARCHES = ['amd64']
 
 # afaics, these are unavailable
@@ -39,7 +53,16 @@ SUFFIX_SIZES = {
     "t": 1024 * 1024,
     "p": 1024 * 1024 * 1024}
 
-VALID_CONSTRAINTS = set(['region', 'cpu-cores', 'root-disk', 'mem', 'arch'])
+VALID_CONSTRAINTS = set([
+    'region', 'cpu-cores', 'root-disk', 'mem', 'arch',
+    'nic-speed', 'private-network-only', 'private-vlan', 'public-vlan',
+    'local-disk', 'dedicated', 'disks', 'type', 'fallback'])
+
+# What a fallback policy may relax when an order can't be filled, ie.
+# fallback=size|region.
+FALLBACKS = ('size', 'region', 'disk')
+
+BOOLEANS = {'true': True, 'yes': True, 'false': False, 'no': False}
 
 
 def converted_size(s):
@@ -59,12 +82,19 @@ def parse_constraints(constraints):
     """
     c = {}
     parts = filter(None, constraints.split(","))
+    k = None
     for p in parts:
+        if '=' not in p:
+            # Continuation of a list value, ie. disks=100G,300G
+            if k != 'disks':
+                raise ConstraintError("Invalid constraint %s" % p)
+            c[k] = "%s,%s" % (c[k], p.strip())
+            continue
         k, v = p.split('=', 1)
-        c[k.strip()] = v.strip()
+        k = k.strip()
+        c[k] = v.strip()
 
-    unknown = set(c).difference(
-        set(['region', 'cpu-cores', 'root-disk', 'mem', 'arch']))
+    unknown = set(c).difference(VALID_CONSTRAINTS)
     if unknown:
         raise ConstraintError("Unknown constraints %s valid:%s" % (
             " ".join(unknown), ", ".join(VALID_CONSTRAINTS)))
@@ -72,15 +102,19 @@ def parse_constraints(constraints):
     if 'mem' in c:
         d = c.pop('mem')
         q = converted_size(d)
+        if q is None:
+            raise ConstraintError("Unknown memory size %s" % d)
         idx = bisect.bisect_left(MEM, q)
         if idx == len(MEM):
             raise ConstraintError(
-                "Invalid memory size %s valid: %s" % d,
-                ", ".join(["%sG" % (m/1024) for m in MEM]))
+                "Invalid memory size %s valid: %s" % (
+                    d, ", ".join(["%sG" % (m/1024) for m in MEM])))
         c['memory'] = MEM[idx]
     else:
         c['memory'] = MEM[0]
 
+    data_disks = c.pop('disks', None)
+
     if 'root-disk' in c:
         d = c.pop('root-disk')
         q = converted_size(d)
@@ -90,19 +124,47 @@ def parse_constraints(constraints):
         idx = bisect.bisect_left(ROOT_DISK, q)
         if idx == len(ROOT_DISK):
             raise ConstraintError(
-                "Invalid root-disk size %s valid: %s" % d,
-                ", ".join(["%sG" % r for r in ROOT_DISK]))
-        c['disks'] = [q]
+                "Invalid root-disk size %s valid: %s" % (
+                    d, ", ".join(["%sG" % r for r in ROOT_DISK])))
+        # The default root disk leaves the layout, and so images and
+        # recycled instances, open.
+        if ROOT_DISK[idx] != ROOT_DISK[0]:
+            c['disks'] = [ROOT_DISK[idx]]
+
+    if data_disks is not None:
+        d = data_disks
+        disks = []
+        for size in filter(None, [x.strip() for x in d.split(',')]):
+            q = converted_size(size)
+            if not q or q % 1024:
+                raise ConstraintError("Invalid disk size %s" % size)
+            disks.append(q / 1024)
+        if not disks:
+            raise ConstraintError("Invalid disks %s" % d)
+        # Data disks follow the root disk.
+        c['disks'] = c.get('disks', [ROOT_DISK[0]]) + disks
+
+    for k in ('local-disk', 'dedicated'):
+        if k in c:
+            d = c.pop(k)
+            if not d.lower() in BOOLEANS:
+                raise ConstraintError("Unknown %s value %s" % (k, d))
+            if k == 'local-disk':
+                c['local_disk'] = BOOLEANS[d.lower()]
+            elif BOOLEANS[d.lower()]:
+                c['dedicated'] = True
 
     if 'cpu-cores' in c:
         d = c.pop('cpu-cores')
         if not d.isdigit():
             raise ConstraintError(
-                "Unknown cpu-cores value %s valid: %s" % d, ", ".join(CPUS))
+                "Unknown cpu-cores value %s valid: %s" % (
+                    d, ", ".join(map(str, CPUS))))
         d = int(d)
         if not d in CPUS:
             raise ConstraintError(
-                "Unknown cpu-cores value %s valid: %s" % d, ", ".join(CPUS))
+                "Unknown cpu-cores value %s valid: %s" % (
+                    d, ", ".join(map(str, CPUS))))
         c['cpus'] = d
     else:
         c['cpus'] = 1
@@ -112,22 +174,165 @@ def parse_constraints(constraints):
         if not d in ARCHES:
             raise ConstraintError("Unsupported arch %s" % d)
 
+    if 'nic-speed' in c:
+        d = c.pop('nic-speed')
+        if not d.isdigit() or not int(d) in NIC_SPEEDS:
+            raise ConstraintError(
+                "Unknown nic-speed value %s valid: %s" % (
+                    d, ", ".join(map(str, NIC_SPEEDS))))
+        c['nic_speed'] = int(d)
+
+    if 'private-network-only' in c:
+        d = c.pop('private-network-only')
+        if not d.lower() in BOOLEANS:
+            raise ConstraintError(
+                "Unknown private-network-only value %s" % d)
+        if BOOLEANS[d.lower()]:
+            c['private'] = True
+
+    for k in ('private-vlan', 'public-vlan'):
+        if k in c:
+            d = c.pop(k)
+            if not d.isdigit():
+                raise ConstraintError("Unknown %s id %s" % (k, d))
+            c[k.replace('-', '_')] = int(d)
+
+    if 'fallback' in c:
+        d = c.pop('fallback')
+        policy = [p.strip() for p in d.split('|') if p.strip()]
+        if not policy or set(policy).difference(FALLBACKS):
+            raise ConstraintError("Unknown fallback %s valid: %s" % (
+                d, ", ".join(FALLBACKS)))
+        c['fallback'] = policy
+
+    if 'type' in c:
+        d = c.pop('type')
+        if not d in MACHINE_TYPES:
+            raise ConstraintError("Unknown type %s valid: %s" % (
+                d, ", ".join(MACHINE_TYPES)))
+        if d == BARE_METAL:
+            c['type'] = d
+            # Bare metal is single tenant on local disk.
+            unsupported = [name for k, name in (
+                ('disks', 'disks'), ('local_disk', 'local-disk'),
+                ('dedicated', 'dedicated'),
+                ('private', 'private-network-only'),
+                ('fallback', 'fallback')) if k in c]
+            if unsupported:
+                raise ConstraintError(
+                    "type=baremetal can't be used with %s" % ", ".join(
+                        sorted(unsupported)))
+
+    if c.get('private') and 'public_vlan' in c:
+        raise ConstraintError(
+            "public-vlan can't be used with private-network-only")
+
     if 'region' in c:
         d = c.pop('region')
-        for r in REGIONS:
-            if d == r['name']:
-                c['datacenter'] = r['id']
-                break
-            elif d in r['aliases']:
-                c['datacenter'] = r['id']
-                break
-        if not 'datacenter' in c:
-            raise ConstraintError("Unknown datacenter %s valid: %s" % (
-                d, ", ".join(VALID_REGIONS)))
+        regions = [_parse_region(r) for r in filter(None, d.split('|'))]
+        if len(regions) == 1 and regions[0][1] is None:
+            c['datacenter'] = regions[0][0]
+        elif regions:
+            c['datacenters'] = [(r, w or 1) for r, w in regions]
 
     return c
 
 
+def _parse_region(spec):
+    """Resolve a region name or alias with an optional ':weight' suffix.
+    """
+    weight = None
+    spec = spec.strip()
+    if ':' in spec:
+        spec, weight = spec.split(':', 1)
+        if not weight.isdigit() or not int(weight):
+            raise ConstraintError("Invalid region weight %s" % weight)
+        weight = int(weight)
+    for r in REGIONS:
+        if spec == r['name'] or spec in r['aliases']:
+            return r['id'], weight
+    raise ConstraintError("Unknown datacenter %s valid: %s" % (
+        spec, ", ".join(VALID_REGIONS)))
+
+
+def spread_datacenters(datacenters, count, strategy='round-robin'):
+    """Assign a datacenter to each of count machines.
+
+    datacenters is a list of (datacenter, weight) pairs. With round-robin
+    the weights are ignored, with weighted machines are distributed in
+    proportion to them, and with fill-first each weight is the number of
+    machines to place in a datacenter before moving on to the next one.
+
+    The result is interleaved across datacenters so that queued orders
+    hit every datacenter concurrently.
+    """
+    if strategy not in SPREAD_STRATEGIES:
+        raise ConstraintError("Unknown spread strategy %s valid: %s" % (
+            strategy, ", ".join(SPREAD_STRATEGIES)))
+
+    names = [d for d, w in datacenters]
+    counts = dict.fromkeys(names, 0)
+    if strategy == 'round-robin':
+        for i in range(count):
+            counts[names[i % len(names)]] += 1
+    elif strategy == 'weighted':
+        total = sum(w for d, w in datacenters)
+        shares = [(count * w / float(total), d) for d, w in datacenters]
+        for share, d in shares:
+            counts[d] = int(share)
+        # Hand out the remainder by largest fractional share.
+        remaining = count - sum(counts.values())
+        for share, d in sorted(
+                shares, key=lambda x: x[0] - int(x[0]), reverse=True):
+            if not remaining:
+                break
+            counts[d] += 1
+            remaining -= 1
+    else:
+        remaining = count
+        for d, w in datacenters:
+            counts[d] = min(w, remaining)
+            remaining -= counts[d]
+        # Capacity exhausted, wrap around the list.
+        for i in range(remaining):
+            counts[names[i % len(names)]] += 1
+
+    plan = []
+    while len(plan) < count:
+        for d in names:
+            if counts[d]:
+                plan.append(d)
+                counts[d] -= 1
+    return plan
+
+
+def fallback_params(params, policy, datacenters=()):
+    """Return ranked alternatives to params, for orders lacking capacity.
+
+    Each alternative relaxes one dimension of the policy, in its order.
+    size steps up to the next memory size then the next cpu-cores count,
+    region moves to each other datacenter of the region list, and disk
+    swaps san and local storage.
+    """
+    alternatives = []
+    for dimension in policy:
+        if dimension == 'size':
+            idx = bisect.bisect_right(MEM, params['memory'])
+            if idx < len(MEM):
+                alternatives.append(dict(params, memory=MEM[idx]))
+            idx = bisect.bisect_right(CPUS, params['cpus'])
+            if idx < len(CPUS):
+                alternatives.append(dict(params, cpus=CPUS[idx]))
+        elif dimension == 'region':
+            for d in datacenters:
+                if d != params.get('datacenter'):
+                    alternatives.append(dict(params, datacenter=d))
+        elif dimension == 'disk':
+            alternatives.append(dict(
+                params, local_disk=not params.get('local_disk', False)))
+    return alternatives
+
+
 def solve_constraints(constraints):
     """Return machine size and region.
     """
@@ -0,0 +1,240 @@
+"""
+Long running daemon serving commands over a local unix socket.
+
+Each invocation otherwise pays interpreter startup, provider client
+construction, ssh key listing and loading the ordering catalog. The
+daemon keeps the provider session with its keep-alive connections and
+listed ssh keys, the ordering catalog and parsed environment files
+across commands. The journal, instance pool and image registry are
+shared with invocations outside the daemon, so they're still read from
+disk by each command.
+
+The cli sends its parsed options to a running daemon and streams back
+the command's output, or runs the command itself when no daemon is
+listening. A command whose client goes away is cancelled.
+"""
+import argparse
+import errno
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+
+from juju_slayer.exceptions import PrecheckError
+from juju_slayer import runner
+
+log = logging.getLogger("juju.slayer")
+
+
+def call(path, options, stdout=None, stderr=None):
+    """Run a command on the daemon, streaming its output to ours.
+
+    Returns the command's exit status, or None if no daemon is listening.
+    """
+    streams = (('stdout', stdout or sys.stdout),
+               ('stderr', stderr or sys.stderr))
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+    try:
+        sock.sendall(json.dumps({'options': vars(options)}) + "\n")
+        for line in sock.makefile('r'):
+            message = json.loads(line)
+            if 'exit' in message:
+                return message['exit']
+            for name, stream in streams:
+                if name in message:
+                    stream.write(message[name])
+                    stream.flush()
+    finally:
+        sock.close()
+    (stderr or sys.stderr).write("Lost connection to daemon %s\n" % path)
+    return 1
+
+
+class Channel(object):
+    """File like stream of a command's output back to its client.
+    """
+
+    def __init__(self, conn, lock, name):
+        self.conn = conn
+        self.lock = lock
+        self.name = name
+
+    def write(self, data):
+        self.send(self.conn, self.lock, {self.name: data})
+
+    def flush(self):
+        pass
+
+    @staticmethod
+    def send(conn, lock, message):
+        with lock:
+            try:
+                conn.sendall(json.dumps(message) + "\n")
+            except socket.error:
+                # The client went away, its watcher cancels the command.
+                pass
+
+
+class Daemon(object):
+
+    def __init__(self, path, provider):
+        self.path = path
+        self.provider = provider
+        # Commands take over the process' stdout and logging while they
+        # run, so they're run one at a time.
+        self.lock = threading.Lock()
+        self.sock = None
+        self.stopped = False
+        # Catalog and other account state kept warm across commands.
+        self.cache = {}
+
+    def bind(self):
+        parent = os.path.dirname(self.path)
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                # Left behind by a daemon that died.
+                os.remove(self.path)
+            else:
+                raise PrecheckError(
+                    "Daemon already serving on %s" % self.path)
+            finally:
+                probe.close()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        os.chmod(self.path, 0600)
+        self.sock.listen(16)
+
+    def serve(self):
+        if self.sock is None:
+            self.bind()
+        sock = self.sock
+        log.info("Serving commands on %s", self.path)
+        try:
+            while not self.stopped:
+                try:
+                    conn, _ = sock.accept()
+                except socket.error, e:
+                    if self.stopped or e.errno == errno.EBADF:
+                        break
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                handler = threading.Thread(target=self.handle, args=(conn,))
+                handler.daemon = True
+                handler.start()
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.stopped = True
+        # Called from both the serving thread and whoever stops it.
+        sock, self.sock = self.sock, None
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        sock.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def handle(self, conn):
+        lock = threading.Lock()
+        gone = threading.Event()
+        running = threading.Event()
+        try:
+            request = json.loads(conn.makefile('r').readline())
+            watcher = threading.Thread(
+                target=self.watch, args=(conn, gone, running))
+            watcher.daemon = True
+            watcher.start()
+            if not self.lock.acquire(False):
+                Channel.send(conn, lock, {
+                    'stderr': "Waiting on the daemon's running command\n"})
+                self.lock.acquire()
+            try:
+                runner.cancelled.clear()
+                running.set()
+                if gone.is_set():
+                    log.info("Client went away before its command ran")
+                    return
+                status = self.execute(
+                    argparse.Namespace(**request['options']),
+                    Channel(conn, lock, 'stdout'),
+                    Channel(conn, lock, 'stderr'))
+            finally:
+                running.clear()
+                self.lock.release()
+            Channel.send(conn, lock, {'exit': status})
+        except Exception:
+            log.exception("Error handling daemon request")
+        finally:
+            conn.close()
+
+    def watch(self, conn, gone, running):
+        """Cancel the client's command if it goes away while it runs.
+
+        Clients send nothing after their request, so reading returns
+        once they disconnect.
+        """
+        try:
+            conn.recv(1)
+        except socket.error:
+            pass
+        gone.set()
+        if running.is_set():
+            log.info("Client went away, cancelling its command")
+            runner.cancelled.set()
+
+    def execute(self, options, stdout, stderr):
+        """Run a command with its output sent to the client's streams.
+        """
+        from juju_slayer.cli import LOG_DATE_FORMAT, LOG_FORMAT, run_command
+        from juju_slayer.config import Config
+        from juju_slayer.exceptions import ConfigError
+
+        config = Config(options, self.cache)
+        handler = logging.StreamHandler(stderr)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+        handler.setLevel(config.verbose and logging.DEBUG or logging.INFO)
+        root = logging.getLogger()
+        root_level = root.level
+        # Pass debug records to the client's handler, our own handlers
+        # keep their levels.
+        for h in root.handlers:
+            if h.level == logging.NOTSET:
+                h.setLevel(root_level)
+        root.setLevel(logging.DEBUG)
+        root.addHandler(handler)
+        real_stdout, sys.stdout = sys.stdout, stdout
+        try:
+            config.validate()
+            return run_command(config, self.provider, options.command)
+        except ConfigError, e:
+            print("Configuration error: %s" % str(e))
+            return 1
+        except runner.Cancelled:
+            log.info("Cancelled %s", options.command)
+            return 1
+        except Exception:
+            log.exception("Error running %s", options.command)
+            return 1
+        finally:
+            sys.stdout = real_stdout
+            root.removeHandler(handler)
+            root.setLevel(root_level)
@@ -1,12 +1,16 @@
 import httplib
 import logging
+import re
 import shutil
 import subprocess
 import socket
+import tempfile
 
 import os
 import yaml
 
+from juju_slayer.config import parse_yaml
+
 log = logging.getLogger("juju.slayer")
 
 
@@ -28,30 +32,23 @@ class Environment(object):
         try:
             return subprocess.check_output(args, env=env, stderr=stderr)
         except subprocess.CalledProcessError, e:
-            import pdb; pdb.set_trace()
             log.error(
                 "Failed to run command %s\n%s",
                 ' '.join(args), e.output)
             raise
 
     def status(self):
-        return yaml.safe_load(self._run(['status']))
+        return parse_yaml(self._run(['status']))
 
     def is_running(self):
         """Try to connect the api server websocket to see if env is running.
         """
-        name = self.config.get_env_name()
-        jenv = os.path.join(
-            self.config.juju_home, "environments", "%s.jenv" % name)
-        if not os.path.exists(jenv):
+        data = self.config.get_jenv()
+        if not data:
+            return False
+        conf = data.get('bootstrap-config')
+        if not conf['type'] in ('manual', 'null'):
             return False
-        with open(jenv) as fh:
-            data = yaml.safe_load(fh.read())
-            if not data:
-                return False
-            conf = data.get('bootstrap-config')
-            if not conf['type'] in ('manual', 'null'):
-                return False
         conn = httplib.HTTPSConnection(
             conf['bootstrap-host'], port=17070, timeout=3)
         try:
@@ -61,7 +58,13 @@ class Environment(object):
             return False
 
     def add_machine(self, location):
-        return self._run(['add-machine', location], capture_err=True)
+        """Add a machine to the environment, returning its juju machine id.
+        """
+        output = self._run(['add-machine', location], capture_err=True)
+        match = re.search(r"created machine (\S+)", output)
+        if match:
+            return match.group(1)
+        return output.strip()
 
     def terminate_machines(self, machines):
         cmd = ['terminate-machine', '--force']
@@ -75,27 +78,32 @@ class Environment(object):
     def bootstrap(self):
         return self._run(['bootstrap', '-v'])
 
-    def bootstrap_jenv(self, host):
+    def bootstrap_jenv(self, host, apt_proxy=None):
         """Bootstrap an environment in a sandbox.
 
         Manual provider config keeps transient state in the form of
-        bootstrap-host for its config.
+        bootstrap-host for its config. An apt proxy set up on the
+        bootstrap host is recorded as the environment's apt-http-proxy,
+        which juju applies to the machines it provisions.
 
-        A temporary JUJU_HOME is used to modify environments.yaml
+        A temporary JUJU_HOME is used to modify environments.yaml, private
+        to this invocation so concurrent ones can't clobber it.
         """
         env_name = self.config.get_env_name()
 
         # Prep a new juju home
-        boot_home = os.path.join(
-            self.config.juju_home, "boot-%s" % env_name)
-
-        if not os.path.exists(boot_home):
-            os.makedirs(os.path.join(boot_home, 'environments'))
+        boot_home = tempfile.mkdtemp(
+            prefix="boot-%s-" % env_name, dir=self.config.juju_home)
+        os.makedirs(os.path.join(boot_home, 'environments'))
 
         # Check that this installation has been used before.
         jenv_dir = os.path.join(self.config.juju_home, 'environments')
         if not os.path.exists(jenv_dir):
-            os.mkdir(jenv_dir)
+            try:
+                os.mkdir(jenv_dir)
+            except OSError:
+                if not os.path.isdir(jenv_dir):
+                    raise
 
         ssh_key_dir = os.path.join(self.config.juju_home, 'ssh')
 
@@ -109,10 +117,10 @@ class Environment(object):
             os.path.join(boot_home, 'ssh'))
 
         # Updated env config with the bootstrap host.
-        with open(self.config.get_env_conf()) as fh:
-            data = yaml.safe_load(fh.read())
-            env_conf = data['environments'].get(env_name)
+        env_conf = self.config.get_env_config()
         env_conf['bootstrap-host'] = host
+        if apt_proxy:
+            env_conf['apt-http-proxy'] = apt_proxy
         with open(os.path.join(
                 boot_home, 'environments.yaml'), 'w') as fh:
             fh.write(yaml.safe_dump({'environments': {env_name: env_conf}}))
@@ -127,12 +135,14 @@ class Environment(object):
 
         try:
             self._run(cmd, env=env, capture_err=True)
-            # Copy over the jenv
+            # Copy over the jenv, replacing any existing one atomically so
+            # concurrent readers never see a partial file.
+            fd, tmp_path = tempfile.mkstemp(dir=jenv_dir, suffix=".tmp")
+            os.close(fd)
             shutil.copy(
                 os.path.join(
                     boot_home, "environments", "%s.jenv" % env_name),
-                os.path.join(
-                    self.config.juju_home,
-                    "environments", "%s.jenv" % env_name))
+                tmp_path)
+            os.rename(tmp_path, os.path.join(jenv_dir, "%s.jenv" % env_name))
         finally:
             shutil.rmtree(boot_home)
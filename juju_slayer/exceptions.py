@@ -29,6 +29,16 @@ class ProviderError(Exception):
     """
 
 
+class QualificationError(ProviderError):
+    """No instance met the qualification thresholds.
+    """
+
+
+class CassetteError(Exception):
+    """A call couldn't be replayed from the cassette.
+    """
+
+
 class ProviderAPIError(Exception):
     """
     """
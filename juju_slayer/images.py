@@ -0,0 +1,98 @@
+"""
+Registry of captured image templates, by series and datacenter.
+
+Each entry keeps the templates it superseded, so pruning only ever
+deletes templates this registry captured.
+"""
+import os
+import tempfile
+import time
+import yaml
+
+from juju_slayer.lock import FileLock
+
+# Name prefix for templates captured by the plugin.
+IMAGE_PREFIX = "juju-"
+
+
+class ImageRegistry(object):
+
+    def __init__(self, path):
+        self.path = path
+        # Held against other invocations while updating.
+        self.lock_path = self.path + ".lock"
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as fh:
+            return yaml.safe_load(fh.read()) or {}
+
+    def save(self, data):
+        parent = os.path.dirname(self.path)
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        fd, tmp_path = tempfile.mkstemp(dir=parent)
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(yaml.safe_dump(data, default_flow_style=False))
+        os.rename(tmp_path, self.path)
+
+    def get(self, series, datacenter):
+        """Get the image for a series in the datacenter, or None.
+        """
+        return self.load().get(series, {}).get(datacenter)
+
+    def record(self, series, datacenter, image):
+        with FileLock(self.lock_path):
+            data = self.load()
+            images = data.setdefault(series, {})
+            superseded = []
+            previous = images.get(datacenter)
+            if previous is not None:
+                superseded = previous.pop('superseded', []) + [previous]
+            images[datacenter] = {
+                'id': image.id,
+                'globalIdentifier': image.global_id,
+                'name': image.name,
+                'created': time.time(),
+                'superseded': superseded}
+            self.save(data)
+
+    def items(self):
+        """Return (series, datacenter, image) for every registered image.
+        """
+        results = []
+        for series, images in sorted(self.load().items()):
+            for datacenter, image in sorted(images.items()):
+                results.append((series, datacenter, image))
+        return results
+
+    def superseded(self):
+        """Return (series, datacenter, image) for every image a later
+        capture superseded.
+        """
+        results = []
+        for series, datacenter, image in self.items():
+            for old in image.get('superseded', ()):
+                results.append((series, datacenter, old))
+        return results
+
+    def prune(self, global_ids):
+        """Remove registered images not in global_ids, returning them.
+
+        Superseded images not in global_ids are forgotten.
+        """
+        with FileLock(self.lock_path):
+            data = self.load()
+            removed = []
+            for series, images in data.items():
+                for datacenter, image in images.items():
+                    image['superseded'] = [
+                        i for i in image.get('superseded', ())
+                        if i['globalIdentifier'] in global_ids]
+                    if image['globalIdentifier'] not in global_ids:
+                        removed.append(images.pop(datacenter))
+                if not images:
+                    data.pop(series)
+            self.save(data)
+        return removed
@@ -0,0 +1,108 @@
+"""
+Join of juju machines to the provider instances backing them.
+"""
+import socket
+
+# Instances are tagged with their machine id when registered.
+MACHINE_TAG = "juju-machine-%s"
+
+
+def resolve_address(address):
+    """Resolve a machine's dns-name to an ip address.
+
+    Juju does a reverse ip lookup to dns name which softlayer has mapped
+    to 198.23.106.29-static.reverse.softlayer.com. An account may also
+    have this mapped to a custom domain so we always resolve to ip
+    address as we map to provider instances by ip address.
+    """
+    if not address:
+        return None
+    try:
+        return socket.gethostbyname(address)
+    except socket.error:
+        return None
+
+
+class MachineIndex(object):
+    """Machines are matched to instances through the journal registry,
+    then instance machine tags, then ip address.
+    """
+
+    def __init__(self, status, instances, registry=None, pending=(),
+                 parked=()):
+        self.machines = status.get('machines', {})
+        self.services = status.get('services') or {}
+        self.instances = instances
+        # Machine id to instance id, of machines we registered.
+        self.registry = registry or {}
+        # Instance ids of journaled ops still in progress.
+        self.pending = set(pending)
+        # Instance ids of recycled instances parked for reuse.
+        self.parked = set(parked)
+        self.instance_of = {}
+        self.machine_of = {}
+        self._build()
+
+    def _build(self):
+        by_id = {}
+        by_tag = {}
+        by_address = {}
+        for i in self.instances:
+            by_id[i.id] = i
+            for address in (i.ip_address, i.private_ip_address):
+                if address:
+                    by_address[address] = i
+            for tag in i.tags:
+                by_tag[tag] = i
+
+        for m in sorted(self.machines):
+            instance = by_id.get(self.registry.get(m))
+            if instance is None:
+                instance = by_tag.get(MACHINE_TAG % m)
+            if instance is None:
+                instance = by_address.get(
+                    resolve_address(self.machines[m].get('dns-name')))
+            if instance is None or instance.id in self.machine_of:
+                continue
+            self.instance_of[m] = instance
+            self.machine_of[instance.id] = m
+
+    def unmatched(self):
+        """Machines without a provider instance.
+        """
+        return sorted(m for m in self.machines if m not in self.instance_of)
+
+    def occupied(self):
+        """Machines hosting service units, directly or in containers.
+        """
+        machines = set()
+        for service in self.services.values():
+            for unit in (service.get('units') or {}).values():
+                if unit.get('machine'):
+                    machines.add(unit['machine'].split('/')[0])
+        return machines
+
+    def dead(self):
+        return sorted(m for m in self.machines
+                      if self.machines[m].get('life', '') == 'dead')
+
+    def recycled(self):
+        """Instances parked for reuse.
+        """
+        return [i for i in self.instances
+                if i.id not in self.machine_of and i.id in self.parked]
+
+    def provisioning(self):
+        """Unregistered instances still provisioning or part of an op.
+        """
+        return [i for i in self.instances
+                if i.id not in self.machine_of and i.id not in self.parked and
+                (i.provisioning or i.id in self.pending)]
+
+    def orphans(self):
+        """Provisioned instances the environment doesn't know about.
+        """
+        known = self.pending | self.parked
+        return [i for i in self.instances
+                if i.id not in self.machine_of and
+                not i.provisioning and i.id not in known]
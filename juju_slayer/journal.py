@@ -0,0 +1,132 @@
+"""
+Durable per environment record of machine op progress.
+
+Each step an op completes is appended as a json line and synced to disk
+before the op moves on, so an interrupted batch can be resumed at the
+last completed step instead of ordering new instances.
+
+Concurrent invocations against an environment share its journal. Each
+op records the run that owns it, and resume only claims ops whose run
+has died.
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger("juju.slayer")
+
+# In order of completion. Only bare metal orders are allocated separately,
+# and only ops given thresholds are qualified. Ops resumed by another run
+# are also recorded as 'claimed'. An op whose instance was disqualified
+# is recorded as 'replaced', and starts over from its order. An op whose
+# instance was garbage collected is recorded as 'abandoned', and one that
+# failed in a way resuming can't fix, ie. its order was refused, as
+# 'failed'. Neither is pending any longer.
+STEPS = ('queued', 'ordered', 'allocated', 'provisioned', 'ssh', 'prepared',
+         'qualified', 'registered')
+
+
+class Journal(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _open(self, mode, lock):
+        parent = os.path.dirname(self.path)
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        fh = open(self.path, mode)
+        fcntl.flock(fh, lock)
+        return fh
+
+    def _append(self, fh, op_id, step, **data):
+        entry = dict(data)
+        entry.update({'op': op_id, 'step': step, 'time': time.time()})
+        # Terminate any torn write so it doesn't swallow this entry.
+        fh.seek(0, os.SEEK_END)
+        if fh.tell():
+            fh.seek(-1, os.SEEK_END)
+            if fh.read(1) != "\n":
+                fh.write("\n")
+        fh.write(json.dumps(entry) + "\n")
+        fh.flush()
+        os.fsync(fh.fileno())
+
+    def record(self, op_id, step, **data):
+        with self.lock:
+            with self._open('a+', fcntl.LOCK_EX) as fh:
+                self._append(fh, op_id, step, **data)
+
+    def load(self):
+        """Return the state of every journaled op keyed by op id.
+
+        An op's state is the merge of all its recorded entries, with the
+        names of the completed steps under 'steps'.
+        """
+        if not os.path.exists(self.path):
+            return {}
+        with self.lock:
+            with self._open('r', fcntl.LOCK_SH) as fh:
+                return self._parse(fh.readlines())
+
+    def _parse(self, lines):
+        ops = {}
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A torn write from an interrupted run, the step didn't
+                # complete so its safe to ignore.
+                log.debug("Skipping partial journal entry %r", line)
+                continue
+            state = ops.setdefault(
+                entry['op'], {'steps': [], 'created': entry['time']})
+            step = entry.pop('step')
+            if step == 'replaced':
+                state['steps'] = ['queued']
+                for key in ('instance_id', 'account', 'address'):
+                    state.pop(key, None)
+            state['steps'].append(step)
+            state.update(entry)
+        return ops
+
+    def claim(self, run_id, alive):
+        """Claim pending ops whose run isn't alive for run_id, oldest first.
+
+        The journal is held exclusively while claiming, so concurrent
+        resumes never claim the same op.
+        """
+        with self.lock:
+            with self._open('a+', fcntl.LOCK_EX) as fh:
+                fh.seek(0)
+                ops = self._parse(fh.readlines())
+                claimed = [s for s in _pending(ops)
+                           if not (s.get('run') and alive(s['run']))]
+                for state in claimed:
+                    self._append(fh, state['op'], 'claimed', run=run_id)
+                    state['run'] = run_id
+        return claimed
+
+    def pending(self):
+        """Return the state of ops that haven't been registered, oldest first.
+        """
+        return _pending(self.load())
+
+    def registry(self):
+        """Return instance ids keyed by the juju machine ids they back.
+        """
+        return dict((s['machine_id'], s['instance_id'])
+                    for s in self.load().values()
+                    if 'registered' in s['steps'] and 'instance_id' in s)
+
+
+def _pending(ops):
+    pending = [s for s in ops.values()
+               if not set(s['steps']).intersection(
+                   ('registered', 'abandoned', 'failed'))]
+    pending.sort(key=lambda s: s['created'])
+    return pending
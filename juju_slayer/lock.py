@@ -0,0 +1,105 @@
+"""
+Advisory file locks coordinating concurrent plugin invocations.
+
+Locks are flock(2) based, so they're released by the kernel when a
+process exits however it exits, and a stale lock file is never held.
+"""
+import errno
+import fcntl
+import logging
+import os
+
+log = logging.getLogger("juju.slayer")
+
+# Modes commands hold their environment's lock in.
+SHARED = 'shared'
+EXCLUSIVE = 'exclusive'
+
+
+def _ensure_parent(path):
+    parent = os.path.dirname(path)
+    if not os.path.exists(parent):
+        try:
+            os.makedirs(parent)
+        except OSError, e:
+            # Created concurrently.
+            if e.errno != errno.EEXIST:
+                raise
+
+
+class FileLock(object):
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self.fh = None
+
+    def acquire(self, blocking=True):
+        """Acquire the lock, returning False if not blocking and it's held.
+        """
+        _ensure_parent(self.path)
+        mode = self.shared and fcntl.LOCK_SH or fcntl.LOCK_EX
+        fh = open(self.path, 'a')
+        try:
+            fcntl.flock(fh, mode | fcntl.LOCK_NB)
+        except IOError, e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                fh.close()
+                raise
+            if not blocking:
+                fh.close()
+                return False
+            log.info("Waiting on %s, held by another invocation", self.path)
+            fcntl.flock(fh, mode)
+        self.fh = fh
+        return True
+
+    def release(self):
+        if self.fh is not None:
+            fcntl.flock(self.fh, fcntl.LOCK_UN)
+            self.fh.close()
+            self.fh = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
+
+
+class RunRegistry(object):
+    """Liveness of invocations, each holds its run lock for its lifetime.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.held = {}
+
+    def _lock_path(self, run_id):
+        return os.path.join(self.path, "%s.lock" % run_id)
+
+    def start(self, run_id):
+        lock = FileLock(self._lock_path(run_id))
+        lock.acquire()
+        self.held[run_id] = lock
+
+    def stop(self, run_id):
+        lock = self.held.pop(run_id, None)
+        if lock is not None:
+            lock.release()
+            os.remove(lock.path)
+
+    def alive(self, run_id):
+        if run_id in self.held:
+            return True
+        path = self._lock_path(run_id)
+        if not os.path.exists(path):
+            return False
+        lock = FileLock(path)
+        if not lock.acquire(blocking=False):
+            return True
+        # Left behind by an invocation that died.
+        os.remove(path)
+        lock.release()
+        return False
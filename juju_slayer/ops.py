@@ -1,9 +1,14 @@
 import logging
 import time
 import subprocess
+import uuid
 
-from juju_slayer.exceptions import TimeoutError
-from juju_slayer import ssh
+from juju_slayer.constraints import BARE_METAL, VIRTUAL
+from juju_slayer.exceptions import (
+    ProviderError, QualificationError, TimeoutError)
+from juju_slayer.index import MACHINE_TAG
+from juju_slayer.provider import is_capacity_error, is_refusal
+from juju_slayer import autoscale, qualify, ssh
 
 log = logging.getLogger("juju.slayer")
 
@@ -16,24 +21,155 @@ class MachineOp(object):
         self.params = params
         self.created = time.time()
         self.options = options
+        self.journal = options.get('journal')
+        self.op_id = options.get('op_id') or uuid.uuid4().hex
+        # Journaled state of a previous attempt at this op.
+        self.resume = options.get('resume') or {}
 
     def run(self):
         raise NotImplementedError()
 
+    def completed(self, step):
+        return step in self.resume.get('steps', ())
+
+    def record(self, step, **data):
+        if self.journal is not None:
+            self.journal.record(self.op_id, step, **data)
+
 
 class MachineAdd(MachineOp):
 
     timeout = 360
+    # Bare metal reboots through a full hardware post.
+    bare_metal_timeout = 1800
     delay = 8
 
+    # Disqualified instances replaced before the op gives up.
+    max_replacements = 3
+    # Attempts at benchmarking an instance before the op gives up on it.
+    benchmark_attempts = 3
+
     def run(self):
-        instance = self.provider.launch_instance(self.params)
-        self.provider.wait_on(instance)
-        instance = self.provider.get_instance(instance.id)
-        self.verify_ssh(instance)
-        # Sigh.. install curl
-        if self.params.get('os_code', '') == 'UBUNTU_12_64':
-            self.update_image(instance)
+        try:
+            return self.acquire()
+        except Exception, e:
+            # Resuming would only fail the same way again.
+            if isinstance(e, QualificationError) or is_refusal(e):
+                self.record('failed', error=str(e))
+            raise
+
+    def acquire(self):
+        kind = self.params.get('type', VIRTUAL)
+        thresholds = self.options.get('qualify')
+        # Bare metal is dedicated, there are no neighbours to be noisy.
+        if not thresholds or kind == BARE_METAL:
+            return self.provision(kind)
+        for attempt in range(self.max_replacements + 1):
+            instance = self.provision(kind)
+            if self.completed('qualified'):
+                return instance
+            failures = self.qualify(instance, thresholds)
+            if not failures:
+                self.record('qualified')
+                return instance
+            log.warning("Instance id:%s ip:%s failed qualification: %s",
+                        instance.id, instance.ip_address,
+                        ", ".join(failures))
+            self.provider.terminate_instance(instance.id, instance.kind)
+            self.record('replaced', rejected=instance.id)
+            # Start over with a fresh order.
+            self.resume = {}
+        raise QualificationError(
+            "No instance qualified after %d replacements" % (
+                self.max_replacements))
+
+    def provision(self, kind):
+        if kind == BARE_METAL:
+            instance = self.order_hardware()
+        elif self.completed('ordered'):
+            instance = self.provider.get_instance(self.resume['instance_id'])
+            log.debug("Resuming op on instance id:%s", instance.id)
+        else:
+            instance, rank = self.launch()
+            self.record('ordered', instance_id=instance.id,
+                        account=instance.account, fallback=rank)
+        if not self.completed('provisioned'):
+            self.provider.wait_on(instance)
+            self.record('provisioned')
+        instance = self.provider.get_instance(instance.id, kind)
+        if not self.completed('ssh'):
+            self.verify_ssh(instance)
+            self.record('ssh')
+        if not self.completed('prepared'):
+            if self.options.get('apt_proxy'):
+                self.use_apt_proxy(instance, self.options['apt_proxy'])
+            # Sigh.. install curl
+            if (self.params.get('os_code', '') == 'UBUNTU_12_64' or
+                    kind == BARE_METAL):
+                self.update_image(instance)
+            self.record('prepared', address=instance.ip_address)
+        return instance
+
+    def launch(self):
+        """Order the instance, returning it with the rank of its params.
+
+        Orders refused for lack of capacity move down the ranked fallback
+        params, rank 0 being the solved params.
+        """
+        candidates = [self.params] + list(self.options.get('fallbacks') or ())
+        for rank, params in enumerate(candidates):
+            try:
+                return self.provider.launch_instance(params), rank
+            except Exception, e:
+                if not is_capacity_error(e) or rank == len(candidates) - 1:
+                    raise
+                log.warning("No capacity for %s, ordering fallback %d %s",
+                            params['hostname'], rank + 1,
+                            _describe(candidates[rank + 1]))
+
+    def qualify(self, instance, thresholds):
+        """Benchmark the instance, returning the thresholds it fails.
+
+        Failing to run the benchmarks says nothing of the instance, so
+        they're retried and the op fails rather than disqualifying it.
+        """
+        t = time.time()
+        for attempt in range(self.benchmark_attempts):
+            try:
+                results = qualify.benchmark(instance.ip_address)
+                break
+            except subprocess.CalledProcessError, e:
+                log.warning("Could not benchmark id:%s ip:%s\n%s",
+                            instance.id, instance.ip_address, e.output)
+                time.sleep(self.delay)
+        else:
+            raise ProviderError(
+                "Could not benchmark id:%s ip:%s, resume to retry" % (
+                    instance.id, instance.ip_address))
+        log.debug("Benchmarked id:%s ip:%s in %0.2f seconds: %s",
+                  instance.id, instance.ip_address, time.time() - t,
+                  " ".join("%s=%s" % r for r in sorted(results.items())))
+        return qualify.check(results, thresholds)
+
+    def order_hardware(self):
+        """Order bare metal, returning the hardware once allocated.
+
+        Hardware is allocated to an order asynchronously, so the order and
+        the allocation are journaled as separate steps.
+        """
+        if self.resume.get('instance_id'):
+            instance = self.provider.get_instance(
+                self.resume['instance_id'], BARE_METAL)
+            log.debug("Resuming op on bare metal id:%s", instance.id)
+            return instance
+        if not self.completed('ordered'):
+            self.provider.launch_instance(self.params)
+            self.record('ordered', hostname=self.params['hostname'])
+        log.debug("Waiting on bare metal order %s", self.params['hostname'])
+        instance = self.provider.find_hardware(
+            self.params['hostname'], self.params['domain'])
+        self.record('allocated', instance_id=instance.id,
+                    account=instance.account)
         return instance
 
     def update_image(self, instance):
@@ -48,13 +184,29 @@ class MachineAdd(MachineOp):
             "Update precise instance %s complete in %0.2f seconds",
             instance.ip_address, time.time() - t)
 
+    def use_apt_proxy(self, instance, proxy):
+        """Point the instance's package installs at the environment's cache.
+        """
+        try:
+            enabled = ssh.use_apt_proxy(instance.ip_address, proxy)
+        except subprocess.CalledProcessError, e:
+            log.warning("Could not configure apt proxy on id:%s ip:%s\n%s",
+                        instance.id, instance.ip_address, e.output)
+            return
+        if not enabled:
+            log.warning("Apt proxy %s unreachable from id:%s ip:%s",
+                        proxy, instance.id, instance.ip_address)
+
     def verify_ssh(self, instance):
         """Workaround for manual provisioning and ssh availability.
 
         Manual provider bails immediately upon failure to connect on
         ssh, we loop to allow the instance time to start ssh.
         """
-        max_time = self.timeout + time.time()
+        timeout = self.timeout
+        if instance.kind == BARE_METAL:
+            timeout = self.bare_metal_timeout
+        max_time = timeout + time.time()
         running = False
         while max_time > time.time():
             try:
@@ -84,11 +236,30 @@ class MachineAdd(MachineOp):
                     instance.id, instance.name, instance.ip_address))
 
 
+def _describe(params):
+    return "cpus:%s memory:%s datacenter:%s local_disk:%s" % (
+        params.get('cpus'), params.get('memory'), params.get('datacenter'),
+        params.get('local_disk'))
+
+
 class MachineRegister(MachineAdd):
 
     def run(self):
         instance = super(MachineRegister, self).run()
+        # When provisioned alongside bootstrap, wait on the state server.
+        gate = self.options.get('gate')
+        if gate is not None and not gate.wait():
+            raise ProviderError(
+                "State server unavailable, not registering id:%s ip:%s" % (
+                    instance.id, instance.ip_address))
         machine_id = self.env.add_machine("ssh:root@%s" % instance.ip_address)
+        self.record('registered', machine_id=machine_id)
+        try:
+            self.provider.tag_instance(
+                instance.id, [MACHINE_TAG % machine_id], instance.kind)
+        except Exception:
+            log.warning("Could not tag id:%s as machine %s",
+                        instance.id, machine_id, exc_info=True)
         return instance, machine_id
 
 
@@ -97,4 +268,123 @@ class MachineDestroy(MachineOp):
     def run(self):
         self.env.terminate_machines([self.params['machine_id']])
         log.debug("Destroying instance %s", self.params['instance_id'])
-        self.provider.terminate_instance(self.params['instance_id'])
+        self.provider.terminate_instance(
+            self.params['instance_id'], self.params.get('kind', VIRTUAL))
+
+
+class InstanceCancel(MachineOp):
+
+    def run(self):
+        """Cancel an instance no juju machine or op in progress owns.
+        """
+        instance = self.params['instance']
+        self.provider.terminate_instance(instance.id, instance.kind)
+        return instance
+
+
+class MachineRecycle(MachineOp):
+
+    def run(self):
+        """Remove the machine from juju and park its reloaded instance.
+        """
+        self.env.terminate_machines([self.params['machine_id']])
+        instance = self.params['instance']
+        log.debug("Reloading instance %s for reuse", instance.id)
+        self.provider.reload_instance(
+            instance.id, ssh_keys=self.params['ssh_keys'], kind=instance.kind)
+        self.options['pool'].park(
+            instance.id, instance.cpus, instance.memory, instance.datacenter,
+            local_disk=instance.local_disk, dedicated=instance.dedicated,
+            kind=instance.kind, os_code=instance.os_code,
+            nic_speed=instance.nic_speed, private=instance.private,
+            public_vlan=instance.public_vlan,
+            private_vlan=instance.private_vlan)
+
+
+class RemoteCommand(object):
+    """Run an ad-hoc shell command on a machine, run across machines at once.
+    """
+
+    def __init__(self, machine_id, address, command, control_dir=None):
+        self.machine_id = machine_id
+        self.address = address
+        self.command = command
+        self.control_dir = control_dir
+
+    def run(self):
+        t = time.time()
+        try:
+            status, output = ssh.execute(
+                self.address, self.command, control_dir=self.control_dir)
+        except OSError, e:
+            status, output = None, "Could not run ssh: %s\n" % e
+        return (self.machine_id, self.address, status, output,
+                time.time() - t)
+
+
+class FileUpload(object):
+    """Upload a file to a machine, verifying its checksum there.
+
+    Returns the machine id and an error message, None on success.
+    """
+
+    def __init__(self, machine_id, address, local_path, path, digest):
+        self.machine_id = machine_id
+        self.address = address
+        self.local_path = local_path
+        self.path = path
+        self.digest = digest
+
+    def run(self):
+        try:
+            self.copy()
+            digest = ssh.checksum(self.address, self.path)
+        except subprocess.CalledProcessError, e:
+            return self.machine_id, e.output.strip() or str(e)
+        except OSError, e:
+            return self.machine_id, str(e)
+        if digest != self.digest:
+            return self.machine_id, "Checksum mismatch %s" % digest
+        return self.machine_id, None
+
+    def copy(self):
+        ssh.push(self.address, self.local_path, self.path)
+
+
+class FileRelay(FileUpload):
+    """Copy a file from a machine holding it to another machine.
+    """
+
+    def __init__(self, machine_id, address, private_address, source,
+                 path, digest):
+        super(FileRelay, self).__init__(
+            machine_id, address, None, path, digest)
+        self.private_address = private_address
+        self.source = source
+
+    def copy(self):
+        ssh.relay(self.source, self.private_address, self.path)
+
+
+class InstanceListing(object):
+    """List provider instances, run alongside juju status.
+    """
+
+    def __init__(self, provider, **filters):
+        self.provider = provider
+        self.filters = filters
+
+    def run(self):
+        return self.provider.get_instances(**self.filters)
+
+
+class LoadSample(object):
+    """Sample a machine's load, run across a profile's machines at once.
+    """
+
+    def __init__(self, machine_id, address):
+        self.machine_id = machine_id
+        self.address = address
+
+    def run(self):
+        return self.machine_id, autoscale.sample(self.address)
@@ -0,0 +1,117 @@
+"""
+Inventory of recycled instances parked for reuse.
+
+Instances removed from the environment with terminate-machine --recycle
+are os reloaded instead of cancelled, and claimed by add-machine before
+it orders new instances. Instances parked longer than the pool's max age
+are no longer claimed, and are left to gc to cancel.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+
+from juju_slayer.constraints import VIRTUAL
+from juju_slayer.lock import FileLock
+
+# What a parked instance must share with an order to be claimed, with
+# defaults for entries parked before they were recorded.
+MATCHED = {
+    'local_disk': False,
+    'dedicated': False,
+    'kind': VIRTUAL,
+    'os_code': None,
+    'nic_speed': None,
+    'private': False}
+
+# Vlans an order may be pinned to, matched only when it is.
+PINNED = ('public_vlan', 'private_vlan')
+
+
+class InstancePool(object):
+
+    # Seconds an instance stays claimable, its reloaded image ages and
+    # it's billed while parked.
+    max_age = 24 * 60 * 60
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # Held against other invocations while reading or updating.
+        self.lock_path = self.path + ".lock"
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as fh:
+            return json.load(fh)
+
+    def _save(self, entries):
+        parent = os.path.dirname(self.path)
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        fd, tmp_path = tempfile.mkstemp(dir=parent)
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(entries, fh)
+        os.rename(tmp_path, self.path)
+
+    def entries(self):
+        # Saves are atomic renames, reads don't need the file lock.
+        with self.lock:
+            return self._load()
+
+    def expired(self):
+        """Ids of instances parked longer than the max age.
+        """
+        now = time.time()
+        return [e['id'] for e in self.entries()
+                if now - e['parked'] > self.max_age]
+
+    def park(self, instance_id, cpus, memory, datacenter, **attributes):
+        """Park an instance, with its MATCHED and PINNED attributes.
+        """
+        entry = dict(MATCHED)
+        entry.update(dict.fromkeys(PINNED))
+        entry.update(attributes)
+        entry.update({
+            'id': instance_id, 'cpus': cpus, 'memory': memory,
+            'datacenter': datacenter, 'parked': time.time()})
+        with self.lock, FileLock(self.lock_path):
+            entries = [e for e in self._load() if e['id'] != instance_id]
+            entries.append(entry)
+            self._save(entries)
+
+    def claim(self, cpus, memory, datacenter=None, **attributes):
+        """Claim an unexpired parked instance of the size, in the
+        datacenter if given, sharing the order's MATCHED attributes and
+        any vlans it's pinned to.
+
+        Returns the instance id, or None if there's no match.
+        """
+        now = time.time()
+        with self.lock, FileLock(self.lock_path):
+            entries = self._load()
+            for e in entries:
+                if e['cpus'] != cpus or e['memory'] != memory:
+                    continue
+                if datacenter and e['datacenter'] != datacenter:
+                    continue
+                if now - e['parked'] > self.max_age:
+                    continue
+                if any(e.get(k, d) != attributes.get(k, d)
+                       for k, d in MATCHED.items()):
+                    continue
+                if any(attributes.get(k) and e.get(k) != attributes[k]
+                       for k in PINNED):
+                    continue
+                entries.remove(e)
+                self._save(entries)
+                return e['id']
+        return None
+
+    def remove(self, instance_ids):
+        instance_ids = set(instance_ids)
+        with self.lock, FileLock(self.lock_path):
+            self._save(
+                [e for e in self._load() if e['id'] not in instance_ids])
@@ -1,23 +1,70 @@
+import calendar
+import ConfigParser
 import logging
 import os
+import threading
 import time
 import itertools
 
+from juju_slayer.accounts import AccountPool, LimitedClient, RateLimiter
+from juju_slayer.constraints import BARE_METAL, VIRTUAL
 from juju_slayer.exceptions import ConfigError, ProviderError
-from SoftLayer import Client, SshKeyManager, CCIManager, config as client_conf
+from juju_slayer.transport import (
+    Transport, TransportClient, DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_READ_TIMEOUT, FAULT_ERRORS)
+from SoftLayer import (
+    API_PUBLIC_ENDPOINT, BasicAuthentication, SshKeyManager,
+    CCIManager, HardwareManager, config as client_conf)
+from SoftLayer.exceptions import SoftLayerAPIError
 
 log = logging.getLogger("juju.slayer")
 
+DEFAULT_ACCOUNT = "default"
 
-def factory():
-    cfg = SoftLayer.get_config()
-    return SoftLayer(cfg)
+# Raised listing hardware on accounts without bare metal permissions.
+PERMISSION_DENIED = 'SoftLayer_Exception_PermissionDenied'
+
+# Further accounts are configured as [softlayer:<name>] sections
+# alongside the bindings' own [softlayer] section.
+CONFIG_FILES = ('/etc/softlayer.conf', '~/.softlayer')
+PROFILE_PREFIX = "softlayer:"
+
+# Settings a profile shares with the primary account unless overridden.
+SHARED_SETTINGS = ('endpoint_url', 'ssh_key', 'connect_timeout', 'timeout')
+
+
+def factory(replay=False):
+    if replay:
+        # Replayed sessions make no api calls, so need no credentials.
+        return SoftLayer({}, TransportClient(
+            Transport(), auth=None, endpoint_url=API_PUBLIC_ENDPOINT))
+    profiles = SoftLayer.get_profiles()
+    name, cfg = profiles[0]
+    primary = SoftLayer(cfg, name=name)
+    if len(profiles) == 1 and primary.orders is None:
+        return primary
+    # Accounts share the primary's pooled transport.
+    return AccountPool([primary] + [
+        SoftLayer(cfg, name=name, transport=primary.transport)
+        for name, cfg in profiles[1:]])
 
 
 def validate():
     SoftLayer.get_config()
 
 
+def _limits(section, options):
+    limits = {}
+    try:
+        if options.get('rate'):
+            limits['rate'] = float(options['rate'])
+        if options.get('orders'):
+            limits['orders'] = int(options['orders'])
+    except ValueError:
+        raise ConfigError("Invalid rate or orders limit in [%s]" % section)
+    return limits
+
+
 class SSHKey(dict):
     __slots__ = ()
 
@@ -30,9 +77,58 @@ class SSHKey(dict):
         return self['label']
 
 
+# Faults of orders refused for lack of capacity. Invalid orders, ie. a
+# price or item not offered in a location, are refused as "not
+# available" too, so only these specific faults count.
+CAPACITY_FAULTS = (
+    'SoftLayer_Exception_Virtual_Host_Pool_InsufficientResources',)
+CAPACITY_ERRORS = (
+    "insufficient capacity", "insufficient resources",
+    "unable to find a suitable host", "no available host", "out of stock")
+
+
+def is_capacity_error(e):
+    """Whether an order failed because the datacenter is out of its size.
+    """
+    if getattr(e, 'faultCode', None) in CAPACITY_FAULTS:
+        return True
+    fault = (getattr(e, 'faultString', None) or '').lower()
+    return any(p in fault for p in CAPACITY_ERRORS)
+
+
+def is_refusal(e):
+    """Whether SoftLayer refused a call outright, ie. an invalid order.
+
+    Retrying a refusal won't help. Capacity may free up, and xml-rpc
+    protocol and transport errors say nothing of the call itself.
+    """
+    if not isinstance(e, SoftLayerAPIError) or is_capacity_error(e):
+        return False
+    return not isinstance(e, tuple(FAULT_ERRORS.values()))
+
+
+def parse_date(value):
+    """Parse a softlayer timestamp, ie. 2014-04-01T09:23:13-06:00, to
+    epoch seconds, or None if unparseable.
+    """
+    try:
+        seconds = calendar.timegm(
+            time.strptime(value[:19], "%Y-%m-%dT%H:%M:%S"))
+    except (TypeError, ValueError):
+        return None
+    offset = value[19:]
+    if offset and offset != 'Z':
+        hours, minutes = offset[1:].split(':')
+        shift = int(hours) * 3600 + int(minutes) * 60
+        seconds += offset[0] == '-' and shift or -shift
+    return seconds
+
+
 class Instance(dict):
     __slots__ = ()
 
+    kind = VIRTUAL
+
     @property
     def id(self):
         return self['id']
@@ -49,67 +145,379 @@ class Instance(dict):
     def name(self):
         return self['hostname']
 
+    @property
+    def local_disk(self):
+        return bool(self.get('localDiskFlag'))
+
+    @property
+    def dedicated(self):
+        return bool(self.get('dedicatedAccountHostOnlyFlag'))
+
+    @property
+    def os_code(self):
+        return self.get('operatingSystem', {}).get(
+            'softwareLicense', {}).get(
+                'softwareDescription', {}).get('referenceCode')
+
+    @property
+    def private(self):
+        return bool(self.get('privateNetworkOnlyFlag'))
+
+    @property
+    def nic_speed(self):
+        # Private network only instances have just a backend component.
+        component = (self.get('primaryNetworkComponent') or
+                     self.get('primaryBackendNetworkComponent') or {})
+        return component.get('maxSpeed')
+
+    @property
+    def public_vlan(self):
+        return (self.get('primaryNetworkComponent') or {}).get(
+            'networkVlan', {}).get('id')
+
+    @property
+    def private_vlan(self):
+        return (self.get('primaryBackendNetworkComponent') or {}).get(
+            'networkVlan', {}).get('id')
+
     @property
     def status(self):
         return self['powerState']['name']
 
     @property
     def ip_address(self):
-        return self.get('primaryIpAddress', '')
+        # Private network only instances have just a backend address.
+        return (self.get('primaryIpAddress') or
+                self.get('primaryBackendIpAddress', ''))
+
+    @property
+    def private_ip_address(self):
+        return self.get('primaryBackendIpAddress', '')
+
+    @property
+    def datacenter(self):
+        return self.get('datacenter', {}).get('name')
+
+    @property
+    def tags(self):
+        return [t['tag']['name'] for t in self.get('tagReferences', ())]
+
+    @property
+    def created(self):
+        """Epoch seconds the instance was ordered, or else provisioned.
+        """
+        return parse_date(self.get('createDate') or self.get('provisionDate'))
+
+    @property
+    def account(self):
+        """Name of the account owning the instance, when sharding orders.
+        """
+        return self.get('account')
+
+    @property
+    def provisioning(self):
+        return bool(self.get('activeTransaction') or
+                    not self.get('provisionDate'))
+
+
+class Hardware(Instance):
+    """A bare metal instance.
+    """
+    __slots__ = ()
+
+    kind = BARE_METAL
+
+    @property
+    def cpus(self):
+        return self['processorPhysicalCoreAmount']
+
+    @property
+    def memory(self):
+        # Unit GB
+        return self['memoryCapacity'] * 1024
+
+    @property
+    def status(self):
+        return self.get('hardwareStatus', {}).get('status')
+
+
+class Image(dict):
+    __slots__ = ()
+
+    @property
+    def id(self):
+        return self['id']
+
+    @property
+    def global_id(self):
+        return self['globalIdentifier']
+
+    @property
+    def name(self):
+        return self['name']
 
 
 class SoftLayer(object):
 
-    def __init__(self, config, client=None):
+    instance_mask = "mask[%s]" % ",".join([
+        "id", "hostname", "domain", "primaryIpAddress",
+        "primaryBackendIpAddress", "maxCpu", "maxMemory", "datacenter",
+        "powerState", "createDate", "provisionDate", "localDiskFlag",
+        "dedicatedAccountHostOnlyFlag", "privateNetworkOnlyFlag",
+        "operatingSystem.softwareLicense.softwareDescription.referenceCode",
+        "primaryNetworkComponent.maxSpeed",
+        "primaryNetworkComponent.networkVlan.id",
+        "primaryBackendNetworkComponent.maxSpeed",
+        "primaryBackendNetworkComponent.networkVlan.id",
+        "activeTransaction.transactionStatus.name", "tagReferences.tag.name"])
+
+    hardware_mask = "mask[%s]" % ",".join([
+        "id", "hostname", "domain", "primaryIpAddress",
+        "primaryBackendIpAddress", "processorPhysicalCoreAmount",
+        "memoryCapacity", "datacenter", "hardwareStatus", "provisionDate",
+        "operatingSystem.softwareLicense.softwareDescription.referenceCode",
+        "primaryNetworkComponent.maxSpeed",
+        "primaryNetworkComponent.networkVlan.id",
+        "primaryBackendNetworkComponent.maxSpeed",
+        "primaryBackendNetworkComponent.networkVlan.id",
+        "activeTransaction.transactionStatus.name", "tagReferences.tag.name"])
+
+    # How long listed ssh keys are reused, a daemon outlives key uploads.
+    keys_ttl = 300
+
+    def __init__(self, config, client=None, name=DEFAULT_ACCOUNT,
+                 transport=None):
         self.config = config
+        self.name = name
+        # Most orders in flight at once, None for no limit.
+        self.orders = config.get('orders')
+        # Only a transport we created is ours to close.
+        self.transport = None
+        self.keys = None
+        self.keys_lock = threading.Lock()
+        # Cleared once the account turns out not to be allowed hardware.
+        self.bare_metal = True
         if client is None:
-            client = Client(
-                auth=self.config['auth'],
-                endpoint_url=self.config['endpoint_url'])
+            if transport is None:
+                self.transport = transport = Transport(
+                    float(config.get('connect_timeout') or
+                          DEFAULT_CONNECT_TIMEOUT),
+                    float(config.get('timeout') or DEFAULT_READ_TIMEOUT))
+            client = self.connect(transport)
         self.client = client
         self.ssh = SshKeyManager(client)
         self.instances = CCIManager(client)
+        self.hardware = HardwareManager(client)
 
     @classmethod
     def get_config(cls):
         provider_conf = client_conf.get_client_settings()
         if 'SL_SSH_KEY' in os.environ:
             provider_conf['ssh_key'] = os.environ['SL_SSH_KEY']
+        if 'SL_CONNECT_TIMEOUT' in os.environ:
+            provider_conf['connect_timeout'] = os.environ['SL_CONNECT_TIMEOUT']
         if not ('auth' in provider_conf and 'endpoint_url' in provider_conf):
             raise ConfigError("Missing digital ocean api credentials")
         return provider_conf
 
+    @classmethod
+    def get_profiles(cls):
+        """Return (name, config) of the primary account and any further
+        account profiles to shard orders across.
+
+        Any section may limit its account's api calls per second with
+        'rate' and its orders in flight with 'orders'.
+        """
+        primary = cls.get_config()
+        parser = ConfigParser.RawConfigParser()
+        parser.read([os.path.expanduser(f) for f in CONFIG_FILES])
+        profiles = [(DEFAULT_ACCOUNT, primary)]
+        for section in parser.sections():
+            options = dict(parser.items(section))
+            if section == 'softlayer':
+                primary.update(_limits(section, options))
+                continue
+            if not section.startswith(PROFILE_PREFIX):
+                continue
+            name = section[len(PROFILE_PREFIX):]
+            if not (options.get('username') and options.get('api_key')):
+                raise ConfigError(
+                    "SoftLayer account %s missing username or api_key" % (
+                        name))
+            conf = dict((k, primary[k]) for k in SHARED_SETTINGS
+                        if k in primary)
+            if options.get('endpoint_url'):
+                conf['endpoint_url'] = options['endpoint_url']
+            conf['auth'] = BasicAuthentication(
+                options['username'], options['api_key'])
+            conf.update(_limits(section, options))
+            profiles.append((name, conf))
+        return profiles
+
+    def connect(self, transport):
+        """Create an api client for the account calling over the
+        transport, held to any rate limit.
+        """
+        if self.config.get('rate'):
+            return LimitedClient(
+                RateLimiter(self.config['rate']), transport,
+                auth=self.config['auth'],
+                endpoint_url=self.config['endpoint_url'])
+        return TransportClient(
+            transport, auth=self.config['auth'],
+            endpoint_url=self.config['endpoint_url'])
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
     def get_ssh_keys(self):
-        keys = map(SSHKey, self.ssh.list_keys())
-        if 'ssh_key' in self.config:
-            keys = [k for k in keys if k.name == self.config['ssh_key']]
-        log.debug(
-            "Using SoftLayer ssh keys: %s" % ", ".join(k.name for k in keys))
-        return keys
+        with self.keys_lock:
+            if self.keys is not None and (
+                    time.time() - self.keys[0] < self.keys_ttl):
+                return self.keys[1]
+            keys = map(SSHKey, self.ssh.list_keys())
+            if 'ssh_key' in self.config:
+                keys = [k for k in keys if k.name == self.config['ssh_key']]
+            log.debug("Using SoftLayer ssh keys: %s" % ", ".join(
+                k.name for k in keys))
+            self.keys = (time.time(), keys)
+            return keys
+
+    def get_instances(self, **filters):
+        """List virtual and bare metal instances, filters are as for
+        CCIManager.list_instances.
 
-    def get_instances(self):
-        return map(Instance, self.instances.list_instances())
+        Accounts without bare metal permissions list only virtual
+        instances.
+        """
+        instances = map(Instance, self.instances.list_instances(
+            mask=self.instance_mask, **filters))
+        if not self.bare_metal:
+            return instances
+        try:
+            hardware = self.hardware.list_hardware(
+                mask=self.hardware_mask, **filters)
+        except SoftLayerAPIError, e:
+            if e.faultCode != PERMISSION_DENIED:
+                raise
+            log.debug("Account %s can't list hardware, listing only "
+                      "virtual instances", self.name)
+            self.bare_metal = False
+            return instances
+        return instances + map(Hardware, hardware)
 
-    def get_instance(self, instance_id):
+    def get_instance(self, instance_id, kind=VIRTUAL):
+        if kind == BARE_METAL:
+            return Hardware(self.hardware.get_hardware(
+                instance_id, mask=self.hardware_mask))
         return Instance(self.instances.get_instance(instance_id))
 
     def launch_instance(self, params):
+        """Order an instance.
+
+        Bare metal orders are allocated hardware asynchronously, use
+        find_hardware to wait on the instance.
+        """
+        if params.get('type') == BARE_METAL:
+            self.hardware.place_order(
+                server=params['server'], hostname=params['hostname'],
+                domain=params['domain'], hourly=params['hourly'],
+                location=params.get('location') or 'FIRST_AVAILABLE',
+                os=params['os'], disks=[], port_speed=params['port_speed'],
+                bare_metal=True, ssh_keys=params.get('ssh_keys'),
+                public_vlan=params.get('public_vlan'),
+                private_vlan=params.get('private_vlan'))
+            return None
         return Instance(self.instances.create_instance(**params))
 
-    def terminate_instance(self, instance_id):
-        self.instances.cancel_instance(instance_id)
+    def lookup_hardware(self, hostname, domain):
+        """Return the hardware allocated to a bare metal order, or None.
+        """
+        found = self.hardware.list_hardware(
+            hostname=hostname, domain=domain, mask=self.hardware_mask)
+        if found:
+            return Hardware(found[0])
+
+    def find_hardware(self, hostname, domain, limit=60, delay=10):
+        """Wait on the hardware allocated to a bare metal order.
+        """
+        for count in range(limit + 1):
+            hardware = self.lookup_hardware(hostname, domain)
+            if hardware is not None:
+                return hardware
+            if count and count % 6 == 0:
+                log.debug("Waiting for bare metal order:%s waited:%ds",
+                          hostname, count * delay)
+            time.sleep(delay)
+        raise ProviderError(
+            "Bare metal order %s not allocated before timeout" % hostname)
+
+    def reload_instance(self, instance_id, ssh_keys=None, kind=VIRTUAL):
+        """Reload the instance's operating system, wiping its disks.
+        """
+        if kind == BARE_METAL:
+            self.hardware.reload(instance_id, ssh_keys=ssh_keys)
+        else:
+            self.instances.reload_instance(instance_id, ssh_keys=ssh_keys)
+
+    def tag_instance(self, instance_id, tags, kind=VIRTUAL):
+        service = kind == BARE_METAL and 'Hardware' or 'Virtual_Guest'
+        self.client[service].setTags(",".join(tags), id=instance_id)
+
+    def terminate_instance(self, instance_id, kind=VIRTUAL):
+        if kind == BARE_METAL:
+            # Hourly bare metal is billed until cancelled.
+            self.hardware.cancel_metal(instance_id, immediate=True)
+        else:
+            self.instances.cancel_instance(instance_id)
+
+    def capture_instance(self, instance_id, name, note=""):
+        """Capture an image template from an instance's disks.
+        """
+        instance = self.get_instance(instance_id)
+        # Device 1 is the swap disk, which isn't captured.
+        disks = [d for d in instance.get('blockDevices', ())
+                 if d.get('device') != '1']
+        return self.client['Virtual_Guest'].createArchiveTransaction(
+            name, disks, note, id=instance_id)
+
+    def get_create_options(self):
+        return self.instances.get_create_options()
+
+    def get_bare_metal_options(self):
+        return self.hardware.get_bare_metal_create_options()
+
+    def get_vlans(self):
+        return self.client['Account'].getNetworkVlans(
+            mask="mask[id,vlanNumber,networkSpace,"
+                 "primaryRouter.datacenter.name]")
+
+    def get_images(self):
+        return map(Image, self.client[
+            'Account'].getPrivateBlockDeviceTemplateGroups(
+                mask="mask[id,globalIdentifier,name,createDate]"))
+
+    def delete_image(self, image_id):
+        self.client['Virtual_Guest_Block_Device_Template_Group'].deleteObject(
+            id=image_id)
 
-    def wait_on(self, instance):
-        # Wait up to 5 minutes, in 30 sec increments
-        result = self._wait_on_instance(instance, 30, 10)
+    def wait_on(self, instance, limit=None):
+        if instance.kind == BARE_METAL:
+            # Wait up to 2 hours by default, in 30 sec increments
+            result = self._wait_on_instance(instance, limit or 240, 30)
+        else:
+            # Wait up to 5 minutes by default, in 10 sec increments
+            result = self._wait_on_instance(instance, limit or 30, 10)
         if not result:
             raise ProviderError("Could not provision instance before timeout")
         return result
 
     def _wait_on_instance(self, instance, limit, delay=10):
         # Redo cci.wait to give user feedback in verbose mode.
+        kind = instance.kind
         for count, new_instance in enumerate(itertools.repeat(instance.id)):
-            instance = self.get_instance(new_instance)
+            instance = self.get_instance(new_instance, kind)
             if not instance.get('activeTransaction', {}).get('id') and \
                instance.get('provisionDate'):
                 return True
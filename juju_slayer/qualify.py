@@ -0,0 +1,114 @@
+"""
+Post-provision performance qualification of instances.
+
+Shared host virtual guests vary widely in cpu steal and disk and network
+throughput. Qualification runs short micro-benchmarks on an instance
+over ssh and compares them against thresholds, so slow hosts can be
+replaced before they're registered with juju.
+"""
+import logging
+import pipes
+import subprocess
+
+from juju_slayer.exceptions import ConfigError
+from juju_slayer import ssh
+
+log = logging.getLogger("juju.slayer")
+
+# A file on SoftLayer's private network mirror, reachable from every
+# instance including private network only ones.
+NETWORK_URL = "http://mirrors.service.softlayer.com/ubuntu/ls-lR.gz"
+
+# Seconds the benchmarks may take on the instance before they're killed,
+# so a wedged host can't hang its op.
+TIMEOUT = 180
+
+# Benchmark name to whether a result must be at least (min) or at most
+# (max) its threshold. Throughputs are in MB/s, steal in percent.
+BENCHMARKS = {
+    'cpu': 'min',
+    'disk': 'min',
+    'network': 'min',
+    'steal': 'max',
+}
+
+# Each benchmark prints a 'name value' line. Hashing and writing 256MB
+# takes a few seconds on a healthy guest.
+SCRIPT = """\
+cpustat() { awk '/^cpu /{print $2+$3+$4+$5+$6+$7+$8+$9, $9}' /proc/stat; }
+now() { date +%%s.%%N; }
+rate() { echo "$1 $2" | awk '{printf "%%.1f\\n", 256 / ($2 - $1)}'; }
+before=$(cpustat); start=$(now)
+dd if=/dev/zero bs=1M count=256 2>/dev/null | md5sum > /dev/null
+end=$(now); after=$(cpustat)
+echo "cpu $(rate $start $end)"
+echo "steal $(echo $before $after | awk '{t = $3 - $1;
+  printf "%%.1f\\n", t ? 100 * ($4 - $2) / t : 0}')"
+start=$(now)
+dd if=/dev/zero of=/root/.qualify bs=1M count=256 conv=fdatasync 2>/dev/null
+end=$(now); rm -f /root/.qualify
+echo "disk $(rate $start $end)"
+echo "network $(curl -s -o /dev/null -m 30 -w '%%{speed_download}' %(url)s |
+  awk '{printf "%%.1f\\n", $1 / 1048576}')"
+"""
+
+
+def parse_thresholds(spec):
+    """Parse thresholds given as 'cpu=200,disk=50,network=10,steal=5'.
+    """
+    thresholds = {}
+    for part in spec.split(','):
+        if not part.strip():
+            continue
+        if '=' not in part:
+            raise ConfigError("Invalid qualification threshold %r" % part)
+        name, value = [p.strip() for p in part.split('=', 1)]
+        if name not in BENCHMARKS:
+            raise ConfigError(
+                "Unknown qualification benchmark %s valid: %s" % (
+                    name, ", ".join(sorted(BENCHMARKS))))
+        try:
+            thresholds[name] = float(value)
+        except ValueError:
+            raise ConfigError(
+                "Invalid qualification threshold %s=%s" % (name, value))
+    return thresholds
+
+
+def benchmark(host):
+    """Run the benchmarks on the host, returning results by name.
+
+    Raises CalledProcessError if they couldn't be run, or timed out.
+    """
+    command = "timeout %d sh -c %s" % (
+        TIMEOUT, pipes.quote(SCRIPT % {'url': NETWORK_URL}))
+    status, output = ssh.execute(host, command)
+    if status != 0:
+        raise subprocess.CalledProcessError(status, command, output)
+    results = {}
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) != 2 or parts[0] not in BENCHMARKS:
+            continue
+        try:
+            results[parts[0]] = float(parts[1])
+        except ValueError:
+            continue
+    return results
+
+
+def check(results, thresholds):
+    """Return a description of each threshold the results fail.
+
+    A benchmark that didn't report a result fails its threshold.
+    """
+    failures = []
+    for name, threshold in sorted(thresholds.items()):
+        result = results.get(name)
+        if result is None:
+            failures.append("%s no result" % name)
+        elif BENCHMARKS[name] == 'min' and result < threshold:
+            failures.append("%s %s < %s" % (name, result, threshold))
+        elif BENCHMARKS[name] == 'max' and result > threshold:
+            failures.append("%s %s > %s" % (name, result, threshold))
+    return failures
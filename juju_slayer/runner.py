@@ -9,12 +9,25 @@ import threading
 
 log = logging.getLogger("juju.slayer")
 
+# Set to cancel the running command's ops. The daemon runs commands one
+# at a time, and sets it when a command's client goes away.
+cancelled = threading.Event()
+
+
+class Cancelled(Exception):
+    """The command was cancelled while waiting on its ops.
+    """
+
 
 class Runner(object):
 
     DEFAULT_NUM_RUNNER = 5
 
-    def __init__(self):
+    # How often waits on results check for cancellation.
+    poll_interval = 0.5
+
+    def __init__(self, num_runners=DEFAULT_NUM_RUNNER):
+        self.num_runners = num_runners
         self.jobs = Queue()
         self.results = Queue()
         self.job_count = 0
@@ -29,7 +42,7 @@ class Runner(object):
         auto = not self.started
 
         if auto:
-            self.start(min(self.DEFAULT_NUM_RUNNER, self.job_count))
+            self.start(min(self.num_runners, self.job_count))
 
         for i in range(self.job_count):
             self.job_count -= 1
@@ -42,7 +55,12 @@ class Runner(object):
             self.stop()
 
     def gather_result(self):
-        return self.results.get()
+        while not cancelled.is_set():
+            try:
+                return self.results.get(timeout=self.poll_interval)
+            except Empty:
+                continue
+        raise Cancelled("Cancelled waiting on ops")
 
     def start(self, count):
         for i in range(count):
@@ -58,6 +76,26 @@ class Runner(object):
         self.started = False
 
 
+class Gate(object):
+    """Holds ops at a point until opened, or fails them if closed.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.opened = False
+
+    def open(self):
+        self.opened = True
+        self.event.set()
+
+    def close(self):
+        self.event.set()
+
+    def wait(self):
+        self.event.wait()
+        return self.opened
+
+
 class OpRunner(threading.Thread):
 
     def __init__(self, ops, results):
@@ -67,6 +105,9 @@ class OpRunner(threading.Thread):
 
     def run(self):
         while 1:
+            # Ops already running finish, queued ones aren't started.
+            if cancelled.is_set():
+                return
             try:
                 op = self.ops.get(block=False)
             except Empty:
@@ -1,5 +1,8 @@
-import subprocess
 import logging
+import os
+import pipes
+import subprocess
+import urlparse
 
 log = logging.getLogger('juju.slayer')
 
@@ -10,6 +13,38 @@ SSH_CMD = ("/usr/bin/ssh",
            "-o", "StrictHostKeyChecking=no",
            "-o", "UserKnownHostsFile=/dev/null")
 
+SCP_CMD = ("/usr/bin/scp", "-q") + SSH_CMD[1:]
+
+CONNECT_TIMEOUT = 10
+# Seconds between keepalives on an established connection, and how many
+# may go unanswered before a wedged host's connection is dropped.
+SERVER_ALIVE_INTERVAL = 15
+SERVER_ALIVE_COUNT = 4
+# Seconds a shared master connection outlives its last use.
+CONTROL_PERSIST = 60
+
+APT_CACHE_PORT = 3142
+
+# Installs apt-cacher-ng listening only on loopback and the private
+# network, the public interface stays closed.
+APT_CACHE_SETUP = """\
+set -e
+export DEBIAN_FRONTEND=noninteractive
+apt-get install -y apt-cacher-ng
+echo "BindAddress: 127.0.0.1 %(address)s" > /etc/apt-cacher-ng/zz_slayer.conf
+service apt-cacher-ng restart
+"""
+
+# Only points apt at the proxy if it's reachable, else the stock mirrors
+# are used.
+APT_PROXY_SETUP = """\
+if (echo > /dev/tcp/%(host)s/%(port)s) 2>/dev/null; then
+  echo 'Acquire::http::Proxy "%(proxy)s";' > %(path)s
+  echo enabled
+fi
+"""
+APT_PROXY_CONF = "/etc/apt/apt.conf.d/42juju-slayer-proxy"
+
 
 def check_ssh(host, user="root"):
     cmd = list(SSH_CMD) + ["%s@%s" % (user, host), "ls"]
@@ -24,6 +59,89 @@ def check_ssh(host, user="root"):
     return True
 
 
+def control_opts(control_dir):
+    """Options sharing one master connection per host across ssh calls.
+
+    Masters linger after the last call, so later commands against the
+    same hosts skip the handshake too.
+    """
+    return ["-o", "ControlMaster=auto",
+            "-o", "ControlPath=%s" % os.path.join(control_dir, "%r@%h:%p"),
+            "-o", "ControlPersist=%d" % CONTROL_PERSIST]
+
+
+def execute(host, command, user="root", control_dir=None):
+    """Run a shell command on the host, returning its status and output.
+
+    Unlike run, a failing command isn't an error.
+    """
+    cmd = list(SSH_CMD) + [
+        "-o", "BatchMode=yes",
+        "-o", "ConnectTimeout=%d" % CONNECT_TIMEOUT,
+        "-o", "ServerAliveInterval=%d" % SERVER_ALIVE_INTERVAL,
+        "-o", "ServerAliveCountMax=%d" % SERVER_ALIVE_COUNT]
+    if control_dir:
+        cmd += control_opts(control_dir)
+    cmd += ["%s@%s" % (user, host), command]
+    process = subprocess.Popen(
+        args=cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output, _ = process.communicate()
+    return process.returncode, output
+
+
+def run(host, command, user="root"):
+    """Run a command on the host returning its output.
+    """
+    cmd = list(SSH_CMD) + ["%s@%s" % (user, host)] + list(command)
+    return subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+
+
+def push(host, local_path, remote_path, user="root"):
+    """Copy a local file to the host.
+    """
+    cmd = list(SCP_CMD) + [local_path, "%s@%s:%s" % (user, host, remote_path)]
+    return subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+
+
+def checksum(host, path, user="root"):
+    """Return the sha256 hex digest of a file on the host.
+    """
+    return run(host, ["sha256sum", pipes.quote(path)], user).split()[0]
+
+
+def relay(source, target, path, user="root"):
+    """Copy a file from the source host to the same path on the target.
+
+    The copy goes over the source's network, ie. softlayer's private
+    network, authenticated by our ssh agent forwarded to the source.
+    """
+    copy = list(SCP_CMD[:1]) + ["-q", "-o", "BatchMode=yes"] + list(
+        SSH_CMD[1:]) + [path, "%s@%s:%s" % (user, target, path)]
+    cmd = list(SSH_CMD) + ["-A", "%s@%s" % (user, source),
+                           " ".join(pipes.quote(c) for c in copy)]
+    return subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+
+
+def setup_apt_cache(host, private_address, user="root"):
+    """Install a caching apt proxy on the host's private address.
+    """
+    script = APT_CACHE_SETUP % {'address': private_address}
+    return run(host, ["sh", "-c", pipes.quote(script)], user)
+
+
+def use_apt_proxy(host, proxy, user="root"):
+    """Point the host's apt at the proxy url, if the host can reach it.
+
+    Returns whether the proxy is in use.
+    """
+    parsed = urlparse.urlparse(proxy)
+    script = APT_PROXY_SETUP % {
+        'host': parsed.hostname, 'port': parsed.port or 80,
+        'proxy': proxy, 'path': APT_PROXY_CONF}
+    output = run(host, ["bash", "-c", pipes.quote(script)], user)
+    return "enabled" in output
+
+
 def update_instance(host, user="root"):
     base = list(SSH_CMD) + ["%s@%s" % (user, host)]
     subprocess.check_output(
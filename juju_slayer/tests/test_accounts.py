@@ -0,0 +1,198 @@
+import mock
+import os
+import threading
+
+from SoftLayer.exceptions import SoftLayerAPIError, TransportError
+
+from juju_slayer.accounts import AccountPool, RateLimiter
+from juju_slayer.exceptions import ConfigError
+from juju_slayer.provider import (
+    Instance, Image, SoftLayer, SSHKey, is_capacity_error, is_refusal)
+from juju_slayer.tests.base import Base
+
+
+def make_account(name, orders=None, key_id=1):
+    account = mock.Mock()
+    account.name = name
+    account.orders = orders
+    account.get_ssh_keys.return_value = [
+        SSHKey({'id': key_id, 'label': 'abc'})]
+    account.launch_instance.side_effect = lambda params: Instance(
+        {'id': hash(params['hostname']), 'hostname': params['hostname']})
+    account.get_images.return_value = []
+    return account
+
+
+class AccountPoolTest(Base):
+
+    def setUp(self):
+        self.primary = make_account('default')
+        self.sub = make_account('sub', orders=1, key_id=2)
+        self.pool = AccountPool([self.primary, self.sub])
+
+    def test_least_loaded(self):
+        first = self.pool.launch_instance({'hostname': 'a', 'ssh_keys': [1]})
+        second = self.pool.launch_instance({'hostname': 'b', 'ssh_keys': [1]})
+        self.assertEqual(first.account, 'default')
+        self.assertEqual(second.account, 'sub')
+        # Keys are translated to the sub account's by name.
+        self.assertEqual(
+            self.sub.launch_instance.call_args[0][0]['ssh_keys'], [2])
+        # The sub account is at its quota.
+        self.assertEqual(
+            self.pool.launch_instance({'hostname': 'c'}).account, 'default')
+        self.pool.wait_on(second)
+        self.sub.wait_on.assert_called_once_with(second, None)
+        self.assertEqual(
+            self.pool.launch_instance({'hostname': 'd'}).account, 'sub')
+
+    def test_pinned_orders(self):
+        self.pool.launch_instance({'hostname': 'a'})
+        self.assertEqual(self.pool.launch_instance(
+            {'hostname': 'b', 'private_vlan': 31}).account, 'default')
+        self.sub.get_images.return_value = [
+            Image({'id': 7, 'globalIdentifier': 'abc-123', 'name': 'x'})]
+        self.assertEqual(self.pool.launch_instance(
+            {'hostname': 'c', 'image_id': 'abc-123'}).account, 'sub')
+
+    def test_quota_wait(self):
+        self.primary.orders = 1
+        self.pool.launch_instance({'hostname': 'a'})
+        self.pool.launch_instance({'hostname': 'b'})
+        timer = threading.Timer(0.05, self.pool.release, ['b'])
+        timer.start()
+        self.assertEqual(
+            self.pool.launch_instance({'hostname': 'c'}).account, 'sub')
+        timer.join()
+
+    def test_failed_order_released(self):
+        self.sub.launch_instance.side_effect = SoftLayerAPIError(
+            'SoftLayer_Exception', 'Quota exceeded')
+        self.pool.launch_instance({'hostname': 'a'})
+        self.assertRaises(SoftLayerAPIError,
+                          self.pool.launch_instance, {'hostname': 'b'})
+        self.assertEqual(self.pool.inflight, {'a': 'default'})
+
+    def test_missing_keys(self):
+        self.sub.get_ssh_keys.return_value = []
+        self.pool.launch_instance({'hostname': 'a', 'ssh_keys': [1]})
+        self.assertRaises(ConfigError, self.pool.launch_instance,
+                          {'hostname': 'b', 'ssh_keys': [1]})
+
+    def test_owner_routing(self):
+        self.sub.get_instances.return_value = [
+            Instance({'id': 5, 'hostname': 'x'})]
+        self.primary.get_instances.return_value = []
+        [instance] = self.pool.get_instances()
+        self.assertEqual(instance.account, 'sub')
+        self.pool.terminate_instance(5, 'virtual')
+        self.sub.terminate_instance.assert_called_once_with(5, 'virtual')
+
+        # Instances not listed are looked up on each account.
+        self.primary.get_instance.side_effect = SoftLayerAPIError(
+            'SoftLayer_Exception_ObjectNotFound', 'Unable to find object')
+        self.sub.get_instance.return_value = Instance({'id': 6})
+        self.pool.reload_instance(6, ssh_keys=[1])
+        self.sub.reload_instance.assert_called_once_with(
+            6, ssh_keys=[2], kind='virtual')
+
+
+class RateLimiterTest(Base):
+
+    @mock.patch('juju_slayer.accounts.time')
+    def test_wait(self, mock_time):
+        mock_time.time.return_value = 100.0
+        limiter = RateLimiter(2)
+        limiter.wait()
+        limiter.wait()
+        self.assertFalse(mock_time.sleep.called)
+        limiter.wait()
+        mock_time.sleep.assert_called_once_with(0.5)
+        limiter.wait()
+        mock_time.sleep.assert_called_with(1.0)
+        # Tokens refill with time.
+        mock_time.time.return_value = 103.0
+        mock_time.sleep.reset_mock()
+        limiter.wait()
+        self.assertFalse(mock_time.sleep.called)
+
+
+class ProfilesTest(Base):
+
+    def test_get_profiles(self):
+        path = os.path.join(self.mkdir(), 'softlayer')
+        with open(path, 'w') as fh:
+            fh.write("[softlayer]\nusername = main\napi_key = k1\n"
+                     "orders = 20\n\n"
+                     "[softlayer:ci]\nusername = ci\napi_key = k2\n"
+                     "rate = 5\norders = 10\n")
+        with mock.patch('juju_slayer.provider.CONFIG_FILES', (path,)):
+            with mock.patch.object(SoftLayer, 'get_config') as get_config:
+                get_config.return_value = {
+                    'auth': object(), 'endpoint_url': 'https://sl',
+                    'ssh_key': 'abc'}
+                profiles = SoftLayer.get_profiles()
+        self.assertEqual([n for n, c in profiles], ['default', 'ci'])
+        self.assertEqual(profiles[0][1]['orders'], 20)
+        ci = profiles[1][1]
+        self.assertEqual(ci['auth'].username, 'ci')
+        self.assertEqual(ci['endpoint_url'], 'https://sl')
+        self.assertEqual(ci['ssh_key'], 'abc')
+        self.assertEqual((ci['rate'], ci['orders']), (5.0, 10))
+
+        with open(path, 'a') as fh:
+            fh.write("\n[softlayer:broken]\nusername = x\n")
+        with mock.patch('juju_slayer.provider.CONFIG_FILES', (path,)):
+            with mock.patch.object(SoftLayer, 'get_config') as get_config:
+                get_config.return_value = {'auth': object()}
+                self.assertRaises(ConfigError, SoftLayer.get_profiles)
+
+
+class SoftLayerTest(Base):
+
+    def test_get_instances_without_hardware(self):
+        provider = SoftLayer({}, client=mock.MagicMock())
+        provider.instances = mock.Mock()
+        provider.instances.list_instances.return_value = [
+            {'id': 5, 'hostname': 'x'}]
+        provider.hardware = mock.Mock()
+        provider.hardware.list_hardware.side_effect = SoftLayerAPIError(
+            'SoftLayer_Exception_PermissionDenied', 'Access Denied')
+        [instance] = provider.get_instances(hostname='x')
+        self.assertEqual(instance.id, 5)
+        # Hardware isn't asked for again.
+        self.assertEqual(len(provider.get_instances()), 1)
+        self.assertEqual(provider.hardware.list_hardware.call_count, 1)
+
+        provider.bare_metal = True
+        provider.hardware.list_hardware.side_effect = SoftLayerAPIError(
+            'SoftLayer_Exception', 'Internal error')
+        self.assertRaises(SoftLayerAPIError, provider.get_instances)
+
+    def test_is_capacity_error(self):
+        for fault in (
+                ('SoftLayer_Exception_Public',
+                 'There is insufficient capacity to complete the request.'),
+                ('SoftLayer_Exception_Virtual_Host_Pool_InsufficientResources',
+                 'Could not place the guest'),
+                ('SoftLayer_Exception_Public',
+                 'Unable to find a suitable host for this guest.')):
+            self.assertTrue(is_capacity_error(SoftLayerAPIError(*fault)))
+        for fault in (
+                ('SoftLayer_Exception_Public',
+                 'Price #1641 is not available in location dal05.'),
+                ('SoftLayer_Exception_Order_InvalidItem',
+                 'The item (#13) is no available item for this package.'),
+                ('SoftLayer_Exception_Public', 'Invalid hostname')):
+            self.assertFalse(is_capacity_error(SoftLayerAPIError(*fault)))
+        self.assertFalse(is_capacity_error(ValueError("capacity")))
+
+    def test_is_refusal(self):
+        self.assertTrue(is_refusal(SoftLayerAPIError(
+            'SoftLayer_Exception_Public',
+            'Price #1641 is not available in location dal05.')))
+        self.assertFalse(is_refusal(SoftLayerAPIError(
+            'SoftLayer_Exception_Public',
+            'There is insufficient capacity to complete the request.')))
+        self.assertFalse(is_refusal(TransportError(0, "Connection reset")))
+        self.assertFalse(is_refusal(ValueError("Price")))
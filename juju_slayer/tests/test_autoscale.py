@@ -0,0 +1,282 @@
+import argparse
+import mock
+import os
+import yaml
+
+from juju_slayer import autoscale
+from juju_slayer.autoscale import Profile, load_policy, parse_load
+from juju_slayer.commands import AddMachine, Autoscale, TerminateMachine
+from juju_slayer.config import Config
+from juju_slayer.exceptions import ConfigError, ProviderError
+from juju_slayer.provider import Instance, SSHKey
+from juju_slayer.tests.base import Base
+
+
+MEMINFO = """\
+MemTotal:        1000000 kB
+MemFree:          100000 kB
+MemAvailable:     %d kB
+Buffers:           50000 kB
+Cached:           250000 kB
+"""
+
+
+def load_output(load, cores=2, available=800000):
+    return "%.2f 0.50 0.40 1/100 1234\n%d\n%s" % (
+        load, cores, MEMINFO % available)
+
+
+class LoadTest(Base):
+
+    def test_parse_load(self):
+        self.assertEqual(parse_load(load_output(1.0, 2)), 0.5)
+        # Memory in use dominates an idle cpu.
+        self.assertAlmostEqual(
+            parse_load(load_output(0.1, 2, available=100000)), 0.9)
+
+    def test_parse_load_without_available(self):
+        output = load_output(0.0).replace("MemAvailable:", "Other:")
+        # Free, buffers and cached add up to 400M of 1G.
+        self.assertAlmostEqual(parse_load(output), 0.6)
+
+    def test_sample_error(self):
+        with mock.patch('juju_slayer.autoscale.ssh.execute') as execute:
+            execute.side_effect = OSError("No such file")
+            self.assertEqual(autoscale.sample('10.0.0.1'), None)
+            execute.side_effect = None
+            execute.return_value = (255, "Connection timed out")
+            self.assertEqual(autoscale.sample('10.0.0.1'), None)
+
+
+class ProfileTest(Base):
+
+    def test_validation(self):
+        self.assertRaises(ConfigError, Profile, 'web', {})
+        self.assertRaises(ConfigError, Profile, 'web', {'max': 1, 'mn': 1})
+        self.assertRaises(ConfigError, Profile, 'web', {'max': 1, 'min': 2})
+        self.assertRaises(ConfigError, Profile, 'web', {
+            'max': 1, 'scale-up': 0.5, 'scale-down': 0.5})
+
+    def test_load_policy(self):
+        path = os.path.join(self.mkdir(), 'policy.yaml')
+        self.assertRaises(ConfigError, load_policy, path)
+        with open(path, 'w') as fh:
+            fh.write(yaml.safe_dump({'profiles': {
+                'web': {'max': 4, 'constraints': 'mem=2G'},
+                'db': {'max': 2}}}))
+        profiles = load_policy(path)
+        self.assertEqual([p.name for p in profiles], ['db', 'web'])
+        self.assertEqual(profiles[1].constraints, 'mem=2G')
+        self.assertEqual(profiles[1].min, 0)
+
+    def test_bounds(self):
+        profile = Profile('web', {'min': 2, 'max': 3})
+        self.assertEqual(profile.decide([], {}, {}, 1000), 2)
+        self.assertEqual(
+            profile.decide(['1', '2', '3', '4'], {}, {}, 1000), -1)
+
+    def test_hysteresis(self):
+        profile = Profile('web', {'max': 3, 'up-periods': 2})
+        record = {}
+        busy = {'1': 0.9}
+        self.assertEqual(profile.decide(['1'], busy, record, 1000), 0)
+        # A sample between the thresholds starts the count again.
+        self.assertEqual(profile.decide(['1'], {'1': 0.5}, record, 1000), 0)
+        self.assertEqual(profile.decide(['1'], busy, record, 1000), 0)
+        self.assertEqual(profile.decide(['1'], busy, record, 1000), 1)
+        self.assertEqual(record['load'], 0.9)
+
+        # At max.
+        self.assertEqual(profile.decide(
+            ['1', '2', '3'], {'1': 0.9, '2': 0.9, '3': 0.9}, record, 1000),
+            0)
+
+    def test_cooldown(self):
+        profile = Profile('web', {'max': 3, 'down-periods': 1})
+        record = {'scaled': 1000}
+        self.assertEqual(profile.decide(
+            ['1', '2'], {'1': 0.1, '2': None}, record, 1100), 0)
+        self.assertEqual(profile.decide(
+            ['1', '2'], {'1': 0.1, '2': None}, record, 1400), -1)
+
+    def test_unsampled(self):
+        profile = Profile('web', {'max': 3})
+        self.assertEqual(profile.decide(['1'], {'1': None}, {}, 1000), 0)
+
+
+class Simulation(object):
+    """An environment of machines with scripted loads.
+    """
+
+    def __init__(self):
+        self.machines = {'0': '10.0.0.1'}
+        self.loads = {}
+        self.units = {}
+        self.instances = []
+        self.added = []
+        self.terminated = []
+        # Machines add-machine manages to add, None for no limit, or an
+        # error it raises.
+        self.capacity = None
+        self.error = None
+        self._add('0')
+
+    def _add(self, machine_id):
+        address = "10.0.0.%d" % (int(machine_id) + 1)
+        self.machines[machine_id] = address
+        self.instances.append(Instance({
+            'id': int(machine_id) + 100, 'hostname': 'softlayer-%s' % (
+                machine_id),
+            'primaryIpAddress': address, 'provisionDate': '2014',
+            'tagReferences': [
+                {'tag': {'name': 'juju-machine-%s' % machine_id}}]}))
+        return machine_id
+
+    def status(self):
+        return {
+            'machines': dict(
+                (m, {'dns-name': a, 'instance-id': 'manual:%s' % a})
+                for m, a in self.machines.items()),
+            'services': {'web': {'units': dict(
+                ('web/%s' % m, {'machine': m}) for m in self.units)}}}
+
+    def execute(self, host, command, **kw):
+        machine = [m for m, a in self.machines.items() if a == host][0]
+        return 0, load_output(self.loads.get(machine, 0.5) * 2, 2)
+
+    def add_machines(self, cmd):
+        self.added.append(cmd.config)
+        if self.error is not None:
+            raise self.error
+        count = cmd.config.num_machines
+        if self.capacity is not None:
+            count = min(count, self.capacity)
+        # Machine ids aren't reused.
+        return [self._add(str(len(self.instances) + i))
+                for i in range(count)]
+
+    def terminate_machines(self, cmd):
+        self.terminated.append(cmd.config)
+        for m in cmd.config.options.machines:
+            del self.machines[m]
+
+
+class AutoscaleTest(Base):
+
+    def setUp(self):
+        juju_home = self.mkdir()
+        self.change_environment(JUJU_HOME=juju_home)
+        with open(os.path.join(juju_home, 'environments.yaml'), 'w') as fh:
+            fh.write(yaml.safe_dump({'environments': {'softlayer': {
+                'type': 'null', 'bootstrap-host': None}}}))
+        self.policy = os.path.join(juju_home, 'policy.yaml')
+        with open(self.policy, 'w') as fh:
+            fh.write(yaml.safe_dump({'profiles': {'web': {
+                'constraints': 'cpu-cores=1, mem=1G, region=dal05',
+                'min': 1, 'max': 3, 'up-periods': 2, 'down-periods': 2,
+                'cooldown': 600, 'recycle': True}}}))
+        self.config = Config(argparse.Namespace(
+            environment='softlayer', policy=self.policy, once=True))
+        self.sim = Simulation()
+        self.provider = mock.Mock()
+        self.provider.get_ssh_keys.return_value = [
+            SSHKey({'id': 1, 'label': 'abc'})]
+        self.provider.get_instances.side_effect = (
+            lambda **kw: list(self.sim.instances))
+        self.env = mock.Mock()
+        self.env.status.side_effect = self.sim.status
+        patcher = mock.patch(
+            'juju_slayer.autoscale.ssh.execute',
+            side_effect=self.sim.execute)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for cls, attr in ((AddMachine, self.sim.add_machines),
+                          (TerminateMachine, self.sim.terminate_machines)):
+            patcher = mock.patch.object(
+                cls, 'run_locked', autospec=True, side_effect=attr)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.cmd = Autoscale(self.config, self.provider, self.env)
+        self.profiles = self.config.get_policy()
+
+    def evaluate(self, now):
+        self.cmd.evaluate(self.profiles, now)
+        return self.config.get_scale_state().load()['web']
+
+    def test_scale(self):
+        # Brought up to the profile's min, machine 0 isn't the profile's.
+        record = self.evaluate(1000)
+        self.assertEqual(record['machines'], ['1'])
+        config = self.sim.added[0]
+        self.assertEqual(config.num_machines, 1)
+        self.assertEqual(
+            config.constraints, 'cpu-cores=1, mem=1G, region=dal05')
+        self.assertFalse(config.resume)
+        self.assertNotEqual(config.run_id, self.config.run_id)
+
+        # Busy, scaled up once busy for two samples after the cooldown.
+        self.sim.loads = {'0': 0.1, '1': 0.95}
+        record = self.evaluate(1100)
+        self.assertEqual(record['up'], 1)
+        self.assertEqual(record['machines'], ['1'])
+        record = self.evaluate(1700)
+        self.assertEqual(record['machines'], ['1', '2'])
+        self.assertEqual(record['scaled'], 1700)
+        self.assertEqual(record['up'], 0)
+
+        # Quiet, only the machine without units is removed.
+        self.sim.loads = {'1': 0.05, '2': 0.1}
+        self.sim.units = {'1': True}
+        self.evaluate(2400)
+        record = self.evaluate(2500)
+        self.assertEqual(record['machines'], ['1'])
+        self.assertEqual(self.sim.terminated[0].options.machines, ['2'])
+        self.assertTrue(self.sim.terminated[0].recycle)
+        self.assertEqual(sorted(self.sim.machines), ['0', '1'])
+
+    def test_no_idle_machines(self):
+        self.evaluate(1000)
+        self.sim._add('2')
+        self.sim.units = {'1': True, '2': True}
+        state = self.config.get_scale_state()
+        data = state.load()
+        data['web']['machines'].append('2')
+        state.save(data)
+        self.sim.loads = {'1': 0.05, '2': 0.05}
+        self.evaluate(2000)
+        record = self.evaluate(2000)
+        self.assertEqual(record['machines'], ['1', '2'])
+        self.assertEqual(self.sim.terminated, [])
+
+    def test_forgets_removed_machines(self):
+        self.evaluate(1000)
+        del self.sim.machines['1']
+        # Replaced to keep the profile at its min.
+        record = self.evaluate(1100)
+        self.assertEqual(record['machines'], ['2'])
+
+    def test_failed_scale_up(self):
+        self.sim.capacity = 0
+        record = self.evaluate(1000)
+        self.assertEqual(record['failed'], 1000)
+        self.assertEqual(record['machines'], [])
+        # Not reordered every interval, but after the cooldown.
+        self.evaluate(1100)
+        self.assertEqual(len(self.sim.added), 1)
+        self.evaluate(1700)
+        self.assertEqual(len(self.sim.added), 2)
+
+    def test_scale_up_error(self):
+        self.sim.error = ProviderError("Order failed")
+        record = self.evaluate(1000)
+        self.assertEqual(record['failed'], 1000)
+        self.assertEqual(record['scaled'], 1000)
+
+    @mock.patch('juju_slayer.commands.time.sleep')
+    def test_run_survives_errors(self, mock_sleep):
+        self.config.options.once = False
+        self.env.status.side_effect = [
+            OSError("juju status failed"), self.sim.status()]
+        mock_sleep.side_effect = [None, KeyboardInterrupt]
+        self.assertRaises(KeyboardInterrupt, self.cmd.run)
+        self.assertEqual(len(self.sim.added), 1)
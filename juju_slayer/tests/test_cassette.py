@@ -0,0 +1,128 @@
+import mock
+import os
+import subprocess
+import time
+
+from SoftLayer.exceptions import SoftLayerAPIError
+
+from juju_slayer.cassette import Cassette
+from juju_slayer.env import Environment
+from juju_slayer.exceptions import CassetteError
+from juju_slayer.transport import Transport
+from juju_slayer import ssh
+from juju_slayer.tests.base import Base
+
+URI = "https://api.softlayer.com/xmlrpc/v3/SoftLayer_Virtual_Guest"
+
+
+class CassetteTest(Base):
+
+    def setUp(self):
+        self.path = os.path.join(self.mkdir(), 'session.cassette')
+        self.api = mock.Mock()
+        self.juju = mock.Mock()
+        self.check_ssh = mock.Mock()
+        for patcher in (
+                mock.patch.object(Transport, 'call', self.api),
+                mock.patch.object(Environment, '_run', self.juju),
+                mock.patch.object(ssh, 'check_ssh', self.check_ssh)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.env = Environment(mock.Mock())
+        self.transport = Transport()
+
+    def use_cassette(self, **kw):
+        cassette = Cassette(self.path, **kw)
+        cassette.install()
+        self.addCleanup(cassette.uninstall)
+        return cassette
+
+    def session(self):
+        """Make a call of every kind, returning the results.
+        """
+        results = []
+        for instance_id in (1, 2):
+            results.append(self.transport.call(
+                URI, 'getObject', headers={
+                    'authenticate': {'username': 'x', 'apiKey': 'secret'},
+                    'SoftLayer_Virtual_GuestInitParameters': {
+                        'id': instance_id}}))
+        results.append(ssh.check_ssh('10.0.0.1'))
+        results.append(self.env._run(['add-machine', 'ssh:root@10.0.0.1']))
+        return results
+
+    def test_record_replay(self):
+        self.api.side_effect = [{'id': 1}, {'id': 2}]
+        self.check_ssh.return_value = True
+        self.juju.return_value = 'created machine 3'
+        cassette = self.use_cassette()
+        recorded = self.session()
+        cassette.uninstall()
+
+        with open(self.path) as fh:
+            self.assertNotIn('secret', fh.read())
+
+        self.api.reset_mock()
+        self.juju.reset_mock()
+        self.check_ssh.reset_mock()
+        self.use_cassette(replay=True, speed=0)
+        self.assertEqual(self.session(), recorded)
+        self.assertFalse(self.api.called)
+        self.assertFalse(self.juju.called)
+        self.assertFalse(self.check_ssh.called)
+        self.assertRaises(CassetteError, ssh.check_ssh, '10.0.0.1')
+
+    def test_replay_matches_requests(self):
+        self.api.side_effect = [{'id': 1}, {'id': 2}, {'id': 3}]
+        cassette = self.use_cassette()
+        for instance_id in (1, 2, 3):
+            self.transport.call(URI, 'getObject', args=[instance_id])
+        cassette.uninstall()
+
+        self.use_cassette(replay=True, speed=0)
+        # Identical requests are served first, then in recorded order.
+        self.assertEqual(
+            self.transport.call(URI, 'getObject', args=[2]),
+            {'id': 2})
+        self.assertEqual(
+            self.transport.call(URI, 'getObject', args=[4]),
+            {'id': 1})
+        self.assertRaises(
+            CassetteError, self.transport.call, URI, 'deleteObject')
+
+    def test_replay_errors(self):
+        self.api.side_effect = SoftLayerAPIError('SoftLayer_Exception', 'no')
+        self.check_ssh.side_effect = subprocess.CalledProcessError(
+            255, ['ssh'], 'Connection refused')
+        self.use_cassette()
+        self.assertRaises(
+            SoftLayerAPIError, self.transport.call, URI, 'getObject')
+        self.assertRaises(
+            subprocess.CalledProcessError, ssh.check_ssh, '10.0.0.1')
+
+        self.use_cassette(replay=True, speed=0)
+        try:
+            self.transport.call(URI, 'getObject')
+        except SoftLayerAPIError, e:
+            self.assertEqual(e.faultCode, 'SoftLayer_Exception')
+        else:
+            self.fail("Expected api error")
+        try:
+            ssh.check_ssh('10.0.0.1')
+        except subprocess.CalledProcessError, e:
+            self.assertEqual(e.output, 'Connection refused')
+        else:
+            self.fail("Expected ssh error")
+
+    @mock.patch('juju_slayer.cassette._sleep')
+    def test_replay_speed(self, mock_sleep):
+        with open(self.path, 'w') as fh:
+            fh.write('{"kind": "ssh", "name": "check_ssh", "start": 1, '
+                     '"duration": 20, "request": {"args": []}, '
+                     '"response": true}\n')
+        self.use_cassette(replay=True, speed=10)
+        self.assertTrue(ssh.check_ssh())
+        mock_sleep.assert_called_once_with(2)
+        # The plugin's own waits are compressed too.
+        time.sleep(30)
+        mock_sleep.assert_called_with(3)
@@ -0,0 +1,172 @@
+import mock
+import os
+
+from juju_slayer.catalog import Catalog
+from juju_slayer.exceptions import ConstraintError
+from juju_slayer.tests.base import Base
+
+CREATE_OPTIONS = {
+    'datacenters': [
+        {'template': {'datacenter': {'name': 'dal05'}}},
+        {'template': {'datacenter': {'name': 'wdc01'}}}],
+    'processors': [
+        {'template': {'startCpus': 1}},
+        {'template': {'startCpus': 2}},
+        {'template': {'startCpus': 2, 'dedicatedAccountHostOnlyFlag': True}}],
+    'memory': [
+        {'template': {'maxMemory': 1024}},
+        {'template': {'maxMemory': 2048}}],
+    'blockDevices': [
+        {'template': {'blockDevices': [
+            {'device': '0', 'diskImage': {'capacity': 25}}],
+            'localDiskFlag': False}},
+        {'template': {'blockDevices': [
+            {'device': '2', 'diskImage': {'capacity': 100}}],
+            'localDiskFlag': False}},
+        {'template': {'blockDevices': [
+            {'device': '3', 'diskImage': {'capacity': 300}}],
+            'localDiskFlag': False}},
+        {'template': {'blockDevices': [
+            {'device': '0', 'diskImage': {'capacity': 100}}],
+            'localDiskFlag': True}},
+        {'template': {'blockDevices': [
+            {'device': '2', 'diskImage': {'capacity': 300}}],
+            'localDiskFlag': True}}],
+    'networkComponents': [
+        {'template': {'networkComponents': [{'maxSpeed': 10}]}},
+        {'template': {'networkComponents': [{'maxSpeed': 100}]}}]}
+
+BARE_METAL_OPTIONS = {
+    'locations': [
+        {'keyname': 'DALLAS05', 'long_name': 'DAL05 - Dallas'}],
+    'categories': {
+        'server_core': {'items': [
+            {'price_id': 50,
+             'description': '2 x 2.0 GHz Core Bare Metal Instance - 2 GB Ram',
+             'hourly_recurring_fee': '.2'},
+            {'price_id': 51,
+             'description': '4 x 2.0 GHz Core Bare Metal Instance - 8 GB Ram',
+             'hourly_recurring_fee': 0}]},
+        'os': {'items': [
+            {'price_id': 60,
+             'description': 'Ubuntu Linux 12.04 LTS Precise Pangolin '
+                            '(32 bit)'},
+            {'price_id': 61,
+             'description': 'Ubuntu Linux 12.04 LTS Precise Pangolin '
+                            '(64 bit)'}]},
+        'port_speed': {'items': [
+            {'price_id': 70, 'capacity': 100.0,
+             'description': '100 Mbps Private Network Uplink'},
+            {'price_id': 71, 'capacity': 100.0,
+             'description': '100 Mbps Public & Private Network Uplinks'}]}}}
+
+VLANS = [
+    {'id': 12, 'networkSpace': 'PRIVATE',
+     'primaryRouter': {'datacenter': {'name': 'dal05'}}},
+    {'id': 13, 'networkSpace': 'PUBLIC',
+     'primaryRouter': {'datacenter': {'name': 'dal05'}}}]
+
+
+class CatalogTest(Base):
+
+    def setUp(self):
+        self.provider = mock.MagicMock()
+        self.provider.get_create_options.return_value = CREATE_OPTIONS
+        self.provider.get_vlans.return_value = VLANS
+        self.provider.get_bare_metal_options.return_value = BARE_METAL_OPTIONS
+        self.path = os.path.join(self.mkdir(), 'slayer', 'catalog.json')
+        self.catalog = Catalog(self.provider, self.path)
+
+    def params(self, **kw):
+        params = {'cpus': 1, 'memory': 1024, 'nic_speed': 100}
+        params.update(kw)
+        return params
+
+    def test_cached(self):
+        self.assertEqual(self.catalog.nic_speeds(), set([10, 100]))
+        catalog = Catalog(self.provider, self.path)
+        self.assertEqual(catalog.datacenters(), set(['dal05', 'wdc01']))
+        self.assertEqual(self.provider.get_create_options.call_count, 1)
+        # Sections are only fetched when used.
+        self.assertFalse(self.provider.get_bare_metal_options.called)
+
+        # Stale caches are refetched.
+        os.utime(self.path, (0, 0))
+        Catalog(self.provider, self.path).cpus()
+        self.assertEqual(self.provider.get_create_options.call_count, 2)
+
+        # So are ones held in memory.
+        os.utime(self.path, (0, 0))
+        self.catalog.cpus()
+        self.assertEqual(self.provider.get_create_options.call_count, 2)
+        self.catalog._loaded -= self.catalog.ttl
+        self.catalog.cpus()
+        self.assertEqual(self.provider.get_create_options.call_count, 3)
+
+    def test_validate(self):
+        self.catalog.validate(self.params(
+            datacenter='dal05', private_vlan=12, public_vlan=13))
+        self.catalog.validate(self.params(
+            datacenters=[('dal05', 1), ('wdc01', 1)]))
+        for params in (self.params(nic_speed=1000),
+                       self.params(cpus=4),
+                       self.params(memory=4096),
+                       self.params(datacenter='sjc01'),
+                       self.params(datacenters=[('sjc01', 1)]),
+                       self.params(private_vlan=13),
+                       self.params(private_vlan=99),
+                       self.params(datacenter='wdc01', private_vlan=12)):
+            self.assertRaises(ConstraintError, self.catalog.validate, params)
+
+    def test_validate_refresh(self):
+        params = self.params(datacenter='dal05', private_vlan=14)
+        self.catalog.validate(self.params(private_vlan=12))
+        self.provider.get_vlans.return_value = VLANS + [
+            {'id': 14, 'networkSpace': 'PRIVATE',
+             'primaryRouter': {'datacenter': {'name': 'dal05'}}}]
+        # A fresh catalog isn't refetched.
+        self.assertRaises(ConstraintError, self.catalog.validate, params)
+        self.assertEqual(self.provider.get_vlans.call_count, 1)
+
+        # An older one is, once.
+        self.catalog._loaded -= self.catalog.refresh_age
+        self.catalog.validate(params)
+        self.assertEqual(self.provider.get_vlans.call_count, 2)
+        self.assertRaises(ConstraintError, self.catalog.validate,
+                          self.params(private_vlan=15))
+        self.assertEqual(self.provider.get_vlans.call_count, 2)
+        self.assertIn(14, Catalog(self.provider, self.path).vlans())
+
+    def test_validate_storage(self):
+        self.catalog.validate(self.params(disks=[25, 100, 300]))
+        self.catalog.validate(self.params(
+            local_disk=True, disks=[100, 300]))
+        self.catalog.validate(self.params(cpus=2, dedicated=True))
+        for params in (self.params(cpus=1, dedicated=True),
+                       self.params(disks=[100]),
+                       self.params(disks=[25, 300]),
+                       self.params(local_disk=True, disks=[25]),
+                       self.params(local_disk=True, disks=[100, 300, 300])):
+            self.assertRaises(ConstraintError, self.catalog.validate, params)
+
+    def test_bare_metal(self):
+        params = self.params(type='baremetal', cpus=2, memory=2048,
+                             datacenter='dal05')
+        self.catalog.validate(params)
+        self.assertEqual(
+            self.catalog.bare_metal_order(params, 'precise'),
+            {'server': 50, 'os': 61, 'port_speed': 71, 'hourly': True})
+        self.assertEqual(
+            self.catalog.bare_metal_order(
+                self.params(cpus=4, memory=8192), 'precise')['hourly'],
+            False)
+        self.assertEqual(
+            self.catalog.bare_metal_locations(), {'dal05': 'DALLAS05'})
+        self.assertRaises(
+            ConstraintError, self.catalog.bare_metal_order, params, 'trusty')
+        for params in (self.params(type='baremetal'),
+                       self.params(type='baremetal', cpus=2, memory=2048,
+                                   datacenter='wdc01'),
+                       self.params(type='baremetal', cpus=2, memory=2048,
+                                   nic_speed=1000)):
+            self.assertRaises(ConstraintError, self.catalog.validate, params)
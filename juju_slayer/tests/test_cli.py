@@ -0,0 +1,99 @@
+import mock
+import os
+import subprocess
+import sys
+import time
+
+from juju_slayer import cli
+from juju_slayer.exceptions import ConfigError
+from juju_slayer.tests.base import Base
+
+HEAVY_MODULES = (
+    'SoftLayer', 'requests', 'yaml',
+    'juju_slayer.commands', 'juju_slayer.config', 'juju_slayer.provider')
+
+# Generous bound on `juju-sl --description`, juju runs it for every
+# plugin when listing them.
+DESCRIPTION_MAX_SECONDS = 1.0
+
+
+class CliImportTest(Base):
+
+    def run_cli(self, *args):
+        """Run the cli parser in a fresh process, returning its output
+        and the modules it imported.
+        """
+        modules_path = os.path.join(self.mkdir(), 'modules')
+        code = (
+            "import sys; sys.argv = ['juju-sl'] + %r\n"
+            "try:\n"
+            "    from juju_slayer import cli\n"
+            "    cli.setup_parser().parse_args()\n"
+            "finally:\n"
+            "    open(%r, 'w').write(' '.join(sys.modules))\n") % (
+                list(args), modules_path)
+        process = subprocess.Popen(
+            [sys.executable, "-c", code],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            cwd=os.path.dirname(os.path.dirname(
+                os.path.dirname(os.path.abspath(__file__)))))
+        output, _ = process.communicate()
+        with open(modules_path) as fh:
+            return output, set(fh.read().split())
+
+    def assert_light(self, modules):
+        loaded = [m for m in HEAVY_MODULES if m in modules]
+        self.assertEqual(loaded, [])
+
+    def test_description(self):
+        output, modules = self.run_cli('--description')
+        self.assertEqual(output.strip(), "Juju SoftLayer client-side provider")
+        self.assert_light(modules)
+
+    def test_help(self):
+        output, modules = self.run_cli('add-machine', '--help')
+        self.assertIn('--num-machines', output)
+        self.assert_light(modules)
+
+    def test_argument_error(self):
+        output, modules = self.run_cli('add-machine', '-n', 'many')
+        self.assertIn('invalid int value', output)
+        self.assert_light(modules)
+
+    def test_description_time(self):
+        t = time.time()
+        self.run_cli('--description')
+        self.assertLess(time.time() - t, DESCRIPTION_MAX_SECONDS)
+
+
+class CliDaemonTest(Base):
+
+    def setUp(self):
+        self.change_environment(JUJU_HOME=self.mkdir())
+        for target in ('sys.stdout', 'logging.basicConfig'):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def main(self, *args):
+        with mock.patch('sys.argv', ['juju-sl'] + list(args)):
+            try:
+                cli.main()
+            except SystemExit, e:
+                return e.code
+
+    @mock.patch('juju_slayer.config.Config.validate')
+    @mock.patch('juju_slayer.daemon.call')
+    def test_daemon_call(self, mock_call, mock_validate):
+        mock_call.return_value = 0
+        self.assertEqual(self.main('status', '-e', 'slayer'), 0)
+        self.assertEqual(mock_call.call_count, 1)
+        self.assertFalse(mock_validate.called)
+
+    @mock.patch('juju_slayer.config.Config.validate')
+    @mock.patch('juju_slayer.daemon.call')
+    def test_autoscale_in_process(self, mock_call, mock_validate):
+        mock_validate.side_effect = ConfigError("No credentials")
+        self.assertEqual(self.main(
+            'autoscale', '-e', 'slayer', '--policy', 'policy.yaml'), 1)
+        self.assertFalse(mock_call.called)
@@ -1,6 +1,7 @@
 import mock
 import os
-import tempfile
+import subprocess
+import time
 import unittest
 import yaml
 
@@ -8,13 +9,29 @@ from juju_slayer.commands import (
     BaseCommand,
     Bootstrap,
     AddMachine,
+    CollectGarbage,
     TerminateMachine,
-    DestroyEnvironment)
-
-
-from juju_slayer.provider import SSHKey, Instance
-from juju_slayer.exceptions import ConfigError
+    DestroyEnvironment,
+    ImagePrune,
+    Push,
+    Run,
+    Status)
+
+from SoftLayer import SoftLayerAPIError
+from SoftLayer.exceptions import TransportError
+
+from juju_slayer import ops
+from juju_slayer.catalog import Catalog
+from juju_slayer.config import Config
+from juju_slayer.provider import SSHKey, Instance, Image, Hardware
+from juju_slayer.exceptions import (
+    ConfigError, ConstraintError, PrecheckError, ProviderError)
+from juju_slayer.images import ImageRegistry
+from juju_slayer.journal import Journal
+from juju_slayer.lock import RunRegistry
+from juju_slayer.pool import InstancePool
 from juju_slayer.tests.base import Base
+from juju_slayer.tests.test_catalog import BARE_METAL_OPTIONS
 
 
 class CommandBase(Base):
@@ -24,11 +41,32 @@ class CommandBase(Base):
         self.provider = mock.MagicMock()
         self.env = mock.MagicMock()
 
+    def use_journal(self):
+        journal = Journal(os.path.join(self.mkdir(), 'softlayer.journal'))
+        self.config.get_journal.return_value = journal
+        return journal
+
     def setup_env(self, conf=None):
         self.provider.get_ssh_keys.return_value = [
             SSHKey({'id': 1, 'label': 'abc'})]
         self.config.series = "precise"
-        with tempfile.NamedTemporaryFile(delete=False) as f:
+        self.config.resume = False
+        self.config.recycle = False
+        self.config.qualify = None
+        self.config.apt_cache = False
+        self.config.get_apt_proxy.return_value = None
+        self.config.get_pool.return_value = InstancePool(
+            os.path.join(self.mkdir(), 'softlayer.pool'))
+        self.config.run_id = 'run-1'
+        self.config.get_runs.return_value = RunRegistry(
+            os.path.join(self.mkdir(), 'runs'))
+        self.config.num_machines = 1
+        self.config.image = None
+        self.config.get_images.return_value = ImageRegistry(
+            os.path.join(self.mkdir(), 'images.yaml'))
+        juju_home = self.mkdir()
+        self.change_environment(JUJU_HOME=juju_home)
+        with open(os.path.join(juju_home, 'environments.yaml'), 'w') as f:
             self.config.get_env_conf.return_value = f.name
             self.config.get_env_name.return_value = 'softlayer'
             if conf is None:
@@ -38,8 +76,8 @@ class CommandBase(Base):
                             'type': 'null',
                             'bootstrap-host': None}}}
             f.write(yaml.safe_dump(conf))
-            f.flush()
-            self.addCleanup(lambda: os.remove(f.name))
+        self.config.get_env_config.side_effect = Config(
+            mock.Mock(environment='softlayer')).get_env_config
 
 
 class BaseCommandTest(CommandBase):
@@ -56,6 +94,52 @@ class BaseCommandTest(CommandBase):
             self.cmd.get_slayer_ssh_keys(),
             [1, 32])
 
+    def place(self, constraints, datacenter):
+        self.config.constraints = constraints
+        params = self.cmd.solve_constraints()
+        self.cmd.place(params, datacenter)
+        return params
+
+    def test_solve_constraints_image(self):
+        self.setup_env()
+        self.assertEqual(self.place("region=dal05", 'dal05')['os_code'],
+                         'UBUNTU_12_64')
+
+        self.config.get_images().record(
+            'precise', 'dal05', Image(
+                id=3, globalIdentifier='abc-def', name='juju-precise-dal05'))
+        # Images are only applied once placed in their datacenter.
+        self.config.constraints = "region=dal05"
+        self.assertEqual(self.cmd.solve_constraints()['os_code'],
+                         'UBUNTU_12_64')
+        params = self.place("region=dal05", 'dal05')
+        self.assertNotIn('os_code', params)
+        self.assertEqual(params['image_id'], 'abc-def')
+
+        for constraints, datacenter in (("region=wdc01", 'wdc01'),
+                                        ("region=dal05|wdc01", 'wdc01'),
+                                        ("", None)):
+            self.assertEqual(
+                self.place(constraints, datacenter)['os_code'],
+                'UBUNTU_12_64')
+
+        # Images carry their own disks.
+        self.assertEqual(
+            self.place("region=dal05, disks=100G", 'dal05')['os_code'],
+            'UBUNTU_12_64')
+        self.config.constraints = "region=dal05, disks=100G"
+        self.config.image = 'abc-def'
+        self.assertRaises(ConstraintError, self.cmd.solve_constraints)
+
+    def test_solve_constraints_storage(self):
+        self.setup_env()
+        self.config.constraints = ""
+        self.assertEqual(self.cmd.solve_constraints()['local_disk'], False)
+        self.config.constraints = "local-disk=true, dedicated=true"
+        params = self.cmd.solve_constraints()
+        self.assertEqual(params['local_disk'], True)
+        self.assertEqual(params['dedicated'], True)
+
     def test_check_preconditions_okay(self):
         self.setup_env()
         self.assertEqual(self.cmd.check_preconditions(), [1])
@@ -106,6 +190,10 @@ class BootstrapTest(CommandBase):
         super(BootstrapTest, self).setUp()
         self.cmd = Bootstrap(self.config, self.provider, self.env)
 
+    def setup_env(self, conf=None):
+        super(BootstrapTest, self).setup_env(conf)
+        self.config.num_machines = 0
+
     @mock.patch('juju_slayer.ops.ssh')
     def test_bootstrap(self, mock_ssh):
         self.setup_env()
@@ -123,6 +211,98 @@ class BootstrapTest(CommandBase):
 
         mock_ssh.check_ssh.assert_called_once_with('10.0.2.1')
         mock_ssh.update_instance.assert_called_once_with('10.0.2.1')
+
+    @mock.patch('juju_slayer.ops.ssh')
+    def test_bootstrap_with_machines(self, mock_ssh):
+        self.setup_env()
+        self.env.is_running.return_value = False
+        self.config.num_machines = 2
+        mock_ssh.check_ssh.return_value = True
+        self.provider.get_instance.return_value = Instance(dict(
+            id=2121, hostname='slayer-13290123j13',
+            primaryIpAddress="10.0.2.1"))
+
+        calls = []
+        self.env.bootstrap_jenv.side_effect = (
+            lambda host, apt_proxy: calls.append('bootstrap'))
+        self.env.add_machine.side_effect = (
+            lambda location: calls.append('add-machine'))
+        self.cmd.run()
+
+        # call_count isn't thread safe, mock_calls is.
+        self.assertEqual(
+            [c[0] for c in self.provider.mock_calls].count('launch_instance'),
+            3)
+        self.assertEqual(calls, ['bootstrap', 'add-machine', 'add-machine'])
+
+    @mock.patch('juju_slayer.commands.ssh.setup_apt_cache')
+    @mock.patch('juju_slayer.ops.ssh')
+    def test_bootstrap_apt_cache(self, mock_ssh, mock_setup):
+        self.setup_env()
+        self.env.is_running.return_value = False
+        self.config.apt_cache = True
+        mock_ssh.check_ssh.return_value = True
+        self.provider.get_instance.return_value = Instance(dict(
+            id=2121, hostname='slayer-13290123j13',
+            primaryIpAddress="10.0.2.1", primaryBackendIpAddress="10.1.0.5"))
+        self.cmd.run()
+        mock_setup.assert_called_once_with('10.0.2.1', '10.1.0.5')
+        self.env.bootstrap_jenv.assert_called_once_with(
+            '10.0.2.1', apt_proxy='http://10.1.0.5:3142')
+
+        # Without a cache, machines use the public mirrors.
+        mock_setup.side_effect = subprocess.CalledProcessError(
+            100, ['apt-get'], "E: Unable to locate package")
+        self.assertEqual(self.cmd.setup_apt_cache(
+            self.provider.get_instance.return_value), None)
+
+    @mock.patch('juju_slayer.ops.ssh')
+    def test_bootstrap_failure_cancels_machines(self, mock_ssh):
+        self.setup_env()
+        self.env.is_running.return_value = False
+        self.config.num_machines = 1
+        self.config.domain = 'example.com'
+        journal = self.use_journal()
+        mock_ssh.check_ssh.return_value = True
+        self.provider.launch_instance.return_value = Instance(dict(
+            id=221, hostname='softlayer-abc'))
+        self.provider.get_instance.side_effect = lambda i, kind=None: (
+            Instance(dict(id=i, hostname='softlayer-abc',
+                          primaryIpAddress="10.0.2.1")))
+        self.env.bootstrap_jenv.side_effect = ValueError("Bad")
+
+        self.assertRaises(ValueError, self.cmd.run)
+        self.assertEqual(
+            self.provider.terminate_instance.call_args_list,
+            [mock.call(221, 'virtual'), mock.call(221, 'virtual')])
+        self.assertFalse(self.env.add_machine.called)
+        self.assertEqual(journal.pending(), [])
+
+    @mock.patch('juju_slayer.ops.ssh')
+    def test_bootstrap_host_failure_cancels_machines(self, mock_ssh):
+        self.setup_env()
+        self.env.is_running.return_value = False
+        self.config.num_machines = 2
+        self.config.domain = 'example.com'
+        journal = self.use_journal()
+        mock_ssh.check_ssh.return_value = True
+
+        def launch(params):
+            if params['hostname'] == 'softlayer-0':
+                raise ProviderError("Order failed")
+            return Instance(dict(id=221, hostname=params['hostname']))
+        self.provider.launch_instance.side_effect = launch
+        self.provider.get_instance.side_effect = lambda i, kind=None: (
+            Instance(dict(id=i, hostname='softlayer-abc',
+                          primaryIpAddress="10.0.2.1")))
+
+        self.assertRaises(ProviderError, self.cmd.run)
+        self.assertEqual(
+            self.provider.terminate_instance.call_args_list,
+            [mock.call(221, 'virtual')] * 2)
+        self.assertFalse(self.env.bootstrap_jenv.called)
+        self.assertEqual(journal.pending(), [])
+
     # TODO
     # test existing named host / ie precondition check for live env
     # test for jenv bootstrap (also in test_environment.py)
@@ -138,6 +318,252 @@ class AddMachineTest(CommandBase):
         self.setup_env()
         self.cmd.run()
 
+    @mock.patch('juju_slayer.ops.ssh')
+    def test_add_machine_claims_recycled(self, mock_ssh):
+        self.setup_env()
+        self.config.num_machines = 2
+        self.config.constraints = "mem=2G"
+        pool = self.config.get_pool()
+        pool.park(221, 1, 2048, 'dal05', os_code='UBUNTU_12_64',
+                  nic_speed=100)
+        # A faster nic than ordered.
+        pool.park(222, 1, 2048, 'dal05', os_code='UBUNTU_12_64',
+                  nic_speed=1000)
+        mock_ssh.check_ssh.return_value = True
+        self.provider.get_instance.return_value = Instance(dict(
+            id=221, hostname='softlayer-abc', primaryIpAddress="10.0.2.1"))
+        self.cmd.run()
+        self.assertEqual(self.provider.launch_instance.call_count, 1)
+        self.provider.get_instance.assert_any_call(221)
+        self.assertEqual([e['id'] for e in pool.entries()], [222])
+
+    @mock.patch('juju_slayer.ops.qualify.benchmark')
+    @mock.patch('juju_slayer.ops.ssh')
+    def test_add_machine_qualify(self, mock_ssh, mock_benchmark):
+        self.setup_env()
+        self.config.qualify = {'cpu': 200.0, 'steal': 5.0}
+        self.config.domain = 'example.com'
+        journal = self.use_journal()
+        mock_ssh.check_ssh.return_value = True
+        self.provider.launch_instance.side_effect = [
+            Instance(dict(id=1, hostname='softlayer-a')),
+            Instance(dict(id=2, hostname='softlayer-b'))]
+        self.provider.get_instance.side_effect = lambda i, kind: Instance(
+            dict(id=i, hostname='softlayer-%s' % i,
+                 primaryIpAddress="10.0.2.%s" % i))
+        # A noisy neighbour, then a healthy host.
+        mock_benchmark.side_effect = [
+            {'cpu': 410.0, 'steal': 22.5}, {'cpu': 405.0, 'steal': 0.5}]
+        self.env.add_machine.return_value = '3'
+        self.cmd.run()
+
+        self.provider.terminate_instance.assert_called_once_with(
+            1, 'virtual')
+        self.env.add_machine.assert_called_once_with('ssh:root@10.0.2.2')
+        self.assertEqual(journal.registry(), {'3': 2})
+        [state] = journal.load().values()
+        self.assertEqual(state['rejected'], 1)
+        self.assertIn('qualified', state['steps'])
+
+    @mock.patch('time.sleep')
+    @mock.patch('juju_slayer.ops.qualify.benchmark')
+    @mock.patch('juju_slayer.ops.ssh')
+    def test_add_machine_qualify_errors(self, mock_ssh, mock_benchmark,
+                                       mock_sleep):
+        self.setup_env()
+        self.config.qualify = {'cpu': 200.0}
+        instance = Instance(dict(
+            id=1, hostname='softlayer-a', primaryIpAddress="10.0.2.1"))
+        self.provider.launch_instance.return_value = instance
+        self.provider.get_instance.return_value = instance
+        mock_ssh.check_ssh.return_value = True
+        error = subprocess.CalledProcessError(255, 'ssh', 'Connection reset')
+        op = ops.MachineAdd(self.provider, self.env, {
+            'hostname': 'softlayer-a'}, qualify=self.config.qualify)
+
+        # A failed benchmark is retried rather than disqualifying.
+        mock_benchmark.side_effect = [error, {'cpu': 405.0}]
+        self.assertEqual(op.run(), instance)
+
+        # Still failing, the op fails but keeps the instance.
+        mock_benchmark.side_effect = error
+        self.assertRaises(ProviderError, op.run)
+        self.assertEqual(
+            mock_benchmark.call_count, 2 + ops.MachineAdd.benchmark_attempts)
+        self.assertFalse(self.provider.terminate_instance.called)
+
+    @mock.patch('juju_slayer.ops.qualify.benchmark')
+    @mock.patch('juju_slayer.ops.ssh')
+    def test_add_machine_failed(self, mock_ssh, mock_benchmark):
+        self.setup_env()
+        self.config.domain = 'example.com'
+        journal = self.use_journal()
+        mock_ssh.check_ssh.return_value = True
+
+        # A lost connection may go through on resume.
+        self.provider.launch_instance.side_effect = TransportError(
+            0, "Connection reset")
+        self.cmd.run()
+        self.assertEqual(len(journal.pending()), 1)
+
+        # A refused order never will.
+        self.provider.launch_instance.side_effect = SoftLayerAPIError(
+            'SoftLayer_Exception_Public',
+            'Price #1641 is not available in location dal05.')
+        self.config.resume = True
+        self.cmd.run()
+        self.assertEqual(journal.pending(), [])
+        [state] = journal.load().values()
+        self.assertIn('failed', state['steps'])
+
+        # Nor does running out of replacements for disqualified hosts.
+        self.config.resume = False
+        self.config.qualify = {'cpu': 200.0}
+        self.provider.launch_instance.side_effect = None
+        self.provider.launch_instance.return_value = Instance(dict(
+            id=1, hostname='softlayer-a'))
+        self.provider.get_instance.return_value = Instance(dict(
+            id=1, hostname='softlayer-a', primaryIpAddress="10.0.2.1"))
+        mock_benchmark.return_value = {'cpu': 80.0}
+        self.cmd.run()
+        self.assertEqual(journal.pending(), [])
+
+    @mock.patch('juju_slayer.ops.ssh')
+    def test_add_machine_apt_proxy(self, mock_ssh):
+        self.setup_env()
+        self.config.get_apt_proxy.return_value = 'http://10.1.0.5:3142'
+        mock_ssh.check_ssh.return_value = True
+        self.provider.get_instance.return_value = Instance(dict(
+            id=221, hostname='softlayer-abc', primaryIpAddress="10.0.2.1"))
+        self.cmd.run()
+        mock_ssh.use_apt_proxy.assert_called_once_with(
+            '10.0.2.1', 'http://10.1.0.5:3142')
+        # The proxy is set up before packages are installed.
+        self.assertEqual(
+            [c[0] for c in mock_ssh.mock_calls
+             if c[0] in ('use_apt_proxy', 'update_instance')],
+            ['use_apt_proxy', 'update_instance'])
+
+    @mock.patch('juju_slayer.ops.ssh')
+    def test_add_machine_fallback(self, mock_ssh):
+        self.setup_env()
+        self.config.constraints = (
+            "mem=2G, region=dal05|dal06, fallback=region|size")
+        self.config.domain = 'example.com'
+        self.config.spread = 'fill-first'
+        journal = self.use_journal()
+        mock_ssh.check_ssh.return_value = True
+        orders = []
+
+        def launch(params):
+            orders.append((params['datacenter'], params['memory']))
+            if len(orders) < 3:
+                raise SoftLayerAPIError(
+                    'SoftLayer_Exception_Public',
+                    'There is insufficient capacity to complete the request')
+            return Instance(dict(id=221, hostname=params['hostname']))
+        self.provider.launch_instance.side_effect = launch
+        self.provider.get_instance.return_value = Instance(dict(
+            id=221, hostname='softlayer-abc', primaryIpAddress="10.0.2.1"))
+        self.env.add_machine.return_value = '1'
+        self.cmd.run()
+
+        # Next datacenter of the region list, then the next size up.
+        self.assertEqual(
+            orders, [('dal05', 2048), ('dal06', 2048), ('dal05', 4096)])
+        [state] = journal.load().values()
+        self.assertEqual(state['fallback'], 2)
+        self.assertEqual(len(state['fallbacks']), 3)
+
+        # Invalid orders aren't retried.
+        orders[:] = []
+        self.provider.launch_instance.side_effect = SoftLayerAPIError(
+            'SoftLayer_Exception_Public', 'Invalid hostname')
+        self.assertRaises(
+            SoftLayerAPIError, ops.MachineAdd(
+                self.provider, self.env, {'hostname': 'softlayer-b'},
+                fallbacks=[{'hostname': 'softlayer-b'}]).launch)
+        self.assertEqual(self.provider.launch_instance.call_count, 4)
+
+    def use_bare_metal(self):
+        self.config.constraints = (
+            "type=baremetal, cpu-cores=2, mem=2G, region=dal05")
+        self.config.domain = 'example.com'
+        self.config.get_catalog.return_value = Catalog(
+            self.provider, os.path.join(self.mkdir(), 'catalog.json'))
+        self.provider.get_bare_metal_options.return_value = BARE_METAL_OPTIONS
+        hardware = Hardware(dict(
+            id=301, hostname='softlayer-abc', primaryIpAddress="10.0.3.1"))
+        self.provider.launch_instance.return_value = None
+        self.provider.find_hardware.return_value = hardware
+        self.provider.get_instance.return_value = hardware
+
+    @mock.patch('juju_slayer.ops.ssh')
+    def test_add_machine_bare_metal(self, mock_ssh):
+        self.setup_env()
+        self.use_bare_metal()
+        journal = self.use_journal()
+        mock_ssh.check_ssh.return_value = True
+        self.env.add_machine.return_value = '5'
+        self.cmd.run()
+
+        params = self.provider.launch_instance.call_args[0][0]
+        self.assertEqual(
+            [params[k] for k in (
+                'type', 'server', 'os', 'port_speed', 'location', 'hourly')],
+            ['baremetal', 50, 61, 71, 'DALLAS05', True])
+        self.provider.find_hardware.assert_called_once_with(
+            params['hostname'], params['domain'])
+        self.provider.get_instance.assert_called_once_with(301, 'baremetal')
+        self.provider.tag_instance.assert_called_once_with(
+            301, ['juju-machine-5'], 'baremetal')
+        mock_ssh.update_instance.assert_called_once_with('10.0.3.1')
+        self.assertEqual(journal.registry(), {'5': 301})
+
+    @mock.patch('juju_slayer.ops.ssh')
+    def test_add_machine_bare_metal_resume(self, mock_ssh):
+        self.setup_env()
+        self.use_bare_metal()
+        self.config.resume = True
+        journal = self.use_journal()
+        # Interrupted before hardware was allocated to the order.
+        journal.record('abc', 'queued', params={
+            'type': 'baremetal', 'hostname': 'softlayer-abc',
+            'domain': 'example.com'}, series='precise')
+        journal.record('abc', 'ordered', hostname='softlayer-abc')
+        mock_ssh.check_ssh.return_value = True
+        self.env.add_machine.return_value = '5'
+        self.cmd.run()
+
+        self.assertFalse(self.provider.launch_instance.called)
+        self.provider.find_hardware.assert_called_once_with(
+            'softlayer-abc', 'example.com')
+        self.assertEqual(journal.registry(), {'5': 301})
+
+    @mock.patch('juju_slayer.ops.ssh')
+    def test_add_machine_resume(self, mock_ssh):
+        self.setup_env()
+        self.config.resume = True
+        journal = self.use_journal()
+        journal.record('abc', 'queued', params={'hostname': 'softlayer-abc'},
+                       series='precise')
+        journal.record('abc', 'ordered', instance_id=2121)
+        journal.record('abc', 'provisioned')
+        journal.record('def', 'queued', params={}, series='precise')
+        journal.record('def', 'registered', machine_id='3')
+
+        mock_ssh.check_ssh.return_value = True
+        self.provider.get_instance.return_value = Instance(dict(
+            id=2121, hostname='softlayer-abc', primaryIpAddress="10.0.2.1"))
+        self.env.add_machine.return_value = '4'
+        self.cmd.run()
+
+        self.assertFalse(self.provider.launch_instance.called)
+        self.assertFalse(self.provider.wait_on.called)
+        self.env.add_machine.assert_called_once_with('ssh:root@10.0.2.1')
+        self.assertEqual(journal.pending(), [])
+        self.assertEqual(journal.load()['abc']['machine_id'], '4')
+
 
 class TerminateMachineTest(CommandBase):
 
@@ -162,7 +588,37 @@ class TerminateMachineTest(CommandBase):
                 primaryIpAddress="10.0.1.103"))]
         self.config.options.machines = ["1"]
         self.cmd.run()
-        self.provider.terminate_instance.assert_called_once_with(221)
+        self.provider.terminate_instance.assert_called_once_with(
+            221, 'virtual')
+
+    def test_terminate_machine_recycle(self):
+        self.setup_env()
+        self.config.recycle = True
+        self.env.status.return_value = {
+            'machines': {'1': {'dns-name': '10.0.1.23'}}}
+        self.provider.get_instances.return_value = [
+            Instance(dict(
+                id=221, hostname="slayer-123123", maxCpu=2, maxMemory=2048,
+                datacenter={'name': 'dal05'}, primaryIpAddress="10.0.1.23",
+                operatingSystem={'softwareLicense': {'softwareDescription': {
+                    'referenceCode': 'UBUNTU_12_64'}}},
+                primaryNetworkComponent={
+                    'maxSpeed': 100, 'networkVlan': {'id': 7}},
+                primaryBackendNetworkComponent={
+                    'maxSpeed': 100, 'networkVlan': {'id': 8}}))]
+        self.config.options.machines = ["1"]
+        self.cmd.run()
+        self.env.terminate_machines.assert_called_once_with(['1'])
+        self.assertFalse(self.provider.terminate_instance.called)
+        self.provider.reload_instance.assert_called_once_with(
+            221, ssh_keys=[1], kind='virtual')
+        pool = self.config.get_pool()
+        order = dict(os_code='UBUNTU_12_64', nic_speed=100)
+        self.assertEqual(pool.claim(2, 2048, 'wdc01', **order), None)
+        self.assertEqual(
+            pool.claim(2, 2048, 'dal05', private_vlan=9, **order), None)
+        self.assertEqual(
+            pool.claim(2, 2048, 'dal05', private_vlan=8, **order), 221)
 
 
 class DestroyEnvironmentTest(CommandBase):
@@ -196,8 +652,293 @@ class DestroyEnvironmentTest(CommandBase):
         self.cmd.run()
         self.assertEqual(
             self.provider.terminate_instance.call_args_list,
-            [mock.call(258), mock.call(221)])
+            [mock.call(258, 'virtual'), mock.call(221, 'virtual')])
         self.env.terminate_machines.assert_called_once_with(['1'])
 
+
+class StatusTest(CommandBase):
+
+    @mock.patch('sys.stdout')
+    def test_status(self, mock_stdout):
+        self.setup_env()
+        self.use_journal()
+        self.config.domain = 'juju.ubuntu'
+        self.env.status.return_value = {
+            'machines': {
+                '0': {'dns-name': '10.0.1.23', 'agent-state': 'started'},
+                '1': {'dns-name': '10.0.1.25', 'life': 'dead'}}}
+        self.provider.get_instances.return_value = [
+            Instance(dict(id=221, hostname="softlayer-0",
+                          primaryIpAddress="10.0.1.23",
+                          provisionDate="2014-04-01")),
+            Instance(dict(id=258, hostname="softlayer-209123",
+                          primaryIpAddress="10.0.1.103",
+                          provisionDate="2014-04-01"))]
+        cmd = Status(self.config, self.provider, self.env)
+        cmd.run()
+        self.provider.get_instances.assert_called_once_with(
+            domain='juju.ubuntu', hostname='softlayer-*')
+        output = "".join(c[0][0] for c in mock_stdout.write.call_args_list)
+        self.assertIn("1        -          10.0.1.25", output)
+        self.assertIn("dead (no instance)", output)
+        self.assertIn("Orphaned instances:\n  258", output)
+
+
+class TargetBase(CommandBase):
+
+    def setup_machines(self, count):
+        """Live machines 0 to count - 1, and a dead one.
+        """
+        self.setup_env()
+        self.use_journal()
+        self.config.domain = 'juju.ubuntu'
+        self.config.options.machines = None
+        self.config.options.tag = None
+        machines = {str(count): {'dns-name': '10.0.1.99', 'life': 'dead'}}
+        instances = []
+        for i in range(count):
+            machines[str(i)] = {'dns-name': '10.0.1.%d' % (i + 23)}
+            instances.append(Instance(dict(
+                id=221 + i, hostname="softlayer-%d" % i,
+                primaryIpAddress="10.0.1.%d" % (i + 23),
+                primaryBackendIpAddress="10.1.0.%d" % (i + 23),
+                provisionDate="2014-04-01",
+                tagReferences=i and [{'tag': {'name': 'web'}}] or [])))
+        self.env.status.return_value = {'machines': machines}
+        self.provider.get_instances.return_value = instances
+
+
+class CollectGarbageTest(TargetBase):
+
+    def setUp(self):
+        super(CollectGarbageTest, self).setUp()
+        self.setup_machines(2)
+        self.config.get_env_name.return_value = 'softlayer'
+        self.config.min_age = 3600
+        self.config.dry_run = False
+        self.journal = self.config.get_journal()
+        instances = self.provider.get_instances.return_value
+        # Machine instances, then a sibling environment's instances the
+        # listing's prefix match includes.
+        names = ['softlayer-%s' % (c * 32) for c in 'abcd'] + [
+            'softlayer-eu-0', 'softlayer-eu-%s' % ('e' * 32)]
+        for i, name in enumerate(names):
+            instances.append(Instance(dict(
+                id=300 + i, hostname=name, primaryIpAddress="10.0.3.%d" % i,
+                createDate=time.strftime(
+                    "%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - 7200)),
+                provisionDate="2014-04-01")))
+        # A fresh order.
+        instances[-3]['createDate'] = time.strftime(
+            "%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        # An op of a live run, and one whose run died.
+        self.config.get_runs().start('run-1')
+        self.addCleanup(self.config.get_runs().stop, 'run-1')
+        self.journal.record(
+            'live', 'queued', params={'hostname': names[1]}, run='run-1')
+        self.journal.record(
+            'dead', 'queued', params={'hostname': names[2]}, run='run-0')
+        self.journal.record('dead', 'ordered', instance_id=302)
+        self.cmd = CollectGarbage(self.config, self.provider, self.env)
+
+    @mock.patch('sys.stdout')
+    def test_collect(self, mock_stdout):
+        self.cmd.run()
+        self.assertEqual(
+            sorted(c[0][0] for c in
+                   self.provider.terminate_instance.call_args_list),
+            [300, 302])
+        self.assertEqual(
+            [s['op'] for s in self.journal.pending()], ['live'])
+        output = "".join(c[0][0] for c in mock_stdout.write.call_args_list)
+        self.assertIn("Cancelled 2 of 2 instances", output)
+
+    @mock.patch('sys.stdout')
+    def test_dry_run(self, mock_stdout):
+        self.config.dry_run = True
+        self.cmd.run()
+        self.assertFalse(self.provider.terminate_instance.called)
+        output = "".join(c[0][0] for c in mock_stdout.write.call_args_list)
+        self.assertIn("300        10.0.3.0", output)
+        self.assertIn("Dry run, 2 instances not cancelled", output)
+
+    @mock.patch('sys.stdout')
+    def test_parked(self, mock_stdout):
+        pool = self.config.get_pool()
+        pool.max_age = 3600
+        with mock.patch('time.time', return_value=time.time() - 7200):
+            pool.park(302, 1, 1024, 'dal05')
+        pool.park(300, 1, 1024, 'dal05')
+        self.cmd.run()
+        # Only the instance parked past the pool's max age.
+        self.provider.terminate_instance.assert_called_once_with(
+            302, 'virtual')
+        self.assertEqual([e['id'] for e in pool.entries()], [300])
+
+    @mock.patch('sys.stdout')
+    def test_sibling_environment(self, mock_stdout):
+        # Nothing of softlayer-eu backs a softlayer machine, but it's
+        # not softlayer's to collect.
+        self.config.dry_run = True
+        self.cmd.run()
+        output = "".join(c[0][0] for c in mock_stdout.write.call_args_list)
+        self.assertNotIn("softlayer-eu", output)
+
+    def test_unmatched_machines(self):
+        self.env.status.return_value['machines']['1']['dns-name'] = (
+            '10.0.9.9')
+        self.assertRaises(PrecheckError, self.cmd.run)
+        self.assertFalse(self.provider.terminate_instance.called)
+
+
+class RunTest(TargetBase):
+
+    def setUp(self):
+        super(RunTest, self).setUp()
+        self.setup_machines(2)
+        self.config.concurrency = 2
+        self.config.ssh_control_dir = os.path.join(self.mkdir(), 'ssh')
+        self.config.options.remote_command = ['uptime']
+        self.cmd = Run(self.config, self.provider, self.env)
+
+    @mock.patch('sys.stdout')
+    @mock.patch('juju_slayer.ops.ssh.execute')
+    def test_run(self, mock_execute, mock_stdout):
+        mock_execute.side_effect = lambda host, command, control_dir: (
+            host == '10.0.1.24' and 1 or 0, "up on %s\n" % host)
+        self.cmd.run()
+        self.assertEqual(
+            sorted(c[0][0] for c in mock_execute.call_args_list),
+            ['10.0.1.23', '10.0.1.24'])
+        mock_execute.assert_any_call(
+            '10.0.1.23', 'uptime', control_dir=self.config.ssh_control_dir)
+        self.assertTrue(os.path.isdir(self.config.ssh_control_dir))
+        output = "".join(c[0][0] for c in mock_stdout.write.call_args_list)
+        self.assertIn("== machine 1 10.0.1.24 exit 1 in", output)
+        self.assertIn("up on 10.0.1.23\n", output)
+        self.assertIn("Ran on 2 machines", output)
+        self.assertIn("1 failed: 1", output)
+
+    @mock.patch('juju_slayer.ops.ssh.execute')
+    def test_run_no_concurrency(self, mock_execute):
+        self.config.concurrency = 0
+        self.assertRaises(ConfigError, self.cmd.run)
+        self.assertFalse(mock_execute.called)
+
+    def test_get_targets(self):
+        index = self.cmd.get_index()
+        self.assertEqual(self.cmd.get_targets(index), [
+            ('0', '10.0.1.23'), ('1', '10.0.1.24')])
+        self.config.options.tag = 'web'
+        self.assertEqual(
+            self.cmd.get_targets(index), [('1', '10.0.1.24')])
+        self.config.options.tag = None
+        self.config.options.machines = ['0,2']
+        self.assertEqual(
+            self.cmd.get_targets(index), [('0', '10.0.1.23')])
+        self.config.options.machines = ['5']
+        self.assertRaises(ConfigError, self.cmd.get_targets, index)
+
+
+class PushTest(TargetBase):
+
+    def setUp(self):
+        super(PushTest, self).setUp()
+        self.setup_machines(6)
+        self.config.options.fanout = 2
+        self.config.options.destination = '/srv/data.tgz'
+        self.config.options.source = os.path.join(self.mkdir(), 'data.tgz')
+        with open(self.config.options.source, 'w') as fh:
+            fh.write('data')
+        self.digest = (
+            '3a6eb0790f39ac87c94f3856b2dd2c5d110e6811602261a9a923d3bb23adc8b7')
+        self.cmd = Push(self.config, self.provider, self.env)
+
+    @mock.patch('sys.stdout')
+    @mock.patch('juju_slayer.ops.ssh')
+    def test_push(self, mock_ssh, mock_stdout):
+        copies = {}
+
+        def relay(source, target, path):
+            copies[target] = source
+            if target == '10.1.0.26' and target not in failures:
+                failures.append(target)
+                raise subprocess.CalledProcessError(1, ['scp'], "Lost")
+        failures = []
+        mock_ssh.relay.side_effect = relay
+        mock_ssh.checksum.return_value = self.digest
+        self.cmd.run()
+
+        # Uploaded once, the rest relayed over the private network.
+        mock_ssh.push.assert_called_once_with(
+            '10.0.1.23', self.config.options.source, '/srv/data.tgz')
+        self.assertEqual(copies['10.1.0.24'], '10.0.1.23')
+        self.assertEqual(sorted(copies), [
+            '10.1.0.24', '10.1.0.25', '10.1.0.26', '10.1.0.27', '10.1.0.28'])
+        # Verified once on each machine, the failed copy was retried.
+        self.assertEqual(len(mock_ssh.checksum.mock_calls), 6)
+        self.assertEqual(failures, ['10.1.0.26'])
+        output = "".join(c[0][0] for c in mock_stdout.write.call_args_list)
+        self.assertIn("to 6 machines", output)
+        self.assertIn("0 failed", output)
+
+    @mock.patch('sys.stdout')
+    @mock.patch('juju_slayer.ops.ssh')
+    def test_push_checksum_mismatch(self, mock_ssh, mock_stdout):
+        mock_ssh.checksum.side_effect = lambda host, path: (
+            host == '10.0.1.28' and 'bad' or self.digest)
+        self.cmd.run()
+        output = "".join(c[0][0] for c in mock_stdout.write.call_args_list)
+        self.assertIn("to 5 machines", output)
+        self.assertIn("1 failed: 5", output)
+        self.assertEqual(
+            len([c for c in mock_ssh.relay.mock_calls
+                 if c[1][1] == '10.1.0.28']), Push.max_attempts)
+
+    def test_push_missing_file(self):
+        self.config.options.source = '/nonexistent'
+        self.assertRaises(ConfigError, self.cmd.run)
+
+
+class ImagePruneTest(CommandBase):
+
+    def setUp(self):
+        super(ImagePruneTest, self).setUp()
+        self.setup_env()
+        self.config.dry_run = False
+        self.cmd = ImagePrune(self.config, self.provider, self.env)
+        self.registry = self.config.get_images()
+        for n, name in ((3, 'c'), (1, 'a'), (2, 'b')):
+            datacenter = name == 'b' and 'wdc01' or 'dal05'
+            self.registry.record('precise', datacenter, Image(
+                id=n, globalIdentifier=name,
+                name='juju-precise-%s-%d' % (datacenter, n != 3)))
+        self.provider.get_images.return_value = [
+            Image(id=1, globalIdentifier='a', name='juju-precise-dal05-1'),
+            Image(id=3, globalIdentifier='c', name='juju-precise-dal05-0'),
+            # Captured by another workstation.
+            Image(id=5, globalIdentifier='e', name='juju-precise-dal05-2'),
+            Image(id=4, globalIdentifier='d', name='my-own-image')]
+
+    def test_image_prune(self):
+        self.cmd.run()
+        self.provider.delete_image.assert_called_once_with(3)
+        self.assertEqual(
+            [(s, d) for s, d, i in self.registry.items()],
+            [('precise', 'dal05')])
+        self.assertEqual(self.registry.superseded(), [])
+
+    @mock.patch('sys.stdout')
+    def test_dry_run(self, mock_stdout):
+        self.config.dry_run = True
+        self.cmd.run()
+        self.assertFalse(self.provider.delete_image.called)
+        self.assertEqual(len(self.registry.items()), 2)
+        output = "".join(c[0][0] for c in mock_stdout.write.call_args_list)
+        self.assertIn(
+            "Would delete superseded image juju-precise-dal05-0", output)
+        self.assertIn(
+            "Would forget missing image juju-precise-wdc01-1", output)
+
 if __name__ == '__main__':
     unittest.main()
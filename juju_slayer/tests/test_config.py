@@ -1,7 +1,7 @@
 import os
 import yaml
 
-from juju_slayer.config import Config
+from juju_slayer.config import Config, load_yaml
 from juju_slayer.exceptions import ConfigError
 
 from base import Base
@@ -56,3 +56,60 @@ class ConfigTest(Base):
         # Via Environment
         self.change_environment(JUJU_ENV="mercury")
         self.assertEqual(config.get_env_name(), 'mercury')
+
+    def test_get_env_config(self):
+        path = os.path.join(self.juju_home, 'environments.yaml')
+        with open(path, 'w') as fh:
+            fh.write(yaml.safe_dump({'environments': {
+                'moon': {'type': 'manual', 'bootstrap-host': None}}}))
+        config = self.get_config(environment='moon')
+        env_conf = config.get_env_config()
+        self.assertEqual(env_conf['type'], 'manual')
+
+        # Copies are returned so callers can modify them.
+        env_conf['bootstrap-host'] = '1.1.1.1'
+        self.assertEqual(config.get_env_config()['bootstrap-host'], None)
+
+        config = self.get_config(environment='mars')
+        self.assertRaises(ConfigError, config.get_env_config)
+
+    def test_get_catalog(self):
+        provider = object()
+        config = self.get_config(environment='moon')
+        catalog = config.get_catalog(provider)
+        self.assertIs(config.get_catalog(provider), catalog)
+        # Configs sharing a cache share the catalog.
+        shared = Config(FakeOptions(environment='sun'), config.cache)
+        self.assertIs(shared.get_catalog(provider), catalog)
+        self.assertIsNot(
+            self.get_config().get_catalog(provider), catalog)
+
+    def test_load_yaml_cached(self):
+        path = os.path.join(self.juju_home, 'environments.yaml')
+        with open(path, 'w') as fh:
+            fh.write(yaml.safe_dump({'default': 'moon'}))
+        data = load_yaml(path)
+        self.assertEqual(data, {'default': 'moon'})
+        self.assertIs(load_yaml(path), data)
+
+        # Modified files are reparsed.
+        with open(path, 'w') as fh:
+            fh.write(yaml.safe_dump({'default': 'mars'}))
+        os.utime(path, (0, 0))
+        self.assertEqual(load_yaml(path), {'default': 'mars'})
+
+    def test_get_apt_proxy(self):
+        with open(os.path.join(
+                self.juju_home, 'environments.yaml'), 'w') as fh:
+            fh.write(yaml.safe_dump({'environments': {'moon': {
+                'type': 'null', 'apt-http-proxy': 'http://10.1.0.9:3142'}}}))
+        config = self.get_config(environment='moon')
+        self.assertEqual(config.get_apt_proxy(), 'http://10.1.0.9:3142')
+
+        # Once bootstrapped, the environment's recorded config is used.
+        os.mkdir(os.path.join(self.juju_home, 'environments'))
+        with open(os.path.join(
+                self.juju_home, 'environments', 'moon.jenv'), 'w') as fh:
+            fh.write(yaml.safe_dump({'bootstrap-config': {
+                'type': 'null', 'apt-http-proxy': 'http://10.1.0.5:3142'}}))
+        self.assertEqual(config.get_apt_proxy(), 'http://10.1.0.5:3142')
@@ -1,6 +1,8 @@
 from base import Base
 
-from juju_slayer.constraints import solve_constraints
+from juju_slayer.constraints import (
+    fallback_params, solve_constraints, spread_datacenters)
+from juju_slayer.exceptions import ConstraintError
 
 
 class ConstraintTests(Base):
@@ -11,12 +13,29 @@ class ConstraintTests(Base):
 
         ("region=ams, root-disk=100G",
          {'datacenter': 'ams01', 'memory': 1024, 'cpus': 1, 'disks': [100]}),
+        ("root-disk=20G", {'memory': 1024, 'cpus': 1}),
+        ("root-disk=25G, disks=100G",
+         {'memory': 1024, 'cpus': 1, 'disks': [25, 100]}),
 
         ("region=dal, mem=24G",
          {'datacenter': 'dal05', 'cpus': 1, 'memory': 32768}),
 
         ("region=sea, mem=24G, arch=amd64",
          {'datacenter': 'sea01', 'cpus': 1, 'memory': 32768}),
+        ("nic-speed=1000, private-network-only=true, private-vlan=12",
+         {'cpus': 1, 'memory': 1024, 'nic_speed': 1000, 'private': True,
+          'private_vlan': 12}),
+        ("private-network-only=false, public-vlan=13",
+         {'cpus': 1, 'memory': 1024, 'public_vlan': 13}),
+        ("local-disk=true, dedicated=yes, disks=100G,300G, cpu-cores=2",
+         {'cpus': 2, 'memory': 1024, 'local_disk': True, 'dedicated': True,
+          'disks': [25, 100, 300]}),
+        ("root-disk=100G, disks=1T, local-disk=false, dedicated=false",
+         {'cpus': 1, 'memory': 1024, 'local_disk': False,
+          'disks': [100, 1024]}),
+        ("type=baremetal, cpu-cores=2, mem=2G",
+         {'cpus': 2, 'memory': 2048, 'type': 'baremetal'}),
+        ("type=virtual", {'cpus': 1, 'memory': 1024}),
         ("", {'cpus': 1, 'memory': 1024})]
 
     def test_constraint_solving(self):
@@ -24,3 +43,103 @@ class ConstraintTests(Base):
             self.assertEqual(
                 solve_constraints(constraints),
                 solution)
+
+    def test_region_list(self):
+        self.assertEqual(
+            solve_constraints("region=dal05|dal6|wdc"),
+            {'cpus': 1, 'memory': 1024,
+             'datacenters': [('dal05', 1), ('dal06', 1), ('wdc01', 1)]})
+        self.assertEqual(
+            solve_constraints("region=dal:3")['datacenters'],
+            [('dal05', 3)])
+        self.assertRaises(
+            ConstraintError, solve_constraints, "region=dal05|mars")
+        self.assertRaises(
+            ConstraintError, solve_constraints, "region=dal05:0|wdc01")
+
+    def test_fallback(self):
+        self.assertEqual(
+            solve_constraints("mem=2G, fallback=size|region")['fallback'],
+            ['size', 'region'])
+        for constraints in ("fallback=", "fallback=size|colour",
+                            "type=baremetal, fallback=region"):
+            self.assertRaises(
+                ConstraintError, solve_constraints, constraints)
+
+    def test_fallback_params(self):
+        params = {'cpus': 2, 'memory': 2048, 'datacenter': 'dal05',
+                  'hostname': 'softlayer-a'}
+        self.assertEqual(
+            fallback_params(params, ['region', 'size', 'disk'],
+                            ['dal05', 'dal06', 'wdc01']),
+            [dict(params, datacenter='dal06'),
+             dict(params, datacenter='wdc01'),
+             dict(params, memory=4096),
+             dict(params, cpus=4),
+             dict(params, local_disk=True)])
+        # Nothing bigger.
+        self.assertEqual(fallback_params(
+            dict(params, cpus=16, memory=65536), ['size']), [])
+
+    def test_constraint_errors(self):
+        for constraints in ("mem=2G, foo",
+                            "mem=2G, disks=100G, region=dal, 300G",
+                            "mem=lots",
+                            "mem=2X",
+                            "mem=128G",
+                            "root-disk=1T",
+                            "cpu-cores=many",
+                            "cpu-cores=3"):
+            self.assertRaises(
+                ConstraintError, solve_constraints, constraints)
+
+    def test_network_constraint_errors(self):
+        for constraints in ("nic-speed=50",
+                            "private-network-only=maybe",
+                            "private-vlan=abc",
+                            "private-network-only=true, public-vlan=1"):
+            self.assertRaises(
+                ConstraintError, solve_constraints, constraints)
+
+    def test_storage_constraint_errors(self):
+        for constraints in ("local-disk=maybe",
+                            "dedicated=1",
+                            "disks=",
+                            "disks=100M",
+                            "disks=abc",
+                            "100G, disks=100G",
+                            "type=metal",
+                            "type=baremetal, local-disk=true",
+                            "type=baremetal, disks=100G",
+                            "type=baremetal, private-network-only=true"):
+            self.assertRaises(
+                ConstraintError, solve_constraints, constraints)
+
+
+class SpreadTests(Base):
+
+    datacenters = [('dal05', 3), ('dal06', 1), ('wdc01', 2)]
+
+    def test_round_robin(self):
+        self.assertEqual(
+            spread_datacenters(self.datacenters, 5),
+            ['dal05', 'dal06', 'wdc01', 'dal05', 'dal06'])
+
+    def test_weighted(self):
+        plan = spread_datacenters(self.datacenters, 12, 'weighted')
+        self.assertEqual(plan.count('dal05'), 6)
+        self.assertEqual(plan.count('dal06'), 2)
+        self.assertEqual(plan.count('wdc01'), 4)
+        # Interleaved so each datacenter gets orders up front.
+        self.assertEqual(plan[:3], ['dal05', 'dal06', 'wdc01'])
+
+    def test_fill_first(self):
+        self.assertEqual(
+            sorted(spread_datacenters(self.datacenters, 4, 'fill-first')),
+            ['dal05', 'dal05', 'dal05', 'dal06'])
+        self.assertEqual(
+            len(spread_datacenters(self.datacenters, 8, 'fill-first')), 8)
+
+    def test_unknown_strategy(self):
+        self.assertRaises(
+            ConstraintError, spread_datacenters, self.datacenters, 2, 'x')
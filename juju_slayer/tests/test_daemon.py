@@ -0,0 +1,163 @@
+import argparse
+import json
+import logging
+import mock
+import os
+import socket
+import StringIO
+import threading
+import time
+
+from juju_slayer import commands, daemon, runner
+from juju_slayer.exceptions import ConfigError, PrecheckError
+from juju_slayer.tests.base import Base
+
+log = logging.getLogger("juju.slayer")
+
+
+class Command(commands.BaseCommand):
+
+    env_lock = None
+
+    def run(self):
+        keys = self.provider.get_ssh_keys()
+        log.debug("Listed keys")
+        print("%s %s" % (self.config.options.environment, " ".join(keys)))
+
+
+class Broken(Command):
+
+    def run(self):
+        raise ConfigError("No ssh keys")
+
+
+class Cached(Command):
+
+    def run(self):
+        print(id(self.config.get_catalog(self.provider)))
+
+
+class BlockingOp(object):
+
+    started = threading.Event()
+    release = threading.Event()
+    ran = []
+
+    def run(self):
+        self.started.set()
+        self.release.wait()
+        self.ran.append(self)
+
+
+class Slow(Command):
+
+    def run(self):
+        ops = runner.Runner(1)
+        ops.poll_interval = 0.01
+        ops.queue_op(BlockingOp())
+        ops.queue_op(BlockingOp())
+        list(ops.iter_results())
+
+
+class DaemonTest(Base):
+
+    def setUp(self):
+        self.change_environment(JUJU_HOME=self.mkdir())
+        self.path = os.path.join(self.mkdir(), 'daemon.sock')
+        self.provider = mock.Mock()
+        self.provider.get_ssh_keys.return_value = ['abc']
+        self.daemon = daemon.Daemon(self.path, self.provider)
+        self.daemon.bind()
+        thread = threading.Thread(target=self.daemon.serve)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.daemon.stop)
+        for name, cls in (('Command', Command), ('Broken', Broken),
+                          ('Cached', Cached), ('Slow', Slow)):
+            patcher = mock.patch.object(commands, name, cls, create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('juju_slayer.config.Config.validate')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def call(self, command, **options):
+        options.setdefault('environment', 'slayer')
+        options.setdefault('verbose', True)
+        # Client and daemon share the process here, so the client can't
+        # write to sys.stdout the daemon takes over.
+        stdout, stderr = StringIO.StringIO(), StringIO.StringIO()
+        status = daemon.call(
+            self.path, argparse.Namespace(command=command, **options),
+            stdout, stderr)
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def test_call(self):
+        status, stdout, stderr = self.call('Command')
+        self.assertEqual(status, 0)
+        self.assertEqual(stdout, "slayer abc\n")
+        self.assertIn("DEBUG Listed keys", stderr)
+
+        # The provider session is reused across commands.
+        status, stdout, stderr = self.call('Command', verbose=False)
+        self.assertEqual(stdout, "slayer abc\n")
+        self.assertNotIn("Listed keys", stderr)
+        self.assertEqual(self.provider.get_ssh_keys.call_count, 2)
+
+    def test_cache(self):
+        # The catalog is kept warm across commands.
+        status, first, stderr = self.call('Cached')
+        status, second, stderr = self.call('Cached')
+        self.assertEqual(first, second)
+
+    def test_client_gone(self):
+        self.addCleanup(runner.cancelled.clear)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        sock.sendall(json.dumps({'options': {
+            'command': 'Slow', 'environment': 'slayer',
+            'verbose': False}}) + "\n")
+        self.assertTrue(BlockingOp.started.wait(5))
+        sock.close()
+        for i in range(500):
+            if runner.cancelled.is_set():
+                break
+            time.sleep(0.01)
+        self.assertTrue(runner.cancelled.is_set())
+        # The running op finishes, the queued one is never started.
+        BlockingOp.release.set()
+        for i in range(500):
+            if BlockingOp.ran:
+                break
+            time.sleep(0.01)
+        time.sleep(0.05)
+        self.assertEqual(len(BlockingOp.ran), 1)
+        # The daemon goes on to serve other commands.
+        self.assertEqual(self.call('Command')[0], 0)
+        self.assertFalse(runner.cancelled.is_set())
+
+    def test_error(self):
+        status, stdout, stderr = self.call('Broken')
+        self.assertEqual(status, 1)
+        self.assertEqual(stdout, "Configuration error: No ssh keys\n")
+
+    def test_no_daemon(self):
+        self.daemon.stop()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(
+            daemon.call(self.path, argparse.Namespace()), None)
+
+    def test_stale_socket(self):
+        # A socket file nothing is listening on.
+        self.daemon.stop()
+        stale = daemon.Daemon(self.path, self.provider)
+        stale.bind()
+        stale.sock.close()
+        stale.sock = None
+        self.assertEqual(
+            daemon.call(self.path, argparse.Namespace()), None)
+        replacement = daemon.Daemon(self.path, self.provider)
+        replacement.bind()
+        self.addCleanup(replacement.stop)
+        self.assertRaises(PrecheckError, daemon.Daemon(
+            self.path, self.provider).bind)
@@ -3,6 +3,7 @@ import mock
 import os
 import yaml
 
+from juju_slayer.config import Config
 from juju_slayer.env import Environment
 
 from juju_slayer.tests.base import Base
@@ -11,15 +12,13 @@ from juju_slayer.tests.base import Base
 class EnvironmentTest(Base):
 
     def setUp(self):
-        self.config = mock.MagicMock()
+        self.config = Config(
+            mock.Mock(environment="slayer", upload_tools=True))
 
     @mock.patch('subprocess.check_output')
     def test_bootstrap_jenv(self, run_juju):
-        # Setup some mocks
-        self.config.get_env_name.return_value = "slayer"
-        self.config.juju_home = juju_home = self.mkdir()
-        self.config.get_env_conf.return_value = os.path.join(
-            juju_home, "environments.yaml")
+        juju_home = self.mkdir()
+        self.change_environment(JUJU_HOME=juju_home)
         # Setup juju home structure
         os.mkdir(os.path.join(juju_home, "environments"))
         os.mkdir(os.path.join(juju_home, "ssh"))
@@ -46,7 +45,9 @@ class EnvironmentTest(Base):
             self.assertEqual(
                 cmd, ['juju', 'bootstrap', '--debug', '--upload-tools'])
             self.assertTrue(env['JUJU_HOME'].startswith(juju_home))
-            self.assertTrue(env['JUJU_HOME'].endswith('boot-slayer'))
+            # Scratch homes are private to each invocation.
+            self.assertTrue(os.path.basename(
+                env['JUJU_HOME']).startswith('boot-slayer-'))
             with open(os.path.join(env['JUJU_HOME'],
                                    'environments.yaml')) as fh:
                 data = yaml.safe_load(fh.read())
@@ -65,4 +66,8 @@ class EnvironmentTest(Base):
         self.env = Environment(self.config)
         self.env.bootstrap_jenv('1.1.1.1')
 
-        self.assertNotIn('boot-slayer', os.listdir(juju_home))
+        self.assertEqual(
+            [p for p in os.listdir(juju_home) if p.startswith('boot-')], [])
+        self.assertEqual(
+            os.listdir(os.path.join(juju_home, 'environments')),
+            ['slayer.jenv'])
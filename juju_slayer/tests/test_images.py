@@ -0,0 +1,48 @@
+import os
+
+from juju_slayer.images import ImageRegistry
+from juju_slayer.provider import Image
+from juju_slayer.tests.base import Base
+
+
+class ImageRegistryTest(Base):
+
+    def setUp(self):
+        self.registry = ImageRegistry(
+            os.path.join(self.mkdir(), 'slayer', 'images.yaml'))
+
+    def test_record_get(self):
+        self.assertEqual(self.registry.get('precise', 'dal05'), None)
+        self.registry.record('precise', 'dal05', Image(
+            id=1, globalIdentifier='a', name='juju-precise-dal05'))
+        self.registry.record('precise', 'wdc01', Image(
+            id=2, globalIdentifier='b', name='juju-precise-wdc01'))
+        self.assertEqual(
+            self.registry.get('precise', 'dal05')['globalIdentifier'], 'a')
+        self.assertEqual(self.registry.get('precise', 'sjc01'), None)
+        self.assertEqual(self.registry.get('trusty', 'dal05'), None)
+
+    def test_prune(self):
+        self.registry.record('precise', 'dal05', Image(
+            id=1, globalIdentifier='a', name='juju-precise-dal05'))
+        self.registry.record('trusty', 'dal05', Image(
+            id=2, globalIdentifier='b', name='juju-trusty-dal05'))
+        removed = self.registry.prune(set(['a']))
+        self.assertEqual([i['name'] for i in removed], ['juju-trusty-dal05'])
+        self.assertEqual(self.registry.load().keys(), ['precise'])
+
+    def test_superseded(self):
+        for n, name in enumerate('abc'):
+            self.registry.record('precise', 'dal05', Image(
+                id=n, globalIdentifier=name, name='juju-precise-dal05-%d' % n))
+        self.assertEqual(
+            self.registry.get('precise', 'dal05')['globalIdentifier'], 'c')
+        self.assertEqual(
+            [(s, d, i['globalIdentifier'])
+             for s, d, i in self.registry.superseded()],
+            [('precise', 'dal05', 'a'), ('precise', 'dal05', 'b')])
+        # Deleted superseded images are forgotten.
+        self.registry.prune(set(['b', 'c']))
+        self.assertEqual(
+            [i['globalIdentifier'] for _, _, i in self.registry.superseded()],
+            ['b'])
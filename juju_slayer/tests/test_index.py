@@ -0,0 +1,52 @@
+from juju_slayer.index import MachineIndex
+from juju_slayer.provider import Instance
+from juju_slayer.tests.base import Base
+
+
+def instance(id, ip, tags=(), **kw):
+    kw.setdefault('provisionDate', '2014-04-01')
+    return Instance(dict(
+        id=id, hostname="slayer-%s" % id, primaryIpAddress=ip,
+        tagReferences=[{'tag': {'name': t}} for t in tags], **kw))
+
+
+class MachineIndexTest(Base):
+
+    def test_join(self):
+        status = {'machines': {
+            '0': {'dns-name': '10.0.0.1'},
+            '1': {'dns-name': '10.0.0.99'},
+            '2': {'dns-name': '10.0.0.98'},
+            '3': {'dns-name': '10.0.0.97', 'life': 'dead'}}}
+        instances = [
+            instance(10, '10.0.0.1'),
+            instance(11, '10.0.0.2'),
+            instance(12, '10.0.0.3', tags=['juju-machine-2']),
+            instance(13, '10.0.0.4'),
+            instance(14, '10.0.0.5', activeTransaction={'id': 1}),
+            instance(15, '10.0.0.6')]
+        index = MachineIndex(status, instances, {'1': 11}, pending=[15])
+        self.assertEqual(
+            dict((m, i.id) for m, i in index.instance_of.items()),
+            {'0': 10, '1': 11, '2': 12})
+        self.assertEqual(index.unmatched(), ['3'])
+        self.assertEqual(index.dead(), ['3'])
+        self.assertEqual([i.id for i in index.orphans()], [13])
+        self.assertEqual([i.id for i in index.provisioning()], [14, 15])
+
+
+class InstanceTest(Base):
+
+    def test_created(self):
+        self.assertEqual(
+            instance(1, '10.0.0.1', createDate='2014-04-01T09:23:13-06:00',
+                     ).created, 1396365793)
+        self.assertEqual(
+            instance(1, '10.0.0.1', createDate='2014-04-01T15:23:13Z',
+                     ).created, 1396365793)
+        # Bare metal only has its provision date.
+        self.assertEqual(instance(
+            1, '10.0.0.1', provisionDate='2014-04-01T15:23:13+00:00').created,
+            1396365793)
+        self.assertEqual(instance(1, '10.0.0.1', provisionDate='').created,
+                         None)
@@ -0,0 +1,76 @@
+import os
+
+from juju_slayer.journal import Journal
+from juju_slayer.tests.base import Base
+
+
+class JournalTest(Base):
+
+    def setUp(self):
+        self.path = os.path.join(self.mkdir(), 'slayer', 'env.journal')
+        self.journal = Journal(self.path)
+
+    def test_load_empty(self):
+        self.assertEqual(self.journal.load(), {})
+        self.assertEqual(self.journal.pending(), [])
+
+    def test_record_and_load(self):
+        self.journal.record('a', 'queued', params={'cpus': 1})
+        self.journal.record('a', 'ordered', instance_id=21)
+        self.journal.record('b', 'queued', params={'cpus': 2})
+        ops = self.journal.load()
+        self.assertEqual(ops['a']['steps'], ['queued', 'ordered'])
+        self.assertEqual(ops['a']['instance_id'], 21)
+        self.assertEqual(ops['a']['params'], {'cpus': 1})
+        self.assertEqual(
+            [s['op'] for s in self.journal.pending()], ['a', 'b'])
+
+        self.journal.record('a', 'registered', machine_id='1')
+        self.assertEqual(
+            [s['op'] for s in self.journal.pending()], ['b'])
+
+    def test_partial_entry(self):
+        self.journal.record('a', 'queued', params={})
+        with open(self.path, 'a') as fh:
+            fh.write('{"op": "a", "step": "ord')
+        self.assertEqual(self.journal.load()['a']['steps'], ['queued'])
+        self.journal.record('a', 'ordered', instance_id=21)
+        self.assertEqual(
+            self.journal.load()['a']['steps'], ['queued', 'ordered'])
+
+    def test_claim(self):
+        self.journal.record('a', 'queued', run='live')
+        self.journal.record('b', 'queued', run='dead')
+        self.journal.record('c', 'queued')
+        alive = lambda run_id: run_id in ('live', 'resumer')
+        self.assertEqual(
+            [s['op'] for s in self.journal.claim('resumer', alive)],
+            ['b', 'c'])
+        self.assertEqual(self.journal.load()['b']['run'], 'resumer')
+        # Claimed ops belong to the live resumer now.
+        self.assertEqual(self.journal.claim('other', alive), [])
+
+    def test_abandoned(self):
+        self.journal.record('a', 'queued', params={})
+        self.journal.record('a', 'ordered', instance_id=21)
+        self.journal.record('b', 'queued', params={})
+        self.journal.record('a', 'abandoned', instance_id=21)
+        self.assertEqual([s['op'] for s in self.journal.pending()], ['b'])
+
+    def test_failed(self):
+        self.journal.record('a', 'queued', params={})
+        self.journal.record('b', 'queued', params={})
+        self.journal.record('a', 'failed', error="Order refused")
+        self.assertEqual([s['op'] for s in self.journal.pending()], ['b'])
+        self.assertEqual(
+            self.journal.claim('run-2', lambda run: False)[0]['op'], 'b')
+
+    def test_replaced(self):
+        self.journal.record('a', 'queued', params={})
+        self.journal.record('a', 'ordered', instance_id=21)
+        self.journal.record('a', 'prepared', address='10.0.0.1')
+        self.journal.record('a', 'replaced', rejected=21)
+        state = self.journal.load()['a']
+        self.assertEqual(state['steps'], ['queued', 'replaced'])
+        self.assertNotIn('instance_id', state)
+        self.assertEqual(state['rejected'], 21)
@@ -0,0 +1,49 @@
+import os
+
+from juju_slayer.lock import FileLock, RunRegistry
+from juju_slayer.tests.base import Base
+
+
+class FileLockTest(Base):
+
+    def setUp(self):
+        self.path = os.path.join(self.mkdir(), 'slayer', 'env.lock')
+
+    def test_exclusive(self):
+        with FileLock(self.path):
+            self.assertFalse(FileLock(self.path).acquire(blocking=False))
+            self.assertFalse(
+                FileLock(self.path, shared=True).acquire(blocking=False))
+        lock = FileLock(self.path)
+        self.assertTrue(lock.acquire(blocking=False))
+        lock.release()
+
+    def test_shared(self):
+        with FileLock(self.path, shared=True):
+            other = FileLock(self.path, shared=True)
+            self.assertTrue(other.acquire(blocking=False))
+            self.assertFalse(FileLock(self.path).acquire(blocking=False))
+            other.release()
+
+
+class RunRegistryTest(Base):
+
+    def setUp(self):
+        self.path = os.path.join(self.mkdir(), 'runs')
+
+    def test_alive(self):
+        runs = RunRegistry(self.path)
+        runs.start('abc')
+        # As seen from another invocation.
+        other = RunRegistry(self.path)
+        self.assertTrue(other.alive('abc'))
+        self.assertFalse(other.alive('def'))
+        runs.stop('abc')
+        self.assertFalse(other.alive('abc'))
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_dead_run_removed(self):
+        os.makedirs(self.path)
+        open(os.path.join(self.path, 'abc.lock'), 'w').close()
+        self.assertFalse(RunRegistry(self.path).alive('abc'))
+        self.assertEqual(os.listdir(self.path), [])
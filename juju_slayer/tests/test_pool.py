@@ -0,0 +1,64 @@
+import mock
+import os
+import time
+
+from juju_slayer.pool import InstancePool
+from juju_slayer.tests.base import Base
+
+
+class InstancePoolTest(Base):
+
+    def setUp(self):
+        self.pool = InstancePool(
+            os.path.join(self.mkdir(), 'slayer', 'env.pool'))
+
+    def test_park_claim(self):
+        self.assertEqual(self.pool.claim(1, 1024), None)
+        self.pool.park(1, 1, 1024, 'dal05')
+        self.pool.park(2, 2, 2048, 'wdc01')
+        self.assertEqual(self.pool.claim(1, 1024, 'wdc01'), None)
+        self.assertEqual(self.pool.claim(2, 2048), 2)
+        self.assertEqual(self.pool.claim(2, 2048), None)
+        self.assertEqual([e['id'] for e in self.pool.entries()], [1])
+
+    def test_remove(self):
+        self.pool.park(1, 1, 1024, 'dal05')
+        self.pool.park(2, 1, 1024, 'dal05')
+        self.pool.remove([1])
+        self.assertEqual([e['id'] for e in self.pool.entries()], [2])
+
+    def test_claim_storage_and_host(self):
+        self.pool.park(1, 1, 1024, 'dal05', local_disk=True)
+        self.pool.park(2, 1, 1024, 'dal05', dedicated=True)
+        self.assertEqual(self.pool.claim(1, 1024), None)
+        self.assertEqual(self.pool.claim(1, 1024, dedicated=True), 2)
+        self.assertEqual(self.pool.claim(1, 1024, local_disk=True), 1)
+
+    def test_claim_os_and_network(self):
+        self.pool.park(1, 1, 1024, 'dal05', os_code='UBUNTU_12_64',
+                       nic_speed=100, private_vlan=5)
+        self.pool.park(2, 1, 1024, 'dal05', os_code='UBUNTU_12_64',
+                       nic_speed=100, private=True)
+        self.assertEqual(self.pool.claim(1, 1024), None)
+        self.assertEqual(self.pool.claim(
+            1, 1024, os_code='UBUNTU_14_64', nic_speed=100), None)
+        self.assertEqual(self.pool.claim(
+            1, 1024, os_code='UBUNTU_12_64', nic_speed=1000), None)
+        self.assertEqual(self.pool.claim(
+            1, 1024, os_code='UBUNTU_12_64', nic_speed=100,
+            private_vlan=6), None)
+        self.assertEqual(self.pool.claim(
+            1, 1024, os_code='UBUNTU_12_64', nic_speed=100, private=True), 2)
+        # Unpinned orders take any vlan.
+        self.assertEqual(self.pool.claim(
+            1, 1024, os_code='UBUNTU_12_64', nic_speed=100), 1)
+
+    def test_expired(self):
+        self.pool.park(1, 1, 1024, 'dal05')
+        self.pool.park(2, 1, 1024, 'dal05')
+        with mock.patch('time.time', return_value=time.time() + 7200):
+            self.pool.park(2, 1, 1024, 'dal05')
+            self.pool.max_age = 3600
+            self.assertEqual(self.pool.expired(), [1])
+            self.assertEqual(self.pool.claim(1, 1024), 2)
+            self.assertEqual(self.pool.claim(1, 1024), None)
@@ -0,0 +1,42 @@
+import mock
+import subprocess
+
+from juju_slayer.exceptions import ConfigError
+from juju_slayer import qualify
+from juju_slayer.tests.base import Base
+
+
+class QualifyTest(Base):
+
+    def test_parse_thresholds(self):
+        self.assertEqual(
+            qualify.parse_thresholds("cpu=200, disk=50,steal=5"),
+            {'cpu': 200.0, 'disk': 50.0, 'steal': 5.0})
+        self.assertRaises(ConfigError, qualify.parse_thresholds, "gpu=1")
+        self.assertRaises(ConfigError, qualify.parse_thresholds, "cpu")
+        self.assertRaises(ConfigError, qualify.parse_thresholds, "cpu=fast")
+
+    @mock.patch('juju_slayer.qualify.ssh')
+    def test_benchmark(self, mock_ssh):
+        mock_ssh.execute.return_value = (
+            0, "cpu 412.5\nsteal 1.2\ndisk 96.0\nnetwork \n")
+        self.assertEqual(
+            qualify.benchmark('10.0.0.1'),
+            {'cpu': 412.5, 'steal': 1.2, 'disk': 96.0})
+        host, command = mock_ssh.execute.call_args[0]
+        self.assertEqual(host, '10.0.0.1')
+        self.assertTrue(command.startswith(
+            "timeout %d sh -c " % qualify.TIMEOUT))
+
+        # Timed out.
+        mock_ssh.execute.return_value = (124, "cpu 412.5\n")
+        self.assertRaises(
+            subprocess.CalledProcessError, qualify.benchmark, '10.0.0.1')
+
+    def test_check(self):
+        results = {'cpu': 412.5, 'steal': 12.0, 'disk': 50.0}
+        self.assertEqual(qualify.check(results, {'cpu': 200}), [])
+        self.assertEqual(
+            qualify.check(results, {
+                'cpu': 500, 'disk': 50, 'steal': 5, 'network': 10}),
+            ['cpu 412.5 < 500', 'network no result', 'steal 12.0 > 5'])
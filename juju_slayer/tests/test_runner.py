@@ -1,5 +1,8 @@
 
-from juju_slayer.runner import Runner
+import threading
+
+from juju_slayer import runner as runner_module
+from juju_slayer.runner import Cancelled, Runner
 from base import Base
 
 
@@ -34,3 +37,29 @@ class RunnerTest(Base):
         results = list(runner.iter_results())
         self.assertEqual(len(results), 2)
         runner.stop()
+
+    def test_cancelled(self):
+        self.addCleanup(runner_module.cancelled.clear)
+        started, release = threading.Event(), threading.Event()
+        ran = []
+
+        class BlockingOp(object):
+            def run(self):
+                started.set()
+                release.wait()
+                ran.append(self)
+
+        runner = Runner(1)
+        runner.poll_interval = 0.01
+        runner.queue_op(BlockingOp())
+        runner.queue_op(BlockingOp())
+        results = runner.iter_results()
+        timer = threading.Timer(0.05, runner_module.cancelled.set)
+        timer.start()
+        self.assertRaises(Cancelled, list, results)
+        timer.join()
+        self.assertTrue(started.is_set())
+        # The running op finishes, the queued one isn't started.
+        release.set()
+        runner.runners[0].join()
+        self.assertEqual(len(ran), 1)
@@ -0,0 +1,90 @@
+import BaseHTTPServer
+import SocketServer
+import threading
+import xmlrpclib
+
+import mock
+from SoftLayer import API
+from SoftLayer.exceptions import SoftLayerAPIError, MethodNotFound
+
+from juju_slayer.transport import Transport, TransportClient
+from juju_slayer.tests.base import Base
+
+
+class XMLRPCHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        params, method = xmlrpclib.loads(body)
+        self.server.requests.append((self.path, method, params))
+        if method == 'getObject':
+            response = xmlrpclib.dumps(({'id': 1},), methodresponse=True)
+        elif method == 'missing':
+            response = xmlrpclib.dumps(xmlrpclib.Fault('-32601', 'Missing'))
+        else:
+            response = xmlrpclib.dumps(xmlrpclib.Fault('SoftLayer', 'Bad'))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+class TransportTest(Base):
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), XMLRPCHandler)
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.shutdown)
+        self.uri = "http://127.0.0.1:%d/SoftLayer_Account" % (
+            self.server.server_port)
+        self.transport = Transport(connect_timeout=2, read_timeout=5)
+        self.addCleanup(self.transport.close)
+
+    def test_keep_alive(self):
+        for i in range(3):
+            self.assertEqual(
+                self.transport.call(self.uri, 'getObject'), {'id': 1})
+        self.assertEqual(self.transport.stats(), (3, 1))
+
+    def test_session_per_thread(self):
+        self.transport.call(self.uri, 'getObject')
+        thread = threading.Thread(
+            target=self.transport.call, args=(self.uri, 'getObject'))
+        thread.start()
+        thread.join()
+        self.assertEqual(len(self.transport.sessions), 2)
+        self.assertEqual(self.transport.stats(), (2, 2))
+
+    def test_faults(self):
+        self.assertRaises(
+            MethodNotFound, self.transport.call, self.uri, 'missing')
+        self.assertRaises(
+            SoftLayerAPIError, self.transport.call, self.uri, 'bad')
+
+    def test_client(self):
+        client = TransportClient(
+            self.transport, auth=None,
+            endpoint_url="http://127.0.0.1:%d" % self.server.server_port)
+        with mock.patch.object(API, 'make_xml_rpc_api_call') as api_call:
+            self.assertEqual(
+                client['Account'].getObject(id=5, mask="id"), {'id': 1})
+        self.assertFalse(api_call.called)
+        [(path, method, params)] = self.server.requests
+        self.assertEqual((path, method), ('/SoftLayer_Account', 'getObject'))
+        self.assertEqual(
+            params[0]['headers']['SoftLayer_AccountInitParameters'],
+            {'id': 5})
+        self.assertEqual(self.transport.stats(), (1, 1))